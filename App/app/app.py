@@ -3,32 +3,62 @@ import os
 import babel
 import dateutil.parser
 from flask import Flask, request, abort, jsonify, redirect, flash
-from flask import url_for, render_template
+from flask import url_for, render_template, send_file
 from flask import session
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .database.models import *
+from .database import archive, batch, catalog, changes, ingest, lookups
+from .search import search, autocomplete
+from .barcode import barcodes
+from .restock import restock
 from .auth.auth import AuthError, requires_auth
 from datetime import datetime, date
 import json
 import logging
 from six.moves.urllib.parse import urlencode
-from google.cloud import vision
-import io
+from .ocr.pages import read_pages, split_pages, TooManyPages
+from .ocr import admission, receipts
+from .profiling import profiler
+from .storage import storage
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from .forms import *
 import sys
+import time
 
 
 
-def create_app(test_config=None):
+# Stored blobs are immutable, their URL changes with their content.
+BLOB_MAX_AGE = 365 * 24 * 3600
+# Load balancers in front of the app. Their X-Forwarded-For is trusted
+# for request.remote_addr, which keys the /upload quota, only when set.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+
+def _number_or_string(value):
+    # Optional scalar JSON fields, None when absent.
+    return value is None or isinstance(value, str) or (
+        isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def create_app(test_config=None, database_path=None):
     
     app = Flask(__name__)
-    setup_db(app)
+    setup_db(app, database_path=database_path)
     CORS(app)
     #app.secret_key = os.environ['SECRET']
     #os.environ["GOOGLE_APPLICATION_CREDENTIALS"]=r"C:\Users\shahd\OneDrive\Desktop\MediDate Application\MediDate_Credentials\steel-aileron-266916-d88c69f449c7.json"
-    UPLOAD_FOLDER = '/home/Jared/Desktop/Hackathon/enactusHacks/App/app/static/img/Receipts/'
+    # Receipt images, content addressed, see storage.storage.
+    blob_store = storage.store()
+    # Lets nginx or Apache send stored receipt files, ranges included.
+    app.use_x_sendfile = os.environ.get('USE_X_SENDFILE') == '1'
+    # None unless PROFILE_DIR and PROFILE_SECRET or PROFILE_SAMPLE_RATE
+    # are set, see profiling.profiler.
+    request_profiler = profiler.install(app)
+    if TRUSTED_PROXIES:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
     #----------------------------------------------------------------------------#
     # Functions.
     #----------------------------------------------------------------------------#
@@ -45,42 +75,6 @@ def create_app(test_config=None):
 
 
 
-    def detect_text(path):
-        """Detects text in the receipt file."""
-    
-        client = vision.ImageAnnotatorClient()
-
-        with io.open(path, 'rb') as image_file:
-            content = image_file.read()
-
-        image = vision.types.Image(content=content)
-
-        response = client.text_detection(image=image)
-        texts = response.text_annotations
-        d = {"Name": 0, "Fill Date": 0, "RX": 0, "Qty": 90, "date-to-take": 0, "Red": 0, "Blue": 0,"Green": 0}
-        count = 0
-        for text in texts:
-            if(text.description == "Rx" or text.description == "Rx#" or text.description == "#" or text.description == "Rx:" or text.description == "Rx:#" or text.description == "Rx: #" or text.description == ":"):
-                count = 1
-                continue
-            if(text.description[0:2] == "Qty"):
-                d["Qty"] = text.description[3:len(text.description)-1]
-                
-            if(count == 1):
-                d["RX"] = text.description
-                count = 0
-            vertices = (['({},{})'.format(vertex.x, vertex.y)
-                        for vertex in text.bounding_poly.vertices])
-
-            print('bounds: {}'.format(','.join(vertices)))
-        return d
-
-        if response.error.message:
-            raise Exception(
-                '{}\nFor more info on error messages, check: '
-                'https://cloud.google.com/apis/design/errors'.format(
-                    response.error.message))
-   
     #----------------------------------------------------------------------------#
     # Endpoints.
     #----------------------------------------------------------------------------#
@@ -103,20 +97,298 @@ def create_app(test_config=None):
     def home():
         return render_template('pages/home.html')
 
+    """POST /upload
+      Saves an uploaded receipt, one or more images or a PDF, and reads
+      its line items. The form has no signed in user, so the OCR quota
+      is per client address: the peer, or the address forwarded by
+      TRUSTED_PROXIES load balancers when it is set.
+
+      Returns:
+          web page
+    """
+    @app.route('/upload', methods=['GET', 'POST'])
     def upload_predict():
         if request.method == "POST":
-            image_file = request.files["image"]
-            if image_file:
-                image_location = os.path.join(
-                    UPLOAD_FOLDER,
-                    image_file.filename
-                )
-                image_file.save(image_location)
-                pred = detect_text
-                return render_template("pages/home.html", prediction=pred, image_name=image_file.filename)
+            # Several photos of one long receipt, or a multi-page PDF.
+            image_files = [f for f in request.files.getlist("image") if f]
+            if image_files:
+                contents = [image_file.read() for image_file in image_files]
+                try:
+                    with admission.admit(request.remote_addr):
+                        text = read_pages(split_pages(contents))
+                except TooManyPages:
+                    abort(400)
+                # Stored once read, so rejected and unreadable uploads
+                # leave nothing behind, and by content, so the same
+                # receipt uploaded twice is kept once.
+                keys = [blob_store.put(content) for content in contents]
+                pred = receipts.parse_line_items(text)
+                return render_template("pages/home.html", prediction=pred, image_name=keys[0])
         return render_template("pages/home.html", prediction=0, image_name=None)
 
 
+    def send_blob(key):
+        path = blob_store.local_path(key)
+        if path is not None:
+            with open(path, 'rb') as handle:
+                mimetype = storage.content_type(handle.read(16))
+            # Range and If-None-Match are answered by send_file, or by
+            # the web server under USE_X_SENDFILE.
+            return send_file(path, mimetype=mimetype, conditional=True,
+                             cache_timeout=BLOB_MAX_AGE)
+        data = blob_store.get(key)
+        response = app.response_class(
+            data, mimetype=storage.content_type(data[:16]))
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = BLOB_MAX_AGE
+        return response.make_conditional(request, accept_ranges=True,
+                                         complete_length=len(data))
+
+    """GET /receipts/<key>
+      Gets a stored receipt image or PDF, blobs never change so they are
+      cached for a year
+
+      Inputs:
+          string "key" -- content hash returned when it was stored
+
+      Returns:
+          the file, 206 for a Range request
+    """
+    @app.route('/receipts/<key>', methods=['GET'])
+    def get_receipt_image(key):
+        if not storage.is_key(key):
+            abort(404)
+        try:
+            return send_blob(key)
+        except storage.BlobNotFound:
+            abort(404)
+
+    """GET /receipts/<key>/thumbnail
+      Gets a JPEG thumbnail of a stored receipt, made on the first request
+      and stored alongside it
+
+      Inputs:
+          string "key" -- content hash of the receipt
+          int "size" -- longest side, 128, 256 (default) or 512
+
+      Returns:
+          the thumbnail
+    """
+    @app.route('/receipts/<key>/thumbnail', methods=['GET'])
+    def get_receipt_thumbnail(key):
+        size = request.args.get('size', storage.DEFAULT_THUMBNAIL_SIZE,
+                                type=int)
+        if not storage.is_key(key) or '-' in key:
+            abort(404)
+        try:
+            return send_blob(storage.thumbnail(blob_store, key, size))
+        except storage.BlobNotFound:
+            abort(404)
+        except ValueError:
+            abort(400)
+        except Exception:
+            # Not an image Pillow can read.
+            print(sys.exc_info())
+            abort(422)
+
+
+    """POST /api/users/<int:user_id>/receipts
+      Adds the items on a receipt to a user's inventory
+
+      Inputs:
+          int "user_id"
+          multipart "image" of the receipt, repeated for a receipt
+          photographed in parts or a multi-page PDF, or
+          JSON {"items": [{"name": str, "quantity": int or str,
+                           "weight": str}],
+                "receipt_hash": str, "date_purchased": int}
+
+      Returns:
+          JSON Object -- product ids per item and stage timings. Sending
+          the same receipt again returns the first result unchanged.
+          400 when a JSON field has the wrong type. 429 or 503 with
+          Retry-After when OCR is over capacity.
+    """
+    @app.route('/api/users/<int:user_id>/receipts', methods=['POST'])
+    #@requires_auth('post:receipt')
+    def ingest_receipt(user_id):
+
+        started = time.perf_counter()
+        timings = {}
+        date_purchased = None
+        image_files = [f for f in request.files.getlist('image') if f]
+
+        if image_files:
+            contents = [image_file.read() for image_file in image_files]
+            receipt_hash = receipts.receipt_hash(contents)
+            replay = ingest.existing_receipt(user_id, receipt_hash)
+            if replay is not None:
+                replay['timings'] = {'end_to_end_ms': round(
+                    (time.perf_counter() - started) * 1000, 3)}
+                return jsonify(dict(replay, success=True))
+            try:
+                with admission.admit(user_id):
+                    text = read_pages(split_pages(contents))
+            except TooManyPages:
+                abort(400)
+            except admission.Rejected:
+                raise
+            except Exception:
+                print(sys.exc_info())
+                abort(422)
+            timings['ocr_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            items = receipts.parse_line_items(text)
+        else:
+            body = request.get_json(silent=True) or {}
+            items = body.get('items')
+            if not isinstance(items, list) or not all(
+                    isinstance(item, dict) and isinstance(item.get('name'), str)
+                    and _number_or_string(item.get('quantity'))
+                    for item in items):
+                abort(400)
+            receipt_hash = body.get('receipt_hash') or receipts.receipt_hash(items)
+            date_purchased = body.get('date_purchased')
+            if not _number_or_string(date_purchased):
+                abort(400)
+            if isinstance(date_purchased, str):
+                try:
+                    date_purchased = int(date_purchased)
+                except ValueError:
+                    abort(400)
+
+        try:
+            result = ingest.ingest_receipt(user_id, receipt_hash, items,
+                                           date_purchased)
+        except ingest.UnknownUser:
+            abort(404)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        result['timings'].update(timings)
+        result['timings']['end_to_end_ms'] = round(
+            (time.perf_counter() - started) * 1000, 3)
+        result['items'] = items
+
+        return jsonify(dict(result, success=True)), \
+            200 if result['replayed'] else 201
+
+    """GET /api/users/<int:user_id>/changes
+      Inventory changes since a cursor, for clients that keep a local copy
+
+      Inputs:
+          int "user_id"
+          int "since" -- cursor from the previous response, omitted for a
+          full snapshot
+          int "limit" -- changes per page, default 500
+
+      Returns:
+          JSON Object -- next "cursor", "more" if another page follows,
+          "upserts" as rows of "fields" values and "deletes" as product
+          ids. 410 when the cursor is too old, start over without one.
+    """
+    @app.route('/api/users/<int:user_id>/changes', methods=['GET'])
+    #@requires_auth('get:changes')
+    def get_changes(user_id):
+
+        since = request.args.get('since', type=int)
+        limit = request.args.get('limit', changes.DEFAULT_LIMIT, type=int)
+        if (since is not None and since < 0) or limit < 1:
+            abort(400)
+
+        if lookups.get_user(user_id, cached=True) is None:
+            abort(404)
+
+        try:
+            if since is None:
+                result = changes.snapshot(user_id)
+            else:
+                result = changes.changes_since(user_id, since, limit)
+        except changes.CursorExpired:
+            abort(410)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify(dict(result, success=True))
+
+    """GET /api/users/<int:user_id>/restock
+      Items the user is expected to run out of soon, from the latest
+      restock prediction run
+
+      Inputs:
+          int "user_id"
+          int "within" -- days ahead to look, default 7
+
+      Returns:
+          JSON Object -- predictions soonest first, each with the catalog
+          item, its name and the expected runout time in epoch seconds
+    """
+    @app.route('/api/users/<int:user_id>/restock', methods=['GET'])
+    #@requires_auth('get:restock')
+    def get_restock(user_id):
+
+        within = request.args.get('within', 7, type=int)
+        if within < 0:
+            abort(400)
+
+        if lookups.get_user(user_id, cached=True) is None:
+            abort(404)
+
+        try:
+            predictions = restock.predictions_for(db.session, user_id, within)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'predictions': predictions
+        })
+
+    """GET /api/users/<int:user_id>/history
+      Gets a user's purchase history across current and archived
+      products, see database.archive
+
+      Inputs:
+          int "user_id"
+          int "limit" -- products per page, default 100, at most 1000
+          string "before" -- "next" of the previous page
+
+      Returns:
+          JSON Object -- products most recently purchased first, each with
+          an "archived" flag, and "next", the cursor of the following
+          page or null on the last one
+    """
+    @app.route('/api/users/<int:user_id>/history', methods=['GET'])
+    #@requires_auth('get:products')
+    def get_history(user_id):
+
+        limit = request.args.get('limit', archive.DEFAULT_LIMIT, type=int)
+        if not 0 < limit <= archive.MAX_LIMIT:
+            abort(400)
+        before = request.args.get('before')
+        try:
+            before = before and archive.parse_cursor(before)
+        except ValueError:
+            abort(400)
+
+        if lookups.get_user(user_id, cached=True) is None:
+            abort(404)
+
+        try:
+            products, cursor = archive.history(user_id, limit, before)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'products': products,
+            'next': archive.format_cursor(cursor)
+        })
+
     """GET /products
       Gets all products in the database
 
@@ -146,26 +418,114 @@ def create_app(test_config=None):
         return render_template('pages/users.html', users=data)
 
 
-    """POST /users/search
-      Searches for search term in users
+    """GET, POST /products/search
+      Searches for search term in product names
+
+      Inputs:
+          GET "q" query parameter, or POST form field "search_term"
 
       Returns:
-          JSON Object -- json of movie added if the entry is successful
+          JSON Object -- matching products for GET, web page for POST
+    """
+    @app.route('/products/search', methods=['GET', 'POST'])
+    def search_products():
+
+        if request.method == 'POST':
+            search_term = request.form.get('search_term', '')
+        else:
+            search_term = request.args.get('q', '')
+        products = search.search_products(search_term)
+
+        if request.method == 'GET':
+            return jsonify({
+                'success': True,
+                'count': len(products),
+                'products': [product.format() for product in products]
+            })
+
+        response={
+            "count":len(products),
+            "data": products
+        }
+
+        return render_template('pages/search_products.html', results=response, search_term=search_term)
+
+    """GET /api/products/autocomplete
+      Suggests product names starting with the typed text
+
+      Inputs:
+          "q" query parameter, optional "limit"
+
+      Returns:
+          JSON Object -- names ordered by how often they were entered
     """
+    @app.route('/api/products/autocomplete', methods=['GET'])
+    def autocomplete_products():
+
+        limit = request.args.get('limit', autocomplete.DEFAULT_LIMIT, type=int)
+        if limit < 1:
+            abort(400)
+
+        return jsonify({
+            'success': True,
+            'suggestions': autocomplete.suggest(request.args.get('q', ''), limit)
+        })
+
+    """GET /api/barcode/<upc>
+      Looks a scanned barcode up in the offline catalog, to prefill the
+      new product form
+
+      Inputs:
+          string "upc" -- UPC-A, EAN-13, EAN-8 or GTIN-14
+
+      Returns:
+          JSON Object -- the barcode as GTIN-14 with the product's name,
+          weight and quantity. 400 for an invalid code, 404 when it is
+          not in the catalog.
     """
-    @app.route('/users/search', methods=['POST'])
+    @app.route('/api/barcode/<upc>', methods=['GET'])
+    def lookup_barcode(upc):
+
+        try:
+            product = barcodes.lookup(upc)
+        except barcodes.InvalidBarcode:
+            abort(400)
+        if product is None:
+            abort(404)
+
+        return jsonify(dict(product, success=True))
+
+    """GET, POST /users/search
+      Searches for search term in user names
+
+      Inputs:
+          GET "q" query parameter, or POST form field "search_term"
+
+      Returns:
+          JSON Object -- matching users for GET, web page for POST
+    """
+    @app.route('/users/search', methods=['GET', 'POST'])
     def search_users():
-        
-        search_term = request.form.get('search_term',None)
-        users = User.query.filter(User.name.ilike("%{}%".format(search_term))).all()
+
+        if request.method == 'POST':
+            search_term = request.form.get('search_term', '')
+        else:
+            search_term = request.args.get('q', '')
+        users = search.search_users(search_term)
+
+        if request.method == 'GET':
+            return jsonify({
+                'success': True,
+                'count': len(users),
+                'users': [user.format() for user in users]
+            })
 
         response={
             "count":len(users),
             "data": users
         }
 
-    return render_template('pages/search_users.html', results=response, search_term=request.form.get('search_term', ''))
-    """
+        return render_template('pages/search_users.html', results=response, search_term=search_term)
 
     """GET /products/create
       Creates and adds a new product to the database
@@ -198,7 +558,8 @@ def create_app(test_config=None):
                 description=form.description.data,
                 weight=form.weight.data,
                 quantity=form.quanitity.data,
-                date_purchased=form.date_purchased.data
+                date_purchased=form.date_purchased.data,
+                catalog_id=catalog.catalog_id_for(form.name.data)
             )
             db.session.add(product)
             db.session.commit()
@@ -278,7 +639,7 @@ def create_app(test_config=None):
         # Delete product with submitted id from database
         try:
             # Find product with product_id
-            product = Product.query.filter(Product.id == product_id).one_or_none()
+            product = lookups.get_product(product_id)
 
             # if product is none throw 404  
             if product is None:
@@ -314,7 +675,7 @@ def create_app(test_config=None):
         try:
 
             # Find user with user_id
-            user = User.query.filter(User.id == user_id).one_or_none()
+            user = lookups.get_user(user_id)
 
             # If user is none throw 404
             if user is None:
@@ -334,6 +695,79 @@ def create_app(test_config=None):
         return jsonify(result)
 
 
+    """DELETE /api/products
+      Deletes many products with a single statement
+
+      Inputs:
+          JSON {"ids": [int, ...]}
+
+      Returns:
+          JSON Object -- ids of the products that were deleted
+    """
+    @app.route('/api/products', methods=['DELETE'])
+    #@requires_auth('delete:product')
+    def delete_products():
+
+        body = request.get_json(silent=True) or {}
+        ids = body.get('ids')
+
+        if not isinstance(ids, list) or not ids or \
+                len(ids) > batch.MAX_BATCH_SIZE or \
+                not all(type(product_id) is int for product_id in ids):
+            abort(400)
+
+        try:
+            deleted = batch.delete_products(set(ids))
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+
+    """PATCH /api/products
+      Updates many products with a single statement
+
+      Inputs:
+          JSON {"products": [{"id": int, "name": str, ...}, ...]}
+
+      Returns:
+          JSON Object -- ids of the products that were updated
+    """
+    @app.route('/api/products', methods=['PATCH'])
+    #@requires_auth('patch:product')
+    def update_products():
+
+        body = request.get_json(silent=True) or {}
+        patches = body.get('products')
+
+        if not isinstance(patches, list) or not patches or \
+                len(patches) > batch.MAX_BATCH_SIZE:
+            abort(400)
+        for patch in patches:
+            if not isinstance(patch, dict) or type(patch.get('id')) is not int \
+                    or not set(patch) - {'id'} \
+                    or not set(patch) - {'id'} <= set(batch.PATCHABLE_FIELDS):
+                abort(400)
+        if len({patch['id'] for patch in patches}) != len(patches):
+            abort(400)
+
+        try:
+            updated = batch.update_products(patches)
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'updated': updated
+        })
+
+
     """GET /products/<int:product_id>
       Edits a recipe in the database
 
@@ -349,7 +783,7 @@ def create_app(test_config=None):
 
         form = ProductForm()
 
-        product_update=Product.query.filter_by(id=product_id).one_or_none()
+        product_update = lookups.get_product(product_id, cached=True)
         
         if product_update is None:
             abort(404)
@@ -383,8 +817,9 @@ def create_app(test_config=None):
 
         form = ProductForm(request.form)
         try:
-            product = Product.query.filter_by(id=product_id).one()
+            product = lookups.get_product(product_id)
             product.name=form.name.data
+            product.catalog_id=catalog.catalog_id_for(form.name.data)
             product.description=form.description.data
             product.weight=form.weight.data
             product.quantity = form.quantity.data
@@ -412,7 +847,7 @@ def create_app(test_config=None):
     @app.route('/users/<int:user_id>/edit', methods=['GET'])
     def edit_user(user_id):
         form = UserForm()
-        user_update = User.query.filter_by(id=user_id).one_or_none()
+        user_update = lookups.get_user(user_id, cached=True)
         if user_update is None:
             abort(404)
 
@@ -442,7 +877,7 @@ def create_app(test_config=None):
 
         form = UserForm(request.form)
         try:
-            user = User.query.filter_by(id=user_id).one()
+            user = lookups.get_user(user_id)
             user.first_name=form.first_name.data
             user.last_name=form.last_name.data
             user.age=form.age.data
@@ -459,6 +894,72 @@ def create_app(test_config=None):
         return redirect(url_for('show_user', user_id=user_id))
 
 
+    """GET /metrics
+      Prometheus metrics, OCR queue depth, rejections and wait times.
+      Under gunicorn set prometheus_multiproc_dir to aggregate across
+      workers.
+
+      Returns:
+          text/plain -- Prometheus exposition format
+    """
+    @app.route('/metrics')
+    def metrics():
+        registry = None
+        if os.environ.get('prometheus_multiproc_dir'):
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        output = generate_latest(registry) if registry else generate_latest()
+        return output, 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+    def check_profile_access():
+        # Profiles hold SQL and code paths, only PROFILE_SECRET holders
+        # may read them.
+        if request_profiler is None or not profiler.verify(
+                request_profiler.secret,
+                request.headers.get(profiler.HEADER), request.path):
+            abort(404)
+
+    """GET /debug/profiles
+      Lists the stored request profiles, see profiling.profiler. Needs an
+      X-Profile header signed for this path.
+
+      Returns:
+          JSON Object -- profiles, newest first, with their request,
+          status, trigger, total and SQL time
+    """
+    @app.route('/debug/profiles', methods=['GET'])
+    def list_profiles():
+        check_profile_access()
+        return jsonify({
+            'success': True,
+            'profiles': request_profiler.profiles()
+        })
+
+
+    """GET /debug/profiles/<filename>
+      Downloads a stored profile. Needs an X-Profile header signed for
+      this path.
+
+      Inputs:
+          string "filename" -- NAME.prof (pstats) or NAME.json (summary)
+
+      Returns:
+          the file
+    """
+    @app.route('/debug/profiles/<filename>', methods=['GET'])
+    def download_profile(filename):
+        check_profile_access()
+        path = request_profiler.path_of(filename)
+        if path is None:
+            abort(404)
+        return send_file(path, as_attachment=filename.endswith('.prof'),
+                         mimetype='application/json'
+                         if filename.endswith('.json')
+                         else 'application/octet-stream')
+
+
     """
     Login Route
 
@@ -544,6 +1045,15 @@ def create_app(test_config=None):
             'message': 'method not allowed'
         }), 405
 
+    # ERROR - GONE (410)
+    @app.errorhandler(410)
+    def gone(error):
+        return jsonify({
+            'success': False,
+            'error': 410,
+            'message': 'gone'
+        }), 410
+
     # ERROR - UNPROCESSABLE (422)
     @app.errorhandler(422)
     def unprocessable(error):
@@ -562,6 +1072,20 @@ def create_app(test_config=None):
             'message': 'internal server error'
         }), 500
     
+    # ERROR - OCR OVER CAPACITY (429, 503)
+    @app.errorhandler(admission.Rejected)
+    def ocr_rejected(error):
+        response = jsonify({
+            'success': False,
+            'error': error.status_code,
+            'message': 'too many requests' if error.status_code == 429
+            else 'service unavailable',
+            'reason': error.reason,
+            'retry_after': error.retry_after
+        })
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, error.status_code
+
     # ERROR - AUTHENTICATION ERROR
     @app.errorhandler(AuthError)
     def auth_error(error):
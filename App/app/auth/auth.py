@@ -1,6 +1,8 @@
 
 import json
 import os
+import threading
+import time
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
@@ -11,6 +13,15 @@ from os import environ as env
 AUTH0_DOMAIN = ''#os.environ['AUTH0_DOMAIN']
 ALGORITHMS = ''#os.environ['ALGORITHMS']
 API_AUDIENCE = ''#os.environ['API_AUDIENCE']
+# Auth0 signing keys change rarely, they are fetched once per JWKS_TTL
+# instead of on every request, and at most every JWKS_MIN_REFRESH when a
+# token names a key that is not in the cached set.
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 3600))
+JWKS_MIN_REFRESH = 60
+
+_jwks = None
+_jwks_fetched = 0.0
+_jwks_lock = threading.Lock()
 
 # AuthError Exception
 """
@@ -106,6 +117,36 @@ def check_permissions(permission, payload):
     return True
 
 
+""" get_jwks(kid=None)
+Returns Auth0's signing keys, cached for JWKS_TTL seconds
+
+    @INPUTS
+        kid: key id the caller needs, refetches early when it is missing
+        from the cached keys, as after a key rotation
+
+    @RETURNS
+        JWKS document (dict with 'keys')
+"""
+
+
+def get_jwks(kid=None):
+    global _jwks, _jwks_fetched
+    fetched = _jwks_fetched
+    age = time.monotonic() - fetched
+    if _jwks is not None and age < JWKS_TTL and (
+            kid is None or age < JWKS_MIN_REFRESH or
+            any(key.get('kid') == kid for key in _jwks['keys'])):
+        return _jwks
+    with _jwks_lock:
+        # Another request may have refreshed the keys while this one
+        # waited for the lock.
+        if _jwks is None or _jwks_fetched == fetched:
+            jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+            _jwks = json.loads(jsonurl.read())
+            _jwks_fetched = time.monotonic()
+        return _jwks
+
+
 """ verify_decode_jwt(token) method
 
     Verifies and returns decoded token payload
@@ -124,10 +165,6 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    # Get the public key from Auth0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-
     # Get the data in the header
     unverified_header = jwt.get_unverified_header(token)
     rsa_key = {}
@@ -139,6 +176,9 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
+    # Get the public key from Auth0
+    jwks = get_jwks(unverified_header['kid'])
+
     for key in jwks['keys']:
         if key['kid'] == unverified_header['kid']:
             rsa_key = {
@@ -0,0 +1,268 @@
+import csv
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+
+'''
+Offline barcode catalog
+
+    Barcodes resolve to a product name, weight and quantity from a file
+    compiled from CSV by build(), with no network call per scan.
+
+    The file is a header followed by fixed width records sorted by
+    barcode. Lookups memory map it read only and binary search the
+    records in place, so a lookup touches about log2(records) pages, no
+    record is ever parsed into Python objects beyond the match, and all
+    gunicorn workers share the file's pages through the page cache.
+
+    Barcodes are stored as GTIN-14: UPC-A, EAN-13 and EAN-8 codes are
+    left padded with zeros, so each product has one key whichever form
+    it is scanned or listed in.
+
+    BARCODE_CATALOG is the compiled file, rebuilt files are picked up by
+    running workers within RELOAD_INTERVAL seconds.
+'''
+
+MAGIC = b'MFBARC01'
+KEY_SIZE = 14
+NAME_SIZE = 82
+WEIGHT_SIZE = 16
+QUANTITY_SIZE = 16
+RECORD_SIZE = KEY_SIZE + NAME_SIZE + WEIGHT_SIZE + QUANTITY_SIZE
+# magic, record size, record count; padded to one record so records stay
+# aligned.
+HEADER = struct.Struct('<8sIQ')
+HEADER_SIZE = RECORD_SIZE
+RELOAD_INTERVAL = 30.0
+
+CATALOG_PATH = os.environ.get('BARCODE_CATALOG', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'data', 'barcodes.bin'))
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class InvalidBarcode(ValueError):
+    """Raised for codes that are not 8, 12, 13 or 14 digits with a valid
+    check digit."""
+
+
+class CatalogError(Exception):
+    """Raised when a catalog file is not one written by build()."""
+
+
+def check_digit(digits):
+    """GS1 check digit of a code given without it."""
+    # Weights alternate 3, 1, ... from the rightmost digit.
+    total = 3 * sum(map(int, digits[::-2])) + sum(map(int, digits[-2::-2]))
+    return str(-total % 10)
+
+
+""" normalize(code)
+GTIN-14 form of a scanned or listed barcode
+
+    @INPUTS
+        code: barcode as a string, spaces and dashes are ignored
+
+    @RETURNS: 14 ASCII digits as bytes
+
+    @RAISES:
+        InvalidBarcode: wrong length, non digits or bad check digit
+"""
+
+
+def normalize(code):
+    digits = ''.join(code.split()).replace('-', '')
+    if len(digits) not in (8, 12, 13, 14) or not digits.isdigit() or \
+            not digits.isascii():
+        raise InvalidBarcode(code)
+    if check_digit(digits[:-1]) != digits[-1]:
+        raise InvalidBarcode(code)
+    return digits.zfill(KEY_SIZE).encode('ascii')
+
+
+def _field(value, size):
+    data = (value or '').strip().encode('utf-8')[:size]
+    # Never leave half of a multi-byte character at the cut.
+    return data.decode('utf-8', 'ignore').encode('utf-8').ljust(size, b'\0')
+
+
+def _text(data):
+    return data.rstrip(b'\0').decode('utf-8')
+
+
+def pack(key, name, weight=None, quantity=None):
+    return key + _field(name, NAME_SIZE) + _field(weight, WEIGHT_SIZE) + \
+        _field(quantity, QUANTITY_SIZE)
+
+
+def unpack(record):
+    name_end = KEY_SIZE + NAME_SIZE
+    weight_end = name_end + WEIGHT_SIZE
+    return {
+        'barcode': record[:KEY_SIZE].decode('ascii'),
+        'name': _text(record[KEY_SIZE:name_end]),
+        'weight': _text(record[name_end:weight_end]),
+        'quantity': _text(record[weight_end:RECORD_SIZE]),
+    }
+
+
+""" build(csv_path, output_path)
+Compiles a CSV with a header row of barcode (or upc), name and optionally
+weight, quantity into a catalog file. Later rows win over earlier rows
+with the same barcode. The file is replaced atomically, running workers
+keep reading the old one until they reload.
+
+    @INPUTS
+        csv_path: source CSV
+        output_path: catalog file to write, CATALOG_PATH if None
+
+    @RETURNS: dict with the records written and rows skipped
+"""
+
+
+def build(csv_path, output_path=None):
+    output_path = output_path or CATALOG_PATH
+    records = {}
+    skipped = 0
+    with open(csv_path, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            code = row.get('barcode') or row.get('upc') or ''
+            if not row.get('name'):
+                skipped += 1
+                continue
+            try:
+                key = normalize(code)
+            except InvalidBarcode:
+                skipped += 1
+                continue
+            records[key] = pack(key, row['name'], row.get('weight'),
+                                row.get('quantity'))
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, partial = tempfile.mkstemp(dir=directory, prefix='.barcodes')
+    try:
+        with os.fdopen(descriptor, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, RECORD_SIZE, len(records))
+                         .ljust(HEADER_SIZE, b'\0'))
+            for key in sorted(records):
+                handle.write(records[key])
+        os.chmod(partial, 0o644)
+        os.replace(partial, output_path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return {'records': len(records), 'skipped': skipped,
+            'bytes': HEADER_SIZE + len(records) * RECORD_SIZE}
+
+
+class BarcodeIndex(object):
+    """A memory mapped catalog file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self.stat = os.fstat(handle.fileno())
+            if self.stat.st_size < HEADER_SIZE:
+                raise CatalogError(path)
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or record_size != RECORD_SIZE or \
+                self.stat.st_size != HEADER_SIZE + self.count * RECORD_SIZE:
+            self.map.close()
+            raise CatalogError(path)
+
+    def __len__(self):
+        return self.count
+
+    def find(self, key):
+        """Record of a normalized barcode as bytes, None if absent."""
+        data = self.map
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER_SIZE + middle * RECORD_SIZE
+            if data[offset:offset + KEY_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+        offset = HEADER_SIZE + low * RECORD_SIZE
+        if low < self.count and data[offset:offset + KEY_SIZE] == key:
+            return data[offset:offset + RECORD_SIZE]
+        return None
+
+    def lookup(self, code):
+        """Product of a barcode as a dict, None if it is not in the
+        catalog. Raises InvalidBarcode."""
+        record = self.find(normalize(code))
+        return None if record is None else unpack(record)
+
+    def replaced(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) != \
+            (self.stat.st_ino, self.stat.st_mtime_ns)
+
+    def close(self):
+        self.map.close()
+
+
+def index():
+    """The catalog at CATALOG_PATH, None while none has been built. A
+    rebuilt file is mapped in place of the old one at most
+    RELOAD_INTERVAL seconds after it lands."""
+    global _index
+    current = _index
+    if current is not None and \
+            time.monotonic() - current.checked < RELOAD_INTERVAL:
+        return current.index
+    with _index_lock:
+        if _index is None or _index.index is None or \
+                _index.index.replaced():
+            try:
+                loaded = BarcodeIndex(CATALOG_PATH)
+            except FileNotFoundError:
+                loaded = None
+            # The old map is left to the garbage collector, a request may
+            # still be reading it.
+            _index = _Loaded(loaded)
+        _index.checked = time.monotonic()
+        return _index.index
+
+
+class _Loaded(object):
+    def __init__(self, loaded):
+        self.index = loaded
+        self.checked = time.monotonic()
+
+
+""" lookup(code)
+Looks a barcode up in the catalog at CATALOG_PATH
+
+    @INPUTS
+        code: barcode as scanned
+
+    @RETURNS: dict of barcode, name, weight and quantity, None when the
+        code is unknown or no catalog has been built
+
+    @RAISES:
+        InvalidBarcode: code is not a valid barcode
+"""
+
+
+def lookup(code):
+    key = normalize(code)
+    catalog = index()
+    if catalog is None:
+        return None
+    record = catalog.find(key)
+    return None if record is None else unpack(record)
@@ -0,0 +1,91 @@
+"""Autocomplete index footprint and lookup latency benchmark.
+
+    Loads --rows synthetic product names into the prefix index used by
+    /api/products/autocomplete, then reports build time, approximate
+    memory footprint, per-lookup latency percentiles by prefix length
+    and the cost of an incremental update, as JSON.
+
+    Usage (from the App/ directory):
+        python -m app.bench.autocomplete --rows 1000000
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from .load import percentile
+from .seed import PRODUCT_NAMES, WEIGHTS
+from ..search.autocomplete import PrefixIndex
+
+
+def _names(rng, count, distinct):
+    """count product names drawn from a Zipf-like pool of distinct names,
+    so a few staples dominate like they do in real fridges."""
+    pool = ['{} {} {}'.format(rng.choice(PRODUCT_NAMES),
+                              ''.join(rng.choice(string.ascii_lowercase)
+                                      for _ in range(rng.randint(3, 8))),
+                              rng.choice(WEIGHTS))
+            for _ in range(distinct)]
+    weights = [1.0 / (rank + 1) for rank in range(distinct)]
+    return rng.choices(pool, weights=weights, k=count)
+
+
+def _percentiles(timings):
+    timings.sort()
+    return {
+        'count': len(timings),
+        'p50_us': round(percentile(timings, 50) * 1e6, 2),
+        'p95_us': round(percentile(timings, 95) * 1e6, 2),
+        'p99_us': round(percentile(timings, 99) * 1e6, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--distinct', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(3)
+    names = _names(rng, args.rows, args.distinct)
+    index = PrefixIndex()
+    started = time.perf_counter()
+    index.load(enumerate(names, 1))
+    report = {
+        'rows': args.rows,
+        'distinct_names': len(index),
+        'build_s': round(time.perf_counter() - started, 3),
+        'memory_bytes': index.memory_bytes(),
+        'lookup': {},
+    }
+
+    for length in (1, 2, 3, 5, 8):
+        timings = []
+        for _ in range(args.lookups):
+            prefix = rng.choice(names)[:length]
+            begun = time.perf_counter()
+            index.lookup(prefix)
+            timings.append(time.perf_counter() - begun)
+        report['lookup']['prefix_{}'.format(length)] = _percentiles(timings)
+
+    timings = []
+    next_id = args.rows + 1
+    for _ in range(args.lookups):
+        begun = time.perf_counter()
+        index.set(next_id, rng.choice(names) + ' new')
+        timings.append(time.perf_counter() - begun)
+        next_id += 1
+    report['incremental_insert'] = _percentiles(timings)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Barcode catalog build time and lookup latency benchmark.
+
+    Writes --records synthetic EAN-13 products to a CSV, compiles it with
+    barcodes.build, then times hits and misses against the memory mapped
+    file and, for comparison, the same lookups on a unique index in
+    SQLite, as JSON.
+
+    Usage (from the App/ directory):
+        python -m app.bench.barcode --records 2000000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from .load import percentile
+from .seed import PRODUCT_NAMES, WEIGHTS
+from ..barcode import barcodes
+
+
+def _codes(rng, count):
+    codes = set()
+    while len(codes) < count:
+        body = '{:012d}'.format(rng.randrange(10 ** 12))
+        codes.add(body + barcodes.check_digit(body))
+    return sorted(codes)
+
+
+def _write_csv(path, rng, codes):
+    with open(path, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['barcode', 'name', 'weight', 'quantity'])
+        for code in codes:
+            writer.writerow([code, rng.choice(PRODUCT_NAMES),
+                             rng.choice(WEIGHTS), rng.randint(1, 12)])
+
+
+def _percentiles(timings):
+    timings.sort()
+    return {
+        'count': len(timings),
+        'p50_us': round(percentile(timings, 50) * 1e6, 2),
+        'p95_us': round(percentile(timings, 95) * 1e6, 2),
+        'p99_us': round(percentile(timings, 99) * 1e6, 2),
+        'per_s': round(len(timings) / sum(timings)),
+    }
+
+
+def _time_each(fn, codes):
+    timings = []
+    for code in codes:
+        started = time.perf_counter()
+        fn(code)
+        timings.append(time.perf_counter() - started)
+    return _percentiles(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=2000000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--sqlite', action='store_true',
+                        help='also time a SQLite unique index')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    directory = tempfile.mkdtemp(prefix='barcodes')
+    source = os.path.join(directory, 'barcodes.csv')
+    target = os.path.join(directory, 'barcodes.bin')
+    codes = _codes(rng, args.records)
+    _write_csv(source, rng, codes)
+
+    started = time.perf_counter()
+    built = barcodes.build(source, target)
+    report = {'build': dict(built, build_s=round(
+        time.perf_counter() - started, 3))}
+
+    hits = rng.sample(codes, min(args.lookups, len(codes)))
+    known = set(codes)
+    misses = []
+    while len(misses) < len(hits):
+        code = _codes(rng, 1)[0]
+        if code not in known:
+            misses.append(code)
+
+    started = time.perf_counter()
+    index = barcodes.BarcodeIndex(target)
+    report['open_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    assert all(index.lookup(code) for code in hits[:100])
+    report['mmap'] = {
+        'hit': _time_each(index.lookup, hits),
+        'miss': _time_each(index.lookup, misses),
+    }
+
+    if args.sqlite:
+        database = sqlite3.connect(os.path.join(directory, 'barcodes.db'))
+        database.execute('CREATE TABLE catalog (barcode TEXT PRIMARY KEY, '
+                         'name TEXT, weight TEXT, quantity TEXT)')
+        with open(source, newline='') as handle:
+            rows = csv.reader(handle)
+            next(rows)
+            database.executemany('INSERT INTO catalog VALUES (?, ?, ?, ?)',
+                                 ((barcodes.normalize(row[0]).decode(),
+                                   *row[1:]) for row in rows))
+        database.commit()
+
+        def query(code):
+            return database.execute(
+                'SELECT name, weight, quantity FROM catalog '
+                'WHERE barcode = ?',
+                (barcodes.normalize(code).decode(),)).fetchone()
+
+        report['sqlite'] = {
+            'hit': _time_each(query, hits),
+            'miss': _time_each(query, misses),
+        }
+        database.close()
+
+    index.close()
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Receipt-to-inventory ingestion latency benchmark.
+
+    Seeds the database, then posts synthetic receipts of several sizes to
+    POST /api/users/<id>/receipts through the Flask test client and
+    reports end-to-end latency percentiles for first ingestion and for
+    retried (replayed) receipts, as JSON. Uploads go through the fake
+    Vision client from app.bench.ocr_app, set OCR_LATENCY=0 to measure
+    only the server's own work.
+
+    Usage (from the App/ directory):
+        python -m app.bench.ingest --database-url sqlite:////tmp/ingest.db
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from .load import percentile
+from .seed import create_bench_app, seed, PRODUCT_NAMES, WEIGHTS
+
+
+def _receipt(rng, size):
+    return [{
+        'name': '{} {}'.format(rng.choice(PRODUCT_NAMES),
+                               rng.randint(1, 500)),
+        'quantity': rng.randint(1, 4),
+        'weight': rng.choice(WEIGHTS),
+    } for _ in range(size)]
+
+
+def _percentiles(timings):
+    timings.sort()
+    return {
+        'count': len(timings),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/ingest.db'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--receipts', type=int, default=200)
+    parser.add_argument('--sizes', default='5,20,50')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    with create_bench_app(args.database_url).app_context():
+        seed(users=args.users, products=args.products, links=args.products)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('OCR_LATENCY', '0')
+    from .ocr_app import app
+    client = app.test_client()
+    rng = random.Random(7)
+
+    report = {'meta': {'users': args.users, 'products': args.products,
+                       'receipts_per_size': args.receipts}}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        fresh, replayed, posted = [], [], []
+        for number in range(args.receipts):
+            user_id = rng.randint(1, args.users)
+            body = {'items': _receipt(rng, size),
+                    'date_purchased': 1600000000 + number}
+            started = time.perf_counter()
+            response = client.post('/api/users/{}/receipts'.format(user_id),
+                                   json=body)
+            fresh.append(time.perf_counter() - started)
+            assert response.status_code == 201, response.get_data()
+            posted.append((user_id, body))
+        for user_id, body in posted:
+            started = time.perf_counter()
+            response = client.post('/api/users/{}/receipts'.format(user_id),
+                                   json=body)
+            replayed.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.get_data()
+        report['items_{}'.format(size)] = {
+            'first': _percentiles(fresh),
+            'replay': _percentiles(replayed),
+        }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""Concurrent HTTP load generator for the MyFridge app.
+
+    Drives every route registered on the app with a pool of keep-alive
+    client threads and writes per-endpoint throughput and latency
+    percentiles as JSON, so results can be diffed between commits.
+
+    Usage (from the App/ directory, after seeding with app.bench.seed):
+        python -m app.bench.load --database-url sqlite:////tmp/myfridge.db \\
+            --concurrency 16 --duration 30 --out results.json
+
+    Pass --base-url to load an already running server (gunicorn, etc.)
+    instead of the in-process threaded server.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+
+# Form bodies for POST routes, keyed by endpoint name. Routes that are
+# not listed here are sent an empty form.
+FORM_BODIES = {
+    'new_product': lambda rng: {
+        'name': 'Bench Product {}'.format(rng.randint(0, 10 ** 6)),
+        'weight': '1kg',
+        'quanitity': str(rng.randint(1, 12)),
+        'date_purchased': '2020-10-25 12:00:00'
+    },
+    'new_user': lambda rng: {
+        'first_name': 'Bench',
+        'last_name': 'User{}'.format(rng.randint(0, 10 ** 6)),
+        'age': str(rng.randint(18, 90))
+    },
+    'edit_product_submission': lambda rng: {
+        'name': 'Edited Product',
+        'weight': '500g',
+        'quantity': '2',
+        'date_purchased': '2020-10-25 12:00:00'
+    },
+    'edit_user_submission': lambda rng: {
+        'first_name': 'Edited',
+        'last_name': 'User',
+        'age': '30'
+    },
+}
+
+# URL converter names mapped to the table that holds valid ids for them.
+ID_ARGUMENTS = {
+    'product_id': 'products',
+    'user_id': 'users',
+}
+
+SKIPPED_ENDPOINTS = {'static'}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(math.ceil(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Scenario(object):
+    """One (method, rule) pair and how to build a concrete request for it."""
+
+    def __init__(self, method, rule, endpoint, arguments):
+        self.method = method
+        self.rule = rule
+        self.endpoint = endpoint
+        self.arguments = arguments
+        self.name = '{} {}'.format(method, rule)
+
+    def build(self, rng, id_ranges):
+        path = self.rule
+        for argument in self.arguments:
+            upper = id_ranges.get(ID_ARGUMENTS[argument], 1) or 1
+            path = re.sub(r'<(?:[^:<>]+:)?{}>'.format(argument),
+                          str(rng.randint(1, upper)), path)
+        body = None
+        headers = {}
+        if self.method in ('POST', 'PATCH'):
+            make_body = FORM_BODIES.get(self.endpoint)
+            body = urlencode(make_body(rng) if make_body else {})
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return path, body, headers
+
+
+def discover_scenarios(app, include_writes=True):
+    """Builds one scenario per routable (method, rule) on the app."""
+    scenarios = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint in SKIPPED_ENDPOINTS:
+            continue
+        if any(argument not in ID_ARGUMENTS for argument in rule.arguments):
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if not include_writes and method != 'GET':
+                continue
+            scenarios.append(Scenario(method, rule.rule, rule.endpoint,
+                                      sorted(rule.arguments)))
+    return scenarios
+
+
+def id_ranges_for(app):
+    """Upper bound of seeded ids per table, used to fill URL arguments."""
+    from ..database.models import db
+    with app.app_context():
+        return {table: db.session.execute(
+                    'SELECT MAX(id) FROM {}'.format(table)).scalar() or 0
+                for table in set(ID_ARGUMENTS.values())}
+
+
+class Recorder(object):
+    """Thread-safe latency and status collector."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, status):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if status is None:
+                self.errors[name] += 1
+            else:
+                self.statuses[name][str(status)] += 1
+
+    def report(self, wall_seconds):
+        endpoints = {}
+        everything = []
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            everything.extend(values)
+            endpoints[name] = _summary(values, wall_seconds)
+            endpoints[name]['status'] = dict(self.statuses[name])
+            endpoints[name]['errors'] = self.errors[name]
+        everything.sort()
+        total = _summary(everything, wall_seconds)
+        total['errors'] = sum(self.errors.values())
+        return {'endpoints': endpoints, 'total': total}
+
+
+def _summary(values, wall_seconds):
+    to_ms = lambda seconds: None if seconds is None \
+        else round(seconds * 1000.0, 3)
+    return {
+        'count': len(values),
+        'throughput_rps': round(len(values) / wall_seconds, 2)
+        if wall_seconds else None,
+        'mean_ms': to_ms(sum(values) / len(values)) if values else None,
+        'p50_ms': to_ms(percentile(values, 50)),
+        'p95_ms': to_ms(percentile(values, 95)),
+        'p99_ms': to_ms(percentile(values, 99)),
+        'max_ms': to_ms(values[-1]) if values else None,
+    }
+
+
+def _worker(base_url, scenarios, id_ranges, recorder, deadline, budget,
+            worker_seed):
+    rng = random.Random(worker_seed)
+    target = urlsplit(base_url)
+    connection = http.client.HTTPConnection(target.hostname, target.port,
+                                            timeout=30)
+    index = worker_seed
+    while time.monotonic() < deadline and budget.take():
+        scenario = scenarios[index % len(scenarios)]
+        index += 1
+        path, body, headers = scenario.build(rng, id_ranges)
+        started = time.perf_counter()
+        try:
+            connection.request(scenario.method, path, body=body,
+                               headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status = None
+            connection.close()
+            connection = http.client.HTTPConnection(
+                target.hostname, target.port, timeout=30)
+        recorder.record(scenario.name, time.perf_counter() - started, status)
+    connection.close()
+
+
+class Budget(object):
+    """Shared request counter, unlimited when total is None."""
+
+    def __init__(self, total):
+        self.lock = threading.Lock()
+        self.remaining = total
+
+    def take(self):
+        if self.remaining is None:
+            return True
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def run(base_url, scenarios, id_ranges, concurrency=8, duration=10.0,
+        requests=None, warmup=0.0):
+    """Runs the load and returns the JSON-ready report."""
+    if warmup:
+        run(base_url, scenarios, id_ranges, concurrency, warmup)
+    recorder = Recorder()
+    budget = Budget(requests)
+    deadline = time.monotonic() + (duration if requests is None
+                                   else float('inf'))
+    threads = [threading.Thread(target=_worker, args=(
+        base_url, scenarios, id_ranges, recorder, deadline, budget, i))
+        for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+def serve_in_background(app):
+    """Starts the app on an ephemeral port in a threaded werkzeug server."""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/myfridge.db'))
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--requests', type=int, default=None,
+                        help='stop after this many requests instead of '
+                             'after --duration seconds')
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--read-only', action='store_true',
+                        help='only drive GET routes')
+    parser.add_argument('--endpoint', action='append', default=[],
+                        help='restrict to scenarios whose name contains '
+                             'this substring (repeatable)')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    # The app module builds its app at import time from DATABASE_URL.
+    os.environ['DATABASE_URL'] = args.database_url
+    from ..app import app
+
+    scenarios = discover_scenarios(app, include_writes=not args.read_only)
+    if args.endpoint:
+        scenarios = [s for s in scenarios
+                     if any(f in s.name for f in args.endpoint)]
+    if not scenarios:
+        parser.error('no routes matched')
+    id_ranges = id_ranges_for(app)
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = serve_in_background(app)
+
+    try:
+        report = run(base_url, scenarios, id_ranges, args.concurrency,
+                     args.duration, args.requests, args.warmup)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report['meta'] = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'database': urlsplit(args.database_url).scheme,
+        'base_url': base_url,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'requests': args.requests,
+        'rows': id_ranges,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Concurrent OCR upload benchmark: sync vs cooperative gunicorn workers.
+
+    Starts gunicorn once per worker class on app.bench.ocr_app (Vision
+    replaced by a fake with a fixed latency), fires concurrent receipt
+    uploads at POST /upload and reports throughput and latency
+    percentiles for each mode as JSON.
+
+    Usage (from the App/ directory):
+        python -m app.bench.ocr --database-url sqlite:////tmp/myfridge.db \\
+            --workers 2 --concurrency 32 --uploads 256 --ocr-latency 0.5
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from .load import Recorder
+
+
+BOUNDARY = uuid.uuid4().hex
+
+
+def _receipt_image():
+    # Pages are decoded and preprocessed before the fake OCR sees them,
+    # so this has to be an image Pillow can read.
+    buffer = io.BytesIO()
+    Image.new('L', (400, 800), 255).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+RECEIPT_IMAGE = _receipt_image()
+
+
+def multipart_body(filename, content):
+    return b''.join([
+        '--{}\r\n'.format(BOUNDARY).encode(),
+        'Content-Disposition: form-data; name="image"; '
+        'filename="{}"\r\n'.format(filename).encode(),
+        b'Content-Type: image/png\r\n\r\n',
+        content,
+        '\r\n--{}--\r\n'.format(BOUNDARY).encode(),
+    ])
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_listening(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start on port {}'.format(port))
+
+
+def start_gunicorn(worker_class, workers, port, env):
+    app_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    return subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '--config', os.path.join(app_dir, 'gunicorn.conf.py'),
+        '--worker-class', worker_class,
+        '--workers', str(workers),
+        '--bind', '127.0.0.1:{}'.format(port),
+        'app.bench.ocr_app:app'
+    ], cwd=app_dir, env=dict(env, WORKER_CLASS=worker_class))
+
+
+def upload_burst(port, uploads, concurrency):
+    recorder = Recorder()
+    counter = iter(range(uploads))
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                timeout=120)
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                break
+            body = multipart_body('receipt-{}.png'.format(number),
+                                  RECEIPT_IMAGE)
+            started = time.perf_counter()
+            try:
+                connection.request('POST', '/upload', body=body, headers={
+                    'Content-Type':
+                        'multipart/form-data; boundary=' + BOUNDARY})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                status = None
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', port, timeout=120)
+            recorder.record('POST /upload', time.perf_counter() - started,
+                            status)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/myfridge.db'))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--uploads', type=int, default=256)
+    parser.add_argument('--ocr-latency', type=float, default=0.5)
+    parser.add_argument('--modes', default='sync,gevent')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    # Uploads are stored in a throwaway directory, never in the
+    # deployment's blob store or static/img/Receipts.
+    blobs = tempfile.mkdtemp(prefix='myfridge-bench-blobs-')
+    env = dict(os.environ,
+               DATABASE_URL=args.database_url,
+               OCR_LATENCY=str(args.ocr_latency),
+               # Every upload comes from 127.0.0.1, the per-client quota and
+               # the OCR slot limit would turn most of them away, and this
+               # compares worker classes, not admission control.
+               OCR_USER_RATE='0',
+               OCR_MAX_CONCURRENT=str(args.concurrency),
+               OCR_MAX_QUEUE=str(args.concurrency),
+               BLOB_STORE='local:' + blobs)
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            port = _free_port()
+            server = start_gunicorn(mode, args.workers, port, env)
+            try:
+                _wait_until_listening(port)
+                burst = upload_burst(port, args.uploads, args.concurrency)
+                # Statuses too, so rejected uploads do not pass for fast
+                # ones.
+                results[mode] = dict(
+                    burst['total'],
+                    status=burst['endpoints']['POST /upload']['status'])
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(blobs, ignore_errors=True)
+
+    report = {
+        'modes': results,
+        'meta': {
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'uploads': args.uploads,
+            'ocr_latency': args.ocr_latency,
+        }
+    }
+    if 'sync' in results and 'gevent' in results \
+            and results['sync']['throughput_rps']:
+        report['speedup'] = round(results['gevent']['throughput_rps'] /
+                                  results['sync']['throughput_rps'], 2)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
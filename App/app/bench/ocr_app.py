@@ -0,0 +1,51 @@
+"""WSGI entry point with the Vision API replaced by a fixed-latency fake.
+
+    Used by app.bench.ocr so upload benchmarks measure the serving mode
+    rather than Google's latency or quota:
+        OCR_LATENCY=0.5 gunicorn app.bench.ocr_app:app
+"""
+import os
+import time
+
+from ..ocr import ocr
+
+
+OCR_LATENCY = float(os.environ.get('OCR_LATENCY', 0.5))
+
+
+class FakeError(object):
+    message = ''
+
+
+SAMPLE_RECEIPT = """FRESHCO #123
+WHOLE MILK 2L          4.99
+2 x LARGE EGGS 12PK    7.58
+BANANAS 1.2kg          1.80
+SUBTOTAL              14.37
+HST                    0.00
+TOTAL                 14.37
+"""
+
+
+class FakeAnnotation(object):
+    description = SAMPLE_RECEIPT
+
+
+class FakeResponse(object):
+    error = FakeError()
+    text_annotations = [FakeAnnotation()]
+
+
+class FakeVisionClient(object):
+    """Sleeps like a network round trip; gevent turns the sleep into a
+    yield, exactly as it does for a real gRPC call."""
+
+    def text_detection(self, image):
+        time.sleep(OCR_LATENCY)
+        return FakeResponse()
+
+
+_fake_client = FakeVisionClient()
+ocr.get_client = lambda: _fake_client
+
+from ..app import app  # noqa: E402
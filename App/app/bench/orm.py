@@ -0,0 +1,100 @@
+"""Per-request ORM overhead of loading one row by primary key.
+
+    Seeds a database, then times loading a random Product by id the way a
+    per-id route does, each lookup in a fresh session as in its own
+    request: Model.query.filter_by(id=...), the baked query in
+    database.lookups, lookups with the cross-request cache warm, and a
+    second lookup of the same id within one request (identity map).
+    Reports microseconds per lookup as JSON.
+
+    Usage (from the App/ directory):
+        python -m app.bench.orm --database-url sqlite:////tmp/orm.db \\
+            --lookups 20000
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from .load import percentile
+from .seed import create_bench_app, seed
+from ..database import lookups
+from ..database.models import db, Product
+
+
+def _percentiles(timings):
+    timings.sort()
+    return {
+        'count': len(timings),
+        'p50_us': round(percentile(timings, 50) * 1e6, 2),
+        'p95_us': round(percentile(timings, 95) * 1e6, 2),
+        'mean_us': round(sum(timings) / len(timings) * 1e6, 2),
+    }
+
+
+def _per_request(fn, ids, repeat=1):
+    timings = []
+    for product_id in ids:
+        # Held as a route holds what it loaded, the identity map only
+        # keeps weak references.
+        earlier = [fn(product_id) for _ in range(repeat - 1)]
+        started = time.perf_counter()
+        product = fn(product_id)
+        timings.append(time.perf_counter() - started)
+        assert product is not None
+        del earlier
+        db.session.remove()
+    return _percentiles(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/orm.db'))
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(3)
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        seed(users=100, products=args.products, links=0)
+        low, high = db.session.query(db.func.min(Product.id),
+                                     db.func.max(Product.id)).one()
+        db.session.remove()
+        ids = [rng.randint(low, high) for _ in range(args.lookups)]
+
+        def query(product_id):
+            return Product.query.filter_by(id=product_id).one_or_none()
+
+        def cached(product_id):
+            return lookups.get_product(product_id, cached=True)
+
+        # Warm up connections and compiled statement caches.
+        _per_request(query, ids[:200])
+        _per_request(lookups.get_product, ids[:200])
+
+        lookups.set_cache(lookups.PKCache(ttl=3600))
+        for product_id in set(ids):
+            cached(product_id)
+            db.session.remove()
+        report = {
+            'query': _per_request(query, ids),
+            'baked': _per_request(lookups.get_product, ids),
+            'pk_cache': _per_request(cached, ids),
+            'identity_map': _per_request(lookups.get_product, ids, repeat=2),
+        }
+        lookups.set_cache(None)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
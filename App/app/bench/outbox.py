@@ -0,0 +1,79 @@
+"""Outbox consumer throughput benchmark.
+
+    Fills outbox_events with synthetic product events, then drains them
+    with 1..N parallel consumer processes into the null sink and reports
+    events per second and the delivery lag seen, as JSON. Parallel
+    consumers only scale on Postgres, SQLite serializes their claims.
+
+    Usage (from the App/ directory):
+        python -m app.bench.outbox --database-url postgresql://localhost/bench \\
+            --events 200000 --processes 1,2,4
+"""
+import argparse
+import json
+import os
+import time
+
+from sqlalchemy import create_engine, text
+
+from ..database.outbox import event_row
+from ..events.consumer import consume
+from .seed import create_bench_app
+
+
+def _fill(engine, events, chunk=5000):
+    with engine.begin() as connection:
+        connection.execute(text('DELETE FROM outbox_events'))
+    statement = text(
+        'INSERT INTO outbox_events (topic, aggregate_id, payload, created_at) '
+        'VALUES (:topic, :aggregate_id, :payload, :created_at)')
+    for start in range(0, events, chunk):
+        rows = [event_row('product.updated', product_id, {
+            'id': product_id, 'name': 'product {}'.format(product_id),
+            'quantity': '1', 'weight': '500g'})
+            for product_id in range(start, min(start + chunk, events))]
+        with engine.begin() as connection:
+            connection.execute(statement, rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/outbox.db'))
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--processes', default='1,2,4')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    create_bench_app(args.database_url)
+    engine = create_engine(args.database_url)
+
+    report = {'meta': {'events': args.events, 'batch_size': args.batch_size,
+                       'database': engine.dialect.name},
+              'processes': {}}
+    for processes in [int(count) for count in args.processes.split(',')]:
+        _fill(engine, args.events)
+        started = time.perf_counter()
+        stats = consume(args.database_url, ['null'], processes,
+                        args.batch_size, stop_when_empty=True)
+        elapsed = time.perf_counter() - started
+        delivered = sum(item['delivered'] for item in stats)
+        report['processes'][str(processes)] = {
+            'delivered': delivered,
+            'elapsed_s': round(elapsed, 3),
+            'events_per_s': round(delivered / elapsed, 1),
+            'max_lag_s': max(item['max_lag_s'] for item in stats),
+            'failed_batches': sum(item['failed_batches'] for item in stats),
+        }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
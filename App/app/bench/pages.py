@@ -0,0 +1,93 @@
+"""Multi-page receipt OCR benchmark: parallel vs sequential.
+
+    Builds an N-page receipt (separate photos, or one PDF with
+    --pdf), then times split + preprocess + OCR + stitch through
+    app.ocr.pages with the bounded pool and with a single worker. Vision
+    is replaced by the fixed-latency fake from app.bench.ocr_app.
+
+    Usage (from the App/ directory):
+        python -m app.bench.pages --pages 1,2,4,8 --ocr-latency 0.4
+"""
+import argparse
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+
+def _page_image(number, size=(1240, 1754)):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(60):
+        draw.text((80, 80 + line * 26),
+                  'PAGE {} ITEM {:02d}    {}.99'.format(number, line, line),
+                  fill='black')
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def _pdf(images):
+    import fitz
+    document = fitz.open()
+    for content in images:
+        page = document.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=content)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def _run(pages_module, contents, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        pages_module.read_pages(pages_module.split_pages(contents))
+        timings.append(time.perf_counter() - started)
+    return round(min(timings), 4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', default='1,2,4,8')
+    parser.add_argument('--ocr-latency', type=float, default=0.4)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--pdf', action='store_true')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    os.environ['OCR_LATENCY'] = str(args.ocr_latency)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/myfridge.db')
+    from . import ocr_app  # noqa: F401, installs the fake Vision client
+    from ..ocr import pages
+
+    report = {'meta': {'ocr_latency': args.ocr_latency,
+                       'workers': args.workers, 'pdf': args.pdf},
+              'pages': {}}
+    for count in [int(count) for count in args.pages.split(',')]:
+        images = [_page_image(number) for number in range(count)]
+        contents = [_pdf(images)] if args.pdf else images
+
+        pages._executor = ThreadPoolExecutor(max_workers=args.workers)
+        parallel = _run(pages, contents, args.repeats)
+        pages._executor = ThreadPoolExecutor(max_workers=1)
+        sequential = _run(pages, contents, args.repeats)
+        report['pages'][str(count)] = {
+            'parallel_s': parallel,
+            'sequential_s': sequential,
+            'speedup': round(sequential / parallel, 2) if parallel else None,
+        }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
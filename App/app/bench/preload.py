@@ -0,0 +1,151 @@
+"""Memory per worker and first request latency, with and without preload.
+
+    Starts gunicorn (sync workers) on a seeded database once with
+    PRELOAD=0 and once with PRELOAD=1. For each it reports the time until
+    the server answers, the latency of one request per worker to routes
+    backed by lazily built caches, and the resident (RSS), proportional
+    (PSS) and unique (USS) memory of the workers, as JSON. Shared pages
+    show up as PSS and USS below RSS.
+
+    Usage (from the App/ directory, after seeding with app.bench.seed):
+        python -m app.bench.preload --database-url sqlite:////tmp/myfridge.db \\
+            --workers 4
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import psutil
+
+from .load import percentile
+
+
+PATHS = ('/api/products/autocomplete?q=mi', '/products/search?q=milk')
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _get(port, path, timeout=60):
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port,
+                                            timeout=timeout)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def _wait_ready(port, deadline):
+    while time.monotonic() < deadline:
+        try:
+            return _get(port, '/metrics', timeout=1)
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError('gunicorn did not come up')
+
+
+def _first_requests(port, path, workers):
+    """Latencies of workers concurrent requests, one per sync worker as
+    each worker takes a single connection at a time."""
+    results = []
+    barrier = threading.Barrier(workers)
+
+    def request():
+        barrier.wait()
+        results.append(_get(port, path))
+
+    threads = [threading.Thread(target=request) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(seconds for _, seconds in results), \
+        sorted({status for status, _ in results})
+
+
+def _memory(master):
+    rows = []
+    for worker in master.children():
+        info = worker.memory_full_info()
+        rows.append((info.rss, getattr(info, 'pss', 0), info.uss))
+    count = len(rows) or 1
+    return {
+        'workers': len(rows),
+        'rss_mb': round(sum(row[0] for row in rows) / count / 2 ** 20, 2),
+        'pss_mb': round(sum(row[1] for row in rows) / count / 2 ** 20, 2),
+        'uss_mb': round(sum(row[2] for row in rows) / count / 2 ** 20, 2),
+        'master_rss_mb': round(master.memory_info().rss / 2 ** 20, 2),
+    }
+
+
+def measure(database_url, workers, preload):
+    port = _free_port()
+    environment = dict(os.environ, DATABASE_URL=database_url,
+                       WORKER_CLASS='sync', WEB_CONCURRENCY=str(workers),
+                       BIND='127.0.0.1:{}'.format(port),
+                       PRELOAD='1' if preload else '0')
+    app_directory = os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))))
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         'app.app:app'], cwd=app_directory, env=environment,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(port, time.monotonic() + 120)
+        report = {'ready_s': round(time.perf_counter() - started, 3)}
+        # Let the rest of the workers finish booting.
+        time.sleep(1.0)
+        for path in PATHS:
+            first, statuses = _first_requests(port, path, workers)
+            again, _ = _first_requests(port, path, workers)
+            report[path] = {
+                'status': statuses,
+                'first_p50_ms': round(percentile(first, 50) * 1000, 2),
+                'first_max_ms': round(first[-1] * 1000, 2),
+                'warm_p50_ms': round(percentile(again, 50) * 1000, 2),
+            }
+        report['memory'] = _memory(psutil.Process(process.pid))
+        return report
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/myfridge.db'))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    report = {
+        'workers': args.workers,
+        'per_worker': measure(args.database_url, args.workers, False),
+        'preload': measure(args.database_url, args.workers, True),
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
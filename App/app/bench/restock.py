@@ -0,0 +1,168 @@
+"""Restock prediction benchmark on synthetic purchase history.
+
+    Generates periodic buyers (each (user, item) pair restocked every
+    few days with jitter), times restock.estimate on millions of purchase
+    events against a plain Python group-by on a sample, then runs the
+    full job end to end (load, estimate, write) against a database.
+    Reports JSON.
+
+    Usage (from the App/ directory):
+        python -m app.bench.restock --events 1000000,5000000 \\
+            --database-url sqlite:////tmp/restock.db --db-events 200000
+"""
+import argparse
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from ..restock import restock
+from .seed import create_bench_app
+
+NOW = 1700000000
+
+
+def synthetic_history(events, users, items=500, seed=0):
+    """Returns (user_ids, catalog_ids, dates) of about events purchases."""
+    rng = np.random.default_rng(seed)
+    per_pair = rng.integers(1, 20, size=max(events // 10, 1))
+    per_pair = per_pair[:np.searchsorted(np.cumsum(per_pair), events) + 1]
+    pairs = len(per_pair)
+    pair_users = rng.integers(1, users + 1, size=pairs)
+    pair_items = rng.zipf(1.3, size=pairs) % items + 1
+    periods = rng.uniform(2, 30, size=pairs)
+    starts = NOW - per_pair * periods * restock.DAY
+
+    pair = np.repeat(np.arange(pairs), per_pair)
+    nth = np.arange(len(pair)) - np.repeat(np.cumsum(per_pair) - per_pair,
+                                           per_pair)
+    jitter = rng.normal(0, 0.15, size=len(pair)) * periods[pair]
+    dates = starts[pair] + (nth * periods[pair] + jitter) * restock.DAY
+    return (pair_users[pair].astype(np.int64),
+            pair_items[pair].astype(np.int64),
+            dates.astype(np.int64))
+
+
+def python_estimate(user_ids, catalog_ids, dates, now):
+    """The same estimate as a per-row Python group-by, for comparison."""
+    groups = defaultdict(set)
+    for user_id, catalog_id, date in zip(user_ids.tolist(),
+                                         catalog_ids.tolist(), dates.tolist()):
+        groups[(user_id, catalog_id)].add(date // restock.DAY)
+    predictions = []
+    for (user_id, catalog_id), days in groups.items():
+        if len(days) < restock.MIN_PURCHASES:
+            continue
+        days = sorted(days)
+        gaps = [min(max(b - a, 1), restock.MAX_INTERVAL_DAYS)
+                for a, b in zip(days, days[1:])]
+        mean = sum(gaps) / len(gaps)
+        std = math.sqrt(max(sum(gap * gap for gap in gaps) / len(gaps)
+                            - mean * mean, 0))
+        runout = days[-1] + mean
+        if runout + restock.STALE_INTERVALS * mean >= now / restock.DAY:
+            predictions.append((user_id, catalog_id, len(days), mean, std,
+                                days[-1] * restock.DAY,
+                                round(runout * restock.DAY)))
+    return predictions
+
+
+def _time(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def _load(database_url, history):
+    app = create_bench_app(database_url)
+    engine = create_engine(database_url)
+    user_ids, catalog_ids, dates = history
+    with app.app_context():
+        from ..database.models import db
+        db.drop_all()
+        db.create_all()
+    users = sorted(set(user_ids.tolist()))
+    items = sorted(set(catalog_ids.tolist()))
+    with engine.begin() as connection:
+        connection.execute(text(
+            'INSERT INTO users (id, first_name, last_name, change_seq) '
+            'VALUES (:id, :name, :name, 0)'),
+            [{'id': user_id, 'name': 'user'} for user_id in users])
+        connection.execute(text(
+            'INSERT INTO catalog (id, name, normalized_name, name_hash) '
+            'VALUES (:id, :name, :name, :name)'),
+            [{'id': item, 'name': 'item {}'.format(item)} for item in items])
+        connection.execute(text(
+            'INSERT INTO products (id, name, catalog_id, date_purchased) '
+            'VALUES (:id, :name, :catalog_id, :date_purchased)'),
+            [{'id': index + 1, 'name': 'item', 'catalog_id': catalog_id,
+              'date_purchased': date}
+             for index, (catalog_id, date) in enumerate(
+                 zip(catalog_ids.tolist(), dates.tolist()))])
+        connection.execute(text(
+            'INSERT INTO user_products (user_id, product_id) '
+            'VALUES (:user_id, :product_id)'),
+            [{'user_id': user_id, 'product_id': index + 1}
+             for index, user_id in enumerate(user_ids.tolist())])
+    return engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', default='1000000,5000000')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--python-sample', type=int, default=200000)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/restock.db'))
+    parser.add_argument('--db-events', type=int, default=200000)
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    report = {'meta': {'users': args.users, 'now': NOW}, 'estimate': {}}
+    for events in [int(count) for count in args.events.split(',')]:
+        history = synthetic_history(events, args.users)
+        result, seconds = _time(restock.estimate, *history, now=NOW)
+        report['estimate'][str(events)] = {
+            'purchases': len(history[0]),
+            'predictions': len(result['user_id']),
+            'numpy_s': round(seconds, 3),
+            'purchases_per_s': round(len(history[0]) / seconds),
+        }
+
+    sample = synthetic_history(args.python_sample, args.users)
+    vectorized, numpy_s = _time(restock.estimate, *sample, now=NOW)
+    looped, python_s = _time(python_estimate, *sample, now=NOW)
+    report['python_sample'] = {
+        'purchases': len(sample[0]),
+        'numpy_s': round(numpy_s, 3),
+        'python_s': round(python_s, 3),
+        'speedup': round(python_s / numpy_s, 1),
+        'same_predictions': len(looped) == len(vectorized['user_id']) and
+        sorted(looped)[0][:3] == min(zip(
+            vectorized['user_id'].tolist(), vectorized['catalog_id'].tolist(),
+            vectorized['purchases'].tolist())),
+    }
+
+    if args.db_events:
+        history = synthetic_history(args.db_events, args.users)
+        engine, load_s = _time(_load, args.database_url, history)
+        result, seconds = _time(restock.run, engine, now=NOW)
+        report['end_to_end'] = dict(result, total_s=round(seconds, 3),
+                                    seed_s=round(load_s, 3),
+                                    database=engine.dialect.name)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Search latency benchmark.
+
+    Seeds --rows products and users (1M by default), then times product
+    and user searches through app.search.search and, for comparison, the
+    old unindexed ILIKE '%term%' scan. Reports per-query-kind latency
+    percentiles as JSON. On PostgreSQL, run the migrations first so the
+    pg_trgm and tsvector indexes exist.
+
+    Usage (from the App/ directory):
+        python -m app.bench.search --database-url sqlite:////tmp/search.db
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from .load import percentile
+from .seed import create_bench_app, seed, PRODUCT_NAMES, LAST_NAMES
+from ..database.models import db, User, Product
+from ..search import search
+
+
+def _terms(rng, count):
+    """Mix of whole words, prefixes, mid-word fragments and typos, which
+    is what a search box sees per keystroke."""
+    terms = []
+    for _ in range(count):
+        word = rng.choice(PRODUCT_NAMES + LAST_NAMES).split()[0].lower()
+        kind = rng.randrange(4)
+        if kind == 0:
+            terms.append(word)
+        elif kind == 1:
+            terms.append(word[:rng.randint(2, len(word))])
+        elif kind == 2 and len(word) > 4:
+            terms.append(word[1:-1])
+        else:
+            position = rng.randrange(len(word))
+            terms.append(word[:position] + 'x' + word[position + 1:])
+    return terms
+
+
+def _time(fn, terms):
+    timings = []
+    for term in terms:
+        started = time.perf_counter()
+        fn(term)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'queries': len(timings),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+    }
+
+
+def _ilike_products(term):
+    return Product.query.filter(
+        Product.name.ilike('%{}%'.format(term))).limit(20).all()
+
+
+def _ilike_users(term):
+    return User.query.filter(
+        User.last_name.ilike('%{}%'.format(term))).limit(20).all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/search.db'))
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--skip-baseline', action='store_true')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    rng = random.Random(1)
+    report = {'meta': {'rows': args.rows,
+                       'database': db.engine.dialect.name}}
+    with app.app_context():
+        if not args.skip_seed:
+            seed(users=args.rows, products=args.rows, links=0)
+
+        search.reset_fallback_indexes()
+        if db.engine.dialect.name != 'postgresql':
+            started = time.perf_counter()
+            search.fallback_index('products')
+            search.fallback_index('users')
+            report['fallback_index_build_s'] = round(
+                time.perf_counter() - started, 3)
+
+        terms = _terms(rng, args.queries)
+        report['products'] = _time(search.search_products, terms)
+        report['users'] = _time(search.search_users, terms)
+        if not args.skip_baseline:
+            report['products_ilike_scan'] = _time(_ilike_products, terms)
+            report['users_ilike_scan'] = _time(_ilike_users, terms)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Synthetic data seeding for the benchmark suite.
+
+    Fills users, products and user_products with deterministic fake rows
+    so load test results are comparable between runs.
+
+    Usage (from the App/ directory):
+        python -m app.bench.seed --database-url sqlite:////tmp/myfridge.db \\
+            --users 1000 --products 10000 --links 50000
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from flask import Flask
+
+from ..database.models import db, setup_db, User, Product, user_products
+
+
+FIRST_NAMES = ['Ada', 'Ben', 'Chloe', 'Dev', 'Emma', 'Femi', 'Grace',
+               'Hiro', 'Ines', 'Jared', 'Kofi', 'Lena', 'Maya', 'Noah']
+LAST_NAMES = ['Adams', 'Brown', 'Chen', 'Diaz', 'Evans', 'Fischer',
+              'Garcia', 'Huang', 'Ito', 'Jones', 'Khan', 'Lopez']
+PRODUCT_NAMES = ['Whole Milk', 'Skim Milk', 'Eggs', 'Cheddar Cheese',
+                 'Greek Yogurt', 'Butter', 'Orange Juice', 'Bread',
+                 'Chicken Breast', 'Ground Beef', 'Spinach', 'Apples',
+                 'Bananas', 'Tomatoes', 'Lettuce', 'Carrots', 'Salmon']
+WEIGHTS = ['250g', '500g', '1kg', '2kg', '1L', '2L', '12pk']
+
+CHUNK_SIZE = 5000
+
+
+def create_bench_app(database_path):
+    """Returns a bare Flask app bound to database_path with all tables."""
+    app = Flask(__name__)
+    setup_db(app, database_path=database_path)
+    return app
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _insert(table, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(table.insert(), chunk)
+
+
+def seed(users=1000, products=10000, links=50000, seed=0):
+    """Inserts synthetic rows in bulk and returns the id ranges used.
+
+    Must be called inside an application context. Existing rows are
+    dropped first so every run starts from the same state.
+    """
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    user_rows = [{
+        'id': i,
+        'first_name': rng.choice(FIRST_NAMES),
+        'last_name': rng.choice(LAST_NAMES),
+        'age': rng.randint(18, 90)
+    } for i in range(1, users + 1)]
+    product_rows = [{
+        'id': i,
+        'name': '{} {}'.format(rng.choice(PRODUCT_NAMES), rng.choice(WEIGHTS)),
+        'weight': rng.choice(WEIGHTS),
+        'quantity': str(rng.randint(1, 12)),
+        'date_purchased': 1600000000 + rng.randint(0, 365 * 86400)
+    } for i in range(1, products + 1)]
+
+    links = min(links, users * products)
+    pairs = set()
+    while len(pairs) < links:
+        pairs.add((rng.randint(1, users), rng.randint(1, products)))
+    link_rows = [{'user_id': u, 'product_id': p} for u, p in sorted(pairs)]
+
+    _insert(User.__table__, user_rows)
+    _insert(Product.__table__, product_rows)
+    _insert(user_products, link_rows)
+    db.session.commit()
+
+    # Explicit ids leave Postgres sequences behind, resync them so
+    # routes that insert keep working against the seeded database.
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('users', 'products'):
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "(SELECT MAX(id) FROM {0}))".format(table))
+        db.session.commit()
+
+    return {'users': users, 'products': products, 'links': len(link_rows)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'sqlite:////tmp/myfridge.db'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--links', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        started = time.perf_counter()
+        scale = seed(args.users, args.products, args.links, args.seed)
+        scale['seconds'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(scale))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+from .models import db
+from . import changes, listeners, outbox
+
+
+'''
+Product archive
+
+    products and user_products only hold items purchased within the
+    retention horizon. archive_products() moves older ones, in batches of
+    one transaction each, to products_archive and user_products_archive,
+    keeping their ids. Listings, search and the sync snapshot read the
+    hot tables only; history() reads across both.
+
+    To users holding them, moved products are deletions: they are
+    recorded in database.changes and published as product.archived
+    through database.outbox.
+'''
+
+DAY = 86400
+RETENTION_DAYS = int(os.environ.get('PRODUCT_RETENTION_DAYS', 365))
+BATCH_SIZE = 1000
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+COLUMNS = ('id', 'name', 'weight', 'quantity', 'date_purchased',
+           'image_link', 'catalog_id')
+
+
+def _expanding(statement):
+    return text(statement).bindparams(bindparam('ids', expanding=True))
+
+
+def _move_batch(before, batch_size, now):
+    session = db.session
+    lock = ''
+    if session.get_bind().dialect.name == 'postgresql':
+        # Concurrent runs take disjoint batches, and an item being edited
+        # waits for the next run.
+        lock = ' FOR UPDATE SKIP LOCKED'
+    ids = [row[0] for row in session.execute(text(
+        'SELECT id FROM products WHERE date_purchased < :before '
+        'ORDER BY date_purchased, id LIMIT :limit' + lock),
+        {'before': before, 'limit': batch_size})]
+    if not ids:
+        return []
+    changes.record_products(ids, changes.DELETE)
+    columns = ', '.join(COLUMNS)
+    session.execute(_expanding(
+        'INSERT INTO products_archive ({0}, archived_at) '
+        'SELECT {0}, :now FROM products WHERE id IN :ids'.format(columns)),
+        {'ids': ids, 'now': now})
+    session.execute(_expanding(
+        'INSERT INTO user_products_archive (user_id, product_id) '
+        'SELECT user_id, product_id FROM user_products '
+        'WHERE product_id IN :ids'), {'ids': ids})
+    # The user_products rows go with the ON DELETE CASCADE.
+    moved = sorted(row[0] for row in session.execute(_expanding(
+        'DELETE FROM products WHERE id IN :ids RETURNING id'), {'ids': ids}))
+    outbox.append(('product.archived', product_id, {'id': product_id})
+                  for product_id in moved)
+    session.commit()
+    listeners.deleted('products', moved)
+    return moved
+
+
+"""
+archive_products(before, batch_size, max_batches)
+    moves products purchased before a time to the archive
+
+    Keyword arguments:
+    before -- epoch seconds, now minus RETENTION_DAYS if None
+    batch_size -- products moved per transaction
+    max_batches -- stop after this many batches, all if None
+    Return: dict with the products and batches moved and seconds taken
+"""
+def archive_products(before=None, batch_size=BATCH_SIZE, max_batches=None):
+    if before is None:
+        before = int(time.time()) - RETENTION_DAYS * DAY
+    started = time.perf_counter()
+    moved = batches = 0
+    now = datetime.utcnow()
+    while max_batches is None or batches < max_batches:
+        ids = _move_batch(before, batch_size, now)
+        if not ids:
+            break
+        moved += len(ids)
+        batches += 1
+    return {'before': before, 'moved': moved, 'batches': batches,
+            'elapsed_s': round(time.perf_counter() - started, 3)}
+
+
+"""
+history(user_id, limit, before)
+    a user's products, current and archived, most recently purchased
+    first
+
+    Keyword arguments:
+    user_id -- owner of the products
+    limit -- products per page
+    before -- cursor of the previous page, None for the first
+    Return: (list of product dicts with an 'archived' flag, cursor of the
+        next page or None)
+"""
+def history(user_id, limit=DEFAULT_LIMIT, before=None):
+    condition = ''
+    parameters = {'user_id': user_id, 'limit': limit + 1}
+    if before is not None:
+        # Keyset pagination on (purchased, id) over the union.
+        condition = ('AND (COALESCE(p.date_purchased, 0) < :date OR '
+                     '(COALESCE(p.date_purchased, 0) = :date '
+                     'AND p.id < :id)) ')
+        parameters['date'], parameters['id'] = before
+    columns = ', '.join('p.' + column for column in COLUMNS)
+    # Each side is cut to a page before the union is sorted, so a page
+    # costs the same however long the history.
+    select = ('SELECT * FROM (SELECT {columns}, {archived} AS archived, '
+              'COALESCE(p.date_purchased, 0) AS purchased '
+              'FROM {products} p JOIN {links} l ON l.product_id = p.id '
+              'WHERE l.user_id = :user_id ' + condition +
+              'ORDER BY purchased DESC, p.id DESC LIMIT :limit) {alias} ')
+    rows = db.session.execute(text(
+        select.format(columns=columns, archived=0, products='products',
+                      links='user_products', alias='hot') +
+        'UNION ALL ' +
+        select.format(columns=columns, archived=1,
+                      products='products_archive',
+                      links='user_products_archive', alias='archived') +
+        'ORDER BY purchased DESC, id DESC LIMIT :limit'),
+        parameters).fetchall()
+
+    products = [dict(zip(COLUMNS, row[:-2]), archived=bool(row[-2]))
+                for row in rows[:limit]]
+    cursor = None
+    if len(rows) > limit:
+        last = products[-1]
+        cursor = (last['date_purchased'] or 0, last['id'])
+    return products, cursor
+
+
+def parse_cursor(value):
+    """(date, id) from the 'DATE:ID' form of a history cursor, raises
+    ValueError on anything else."""
+    date, _, product_id = value.partition(':')
+    return int(date), int(product_id)
+
+
+def format_cursor(cursor):
+    return None if cursor is None else '{}:{}'.format(*cursor)
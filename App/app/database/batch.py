@@ -0,0 +1,178 @@
+from sqlalchemy import bindparam, text
+
+from .models import db, Product
+from . import catalog, changes, listeners, outbox
+
+
+'''
+Set-based product writes
+
+    Each call runs as a single SQL statement (per distinct set of patched
+    fields) instead of a SELECT, a flush and a commit per id. Links in
+    user_products are removed by the ON DELETE CASCADE foreign keys.
+    Users holding the products are told through database.changes and
+    downstream consumers through database.outbox.
+'''
+
+MAX_BATCH_SIZE = 1000
+
+PATCHABLE_FIELDS = {
+    'name': 'VARCHAR',
+    'weight': 'VARCHAR',
+    'quantity': 'VARCHAR',
+    'date_purchased': 'INTEGER',
+    'image_link': 'VARCHAR',
+}
+
+# Columns written alongside the patched ones, never taken from clients.
+COLUMN_TYPES = dict(PATCHABLE_FIELDS, catalog_id='INTEGER')
+
+
+def _is_postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+"""
+delete_products(ids)
+    deletes every product in ids with one DELETE statement
+
+    Keyword arguments:
+    ids -- list of product ids
+    Return: ids that existed and were deleted
+"""
+def delete_products(ids):
+    if not ids:
+        return []
+    changes.record_products(ids, changes.DELETE)
+    if _is_postgres():
+        statement = text(
+            'DELETE FROM products WHERE id = ANY(:ids) RETURNING id')
+    else:
+        statement = text(
+            'DELETE FROM products WHERE id IN :ids RETURNING id'
+        ).bindparams(bindparam('ids', expanding=True))
+    result = db.session.execute(statement, {'ids': list(ids)})
+    deleted = sorted(row[0] for row in result)
+    outbox.append(('product.deleted', product_id, {'id': product_id})
+                  for product_id in deleted)
+    db.session.commit()
+    listeners.deleted('products', deleted)
+    return deleted
+
+
+"""
+update_products(patches)
+    applies field patches with one UPDATE ... FROM (VALUES ...) per
+    distinct set of patched fields, usually a single statement
+
+    Keyword arguments:
+    patches -- list of dicts with an 'id' and any of PATCHABLE_FIELDS
+    Return: ids that existed and were updated
+"""
+def update_products(patches):
+    renamed = [patch['name'] for patch in patches if 'name' in patch]
+    catalog_ids = catalog.upsert(renamed) if renamed else {}
+
+    groups = {}
+    for patch in patches:
+        if 'name' in patch:
+            patch = dict(patch, catalog_id=catalog_ids.get(
+                catalog.normalize_name(patch['name'])))
+        fields = tuple(sorted(key for key in patch if key != 'id'))
+        groups.setdefault(fields, []).append(patch)
+
+    updated = {}
+    for fields, rows in groups.items():
+        if not fields:
+            continue
+        for row in _update_group(fields, rows):
+            updated[row['id']] = row
+    changes.record_products(updated)
+    outbox.append(('product.updated', product_id, row)
+                  for product_id, row in sorted(updated.items()))
+    db.session.commit()
+    listeners.written('products', updated.values())
+    return sorted(updated)
+
+
+def _update_group(fields, rows):
+    values = []
+    params = {}
+    for index, row in enumerate(rows):
+        casts = ['CAST(:id_{} AS INTEGER)'.format(index)]
+        params['id_{}'.format(index)] = row['id']
+        for field in fields:
+            key = '{}_{}'.format(field, index)
+            casts.append('CAST(:{} AS {})'.format(key, COLUMN_TYPES[field]))
+            params[key] = row[field]
+        values.append('({})'.format(', '.join(casts)))
+
+    statement = text(
+        'WITH v (id, {columns}) AS (VALUES {values}) '
+        'UPDATE products SET {assignments} FROM v '
+        'WHERE products.id = v.id RETURNING {returning}'.format(
+            columns=', '.join(fields),
+            values=', '.join(values),
+            assignments=', '.join('{0} = v.{0}'.format(field)
+                                  for field in fields),
+            returning=', '.join('products.' + column.name
+                                for column in Product.__table__.columns)))
+    return [dict(row) for row in db.session.execute(statement, params)]
+
+
+"""
+insert_products(rows)
+    bulk import: resolves every name against the catalog with one upsert
+    and inserts the products with one multi-row INSERT per
+    MAX_BATCH_SIZE rows
+
+    Keyword arguments:
+    rows -- list of dicts with name, weight, quantity, date_purchased and
+        optionally image_link and barcode
+    Return: number of products inserted
+"""
+def insert_products(rows):
+    rows = [row for row in rows if row.get('name')]
+    if not rows:
+        return 0
+    catalog_ids = catalog.upsert(
+        [(row['name'], row.get('barcode')) for row in rows])
+    inserted = insert_product_rows([
+        dict(row, catalog_id=catalog_ids.get(
+            catalog.normalize_name(row['name']))) for row in rows])
+    db.session.commit()
+    listeners.written('products', inserted)
+    return len(inserted)
+
+
+"""
+insert_product_rows(rows)
+    inserts products with one multi-row INSERT ... RETURNING per
+    MAX_BATCH_SIZE rows, in the caller's transaction
+
+    Keyword arguments:
+    rows -- list of dicts keyed by product column name
+    Return: the inserted rows with their ids
+"""
+def insert_product_rows(rows):
+    columns = ('name', 'weight', 'quantity', 'date_purchased', 'image_link',
+               'catalog_id')
+    inserted = []
+    for start in range(0, len(rows), MAX_BATCH_SIZE):
+        values = []
+        params = {}
+        for index, row in enumerate(rows[start:start + MAX_BATCH_SIZE]):
+            values.append('({})'.format(', '.join(
+                'CAST(:{}_{} AS {})'.format(column, index,
+                                            COLUMN_TYPES[column])
+                for column in columns)))
+            for column in columns:
+                params['{}_{}'.format(column, index)] = row.get(column)
+        result = db.session.execute(text(
+            'INSERT INTO products ({}) VALUES {} RETURNING {}'.format(
+                ', '.join(columns), ', '.join(values),
+                ', '.join(column.name for column in Product.__table__.columns)
+            )), params)
+        inserted.extend(dict(row) for row in result)
+    outbox.append(('product.created', row['id'], row) for row in inserted)
+    return inserted
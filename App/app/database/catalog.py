@@ -0,0 +1,161 @@
+import hashlib
+import re
+import unicodedata
+
+from sqlalchemy import bindparam, text
+
+from .models import db
+
+
+'''
+Canonical product catalog
+
+    Every way a product enters the database (the product form, bulk
+    import, receipt ingestion) resolves its name to a catalog row here,
+    so "Whole Milk 2L", "whole milk 2 l" and "WHOLE-MILK 2L" share one
+    catalog id instead of each minting its own identity.
+'''
+
+_SEPARATORS = re.compile(r'[^\w]+|_', re.UNICODE)
+_SPACED_UNIT = re.compile(
+    r'(\d) (ml|l|g|kg|mg|oz|lb|lbs|ct|pk|pack)\b')
+
+
+"""
+normalize_name(name)
+    canonical form of a product name used for matching
+
+    Keyword arguments:
+    name -- product name as typed or read off a receipt
+    Return: NFKC folded, lower-cased name with punctuation collapsed to
+        single spaces and units joined to their amount ("2 l" -> "2l")
+"""
+def normalize_name(name):
+    name = unicodedata.normalize('NFKC', name or '').lower()
+    name = ' '.join(_SEPARATORS.sub(' ', name).split())
+    return _SPACED_UNIT.sub(r'\1\2', name)
+
+
+def name_hash(normalized_name):
+    return hashlib.sha1(normalized_name.encode('utf-8')).hexdigest()
+
+
+"""
+upsert(items)
+    resolves names (and optional barcodes) to catalog ids, inserting the
+    ones not seen before with a single INSERT ... ON CONFLICT DO NOTHING
+    and reading back the rest
+
+    Keyword arguments:
+    items -- iterable of names or of (name, barcode) pairs
+    Return: dict of normalized name to catalog id
+
+    Runs in the caller's transaction and does not commit.
+"""
+def upsert(items):
+    entries = {}
+    for item in items:
+        name, barcode = item if isinstance(item, tuple) else (item, None)
+        normalized = normalize_name(name)
+        if not normalized:
+            continue
+        entry = entries.setdefault(normalized, {
+            'name': ' '.join(name.split()),
+            'normalized_name': normalized,
+            'name_hash': name_hash(normalized),
+            'barcode': None,
+        })
+        entry['barcode'] = entry['barcode'] or barcode or None
+    if not entries:
+        return {}
+
+    ids = {}
+    barcodes = {}
+    # Entries sharing a barcode are one item, the first one's name wins
+    # as it would against a row already holding the barcode.
+    aliases = {}
+    for normalized, entry in entries.items():
+        if entry['barcode'] in barcodes:
+            aliases[normalized] = barcodes[entry['barcode']]
+        elif entry['barcode']:
+            barcodes[entry['barcode']] = normalized
+    if barcodes:
+        # A known barcode wins over the name, a receipt may abbreviate
+        # what the barcode already identifies.
+        result = db.session.execute(text(
+            'SELECT id, barcode FROM catalog WHERE barcode IN :barcodes'
+        ).bindparams(bindparam('barcodes', expanding=True)),
+            {'barcodes': list(barcodes)})
+        for catalog_id, barcode in result:
+            ids[barcodes[barcode]] = catalog_id
+
+    pending = [entry for normalized, entry in entries.items()
+               if normalized not in ids and normalized not in aliases]
+    if pending:
+        values = []
+        params = {}
+        for index, entry in enumerate(pending):
+            values.append('(:name_{0}, :normalized_name_{0}, :name_hash_{0}, '
+                          ':barcode_{0})'.format(index))
+            for key, value in entry.items():
+                params['{}_{}'.format(key, index)] = value
+        # DO NOTHING leaves rows that already exist untouched: updating
+        # them just to have them returned would rewrite and lock a hot
+        # catalog row on every insert of a common item. It has no conflict
+        # target so a barcode inserted concurrently is skipped too instead
+        # of failing the caller's transaction.
+        result = db.session.execute(text(
+            'INSERT INTO catalog (name, normalized_name, name_hash, barcode) '
+            'VALUES {} '
+            'ON CONFLICT DO NOTHING '
+            'RETURNING id, normalized_name'.format(', '.join(values))), params)
+        for catalog_id, normalized in result:
+            ids[normalized] = catalog_id
+
+    existing = [entry for entry in pending
+                if entry['normalized_name'] not in ids]
+    if existing:
+        by_hash = {entry['name_hash']: entry for entry in existing}
+        by_barcode = {entry['barcode']: entry for entry in existing
+                      if entry['barcode']}
+        result = db.session.execute(text(
+            'SELECT id, name_hash, barcode FROM catalog '
+            'WHERE name_hash IN :hashes OR barcode IN :barcodes'
+        ).bindparams(bindparam('hashes', expanding=True),
+                     bindparam('barcodes', expanding=True)),
+            {'hashes': list(by_hash), 'barcodes': list(by_barcode) or ['']})
+        rows = result.fetchall()
+        taken = {barcode for _, _, barcode in rows if barcode}
+        for catalog_id, row_hash, barcode in rows:
+            if barcode in by_barcode:
+                ids[by_barcode[barcode]['normalized_name']] = catalog_id
+        filled = []
+        for catalog_id, row_hash, barcode in rows:
+            entry = by_hash.get(row_hash)
+            if entry is None or entry['normalized_name'] in ids:
+                continue
+            ids[entry['normalized_name']] = catalog_id
+            if barcode is None and entry['barcode'] and \
+                    entry['barcode'] not in taken:
+                filled.append({'id': catalog_id, 'barcode': entry['barcode']})
+        if filled:
+            # Only rows gaining a barcode are written, and only with one
+            # no other row holds.
+            db.session.execute(text(
+                'UPDATE catalog SET barcode = :barcode '
+                'WHERE id = :id AND barcode IS NULL AND NOT EXISTS '
+                '(SELECT 1 FROM catalog AS other '
+                'WHERE other.barcode = :barcode)'), filled)
+
+    for alias, normalized in aliases.items():
+        if normalized in ids:
+            ids[alias] = ids[normalized]
+    return ids
+
+
+"""
+catalog_id_for(name, barcode)
+    catalog id of a single product name, see upsert()
+"""
+def catalog_id_for(name, barcode=None):
+    return upsert([(name, barcode)]).get(normalize_name(name))
@@ -0,0 +1,266 @@
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import bindparam, event, inspect, text
+
+from .models import db, Product, User
+from .routing import RoutingSession
+
+
+'''
+Inventory change log
+
+    Every write that touches a product in a user's inventory appends a
+    (user, product, op) row to the changes table in the same transaction,
+    stamped with the user's change_seq, which the write bumps once. Row
+    locking the user while bumping orders concurrent writers, so a user's
+    sequence numbers are contiguous and become visible in order, and a
+    client that has seen seq N has seen everything up to N.
+
+    ORM writes are recorded from session flush events, set-based writes
+    (database.batch, database.ingest) call record_products() and
+    record_links() themselves.
+
+    snapshot() and changes_since() read from the primary even on GET: a
+    cursor read from one replica and rows from another, or a cursor from
+    a replica fresher than the next request's, would skip changes.
+'''
+
+UPSERT = 'u'
+DELETE = 'd'
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+FIELDS = ('id', 'name', 'weight', 'quantity', 'date_purchased',
+          'image_link', 'catalog_id')
+
+
+class CursorExpired(Exception):
+    """Raised when changes after a cursor have been pruned, the client
+    has to start over from a full snapshot."""
+
+
+def _expanding(statement, *names):
+    return text(statement).bindparams(
+        *[bindparam(name, expanding=True) for name in names])
+
+
+"""
+record(entries, session)
+    appends changes to the log, bumping each affected user's change_seq
+
+    Keyword arguments:
+    entries -- iterable of (user_id, product_id, op), the last op given
+        for a (user, product) pair wins
+    session -- session whose transaction to write in, db.session if None
+    Return: dict of user id to its new change_seq
+
+    Runs in the caller's transaction and does not commit.
+"""
+def record(entries, session=None):
+    session = session or db.session
+    ops = OrderedDict()
+    for user_id, product_id, op in entries:
+        ops[(user_id, product_id)] = op
+    if not ops:
+        return {}
+
+    user_ids = sorted({user_id for user_id, _ in ops})
+    if session.get_bind().dialect.name == 'postgresql':
+        # Take the row locks in id order so writers touching the same
+        # users queue up instead of deadlocking.
+        session.execute(_expanding(
+            'SELECT id FROM users WHERE id IN :ids ORDER BY id FOR UPDATE',
+            'ids'), {'ids': user_ids})
+    seqs = dict(session.execute(_expanding(
+        'UPDATE users SET change_seq = change_seq + 1 WHERE id IN :ids '
+        'RETURNING id, change_seq', 'ids'), {'ids': user_ids}).fetchall())
+
+    now = datetime.utcnow()
+    rows = [{'user_id': user_id, 'seq': seqs[user_id],
+             'product_id': product_id, 'op': op, 'created_at': now}
+            for (user_id, product_id), op in ops.items() if user_id in seqs]
+    if rows:
+        session.execute(text(
+            'INSERT INTO changes (user_id, seq, product_id, op, created_at) '
+            'VALUES (:user_id, :seq, :product_id, :op, :created_at)'), rows)
+    return seqs
+
+
+"""
+record_products(product_ids, op)
+    records a write to products for every user holding them
+
+    Call before deleting, the links are gone afterwards.
+"""
+def record_products(product_ids, op=UPSERT, session=None):
+    session = session or db.session
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return {}
+    result = session.execute(_expanding(
+        'SELECT user_id, product_id FROM user_products '
+        'WHERE product_id IN :ids', 'ids'), {'ids': product_ids})
+    return record(((user_id, product_id, op)
+                   for user_id, product_id in result), session)
+
+
+"""
+record_links(user_id, product_ids, op)
+    records products added to (UPSERT) or removed from (DELETE) a user
+"""
+def record_links(user_id, product_ids, op=UPSERT):
+    return record((user_id, product_id, op)
+                  for product_id in sorted(set(product_ids)))
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def record_deleted_products(session, flush_context, instances):
+    ids = [target.id for target in session.deleted
+           if isinstance(target, Product) and target.id is not None]
+    if ids:
+        record_products(ids, DELETE, session)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_written_products(session, flush_context):
+    entries = []
+    written = []
+    for target in list(session.new) + list(session.dirty):
+        if isinstance(target, User) and target not in session.deleted:
+            history = inspect(target).attrs.products.history
+            entries.extend((target.id, product.id, UPSERT)
+                           for product in history.added or ())
+            entries.extend((target.id, product.id, DELETE)
+                           for product in history.deleted or ())
+        elif isinstance(target, Product) and target not in session.deleted:
+            history = inspect(target).attrs.users.history
+            entries.extend((user.id, target.id, UPSERT)
+                           for user in history.added or ())
+            entries.extend((user.id, target.id, DELETE)
+                           for user in history.deleted or ())
+            if target in session.new or \
+                    session.is_modified(target, include_collections=False):
+                written.append(target.id)
+    if written:
+        result = session.execute(_expanding(
+            'SELECT user_id, product_id FROM user_products '
+            'WHERE product_id IN :ids', 'ids'), {'ids': sorted(written)})
+        entries.extend((user_id, product_id, UPSERT)
+                       for user_id, product_id in result)
+    if entries:
+        record(entries, session)
+
+
+def _product_rows(user_id, product_ids=None):
+    """Rows of FIELDS values of the user's products, all of them when
+    product_ids is None."""
+    statement = (
+        'SELECT {} FROM products JOIN user_products '
+        'ON user_products.product_id = products.id '
+        'WHERE user_products.user_id = :user_id '.format(
+            ', '.join('products.' + field for field in FIELDS)))
+    params = {'user_id': user_id}
+    if product_ids is None:
+        statement = text(statement + 'ORDER BY products.id')
+    else:
+        statement = _expanding(
+            statement + 'AND products.id IN :ids ORDER BY products.id', 'ids')
+        params['ids'] = product_ids
+    return [list(row) for row in db.session.execute(statement, params)]
+
+
+"""
+snapshot(user_id)
+    a user's whole inventory in the changes_since() encoding, the
+    starting point for a client without a cursor
+"""
+def snapshot(user_id):
+    db.session().use_primary()
+    # The cursor is read first: a write landing in between is both in
+    # the snapshot and replayed after it, which is harmless.
+    cursor = db.session.execute(text(
+        'SELECT change_seq FROM users WHERE id = :id'), {'id': user_id}
+    ).scalar()
+    return {
+        'cursor': cursor,
+        'more': False,
+        'fields': FIELDS,
+        'upserts': _product_rows(user_id),
+        'deletes': [],
+    }
+
+
+"""
+changes_since(user_id, since, limit)
+    what changed in a user's inventory after a cursor
+
+    Keyword arguments:
+    user_id -- owner of the inventory
+    since -- cursor returned by the previous call, or by snapshot()
+    limit -- soft cap on change rows read, a page always ends on a whole
+        write so it may run over
+    Return: dict with the next cursor, whether more changes follow,
+        upserts as rows of FIELDS values and deletes as product ids
+
+    Raises CursorExpired if the changes after since were pruned.
+"""
+def changes_since(user_id, since, limit=DEFAULT_LIMIT):
+    limit = max(1, min(limit, MAX_LIMIT))
+    db.session().use_primary()
+    # Read before the log so that every change up to it is in the rows.
+    current = db.session.execute(text(
+        'SELECT change_seq FROM users WHERE id = :id'), {'id': user_id}
+    ).scalar() or 0
+    rows = db.session.execute(text(
+        'SELECT seq, product_id, op FROM changes '
+        'WHERE user_id = :user_id AND seq > :since '
+        'ORDER BY seq, id LIMIT :limit'),
+        {'user_id': user_id, 'since': since, 'limit': limit + 1}).fetchall()
+
+    more = len(rows) > limit
+    if more:
+        last = rows[limit - 1][0]
+        rows = [row for row in rows if row[0] < last] + \
+            db.session.execute(text(
+                'SELECT seq, product_id, op FROM changes '
+                'WHERE user_id = :user_id AND seq = :seq ORDER BY id'),
+                {'user_id': user_id, 'seq': last}).fetchall()
+        more = rows[-1][0] < current
+
+    # A user's seqs have no gaps, a missing one was pruned.
+    if rows[0][0] != since + 1 if rows else since < current:
+        raise CursorExpired(since)
+
+    latest = OrderedDict()
+    for _, product_id, op in rows:
+        latest.pop(product_id, None)
+        latest[product_id] = op
+    upserted = sorted(product_id for product_id, op in latest.items()
+                      if op == UPSERT)
+    upserts = _product_rows(user_id, upserted) if upserted else []
+    # Written and then removed in a later page, or no longer linked.
+    found = {row[0] for row in upserts}
+    deletes = sorted(product_id for product_id, op in latest.items()
+                     if op == DELETE or (op == UPSERT and
+                                         product_id not in found))
+    return {
+        'cursor': rows[-1][0] if rows else since,
+        'more': more,
+        'fields': FIELDS,
+        'upserts': upserts,
+        'deletes': deletes,
+    }
+
+
+"""
+prune(before)
+    deletes change rows older than a datetime, clients with an older
+    cursor get CursorExpired and resync from a snapshot
+
+    Return: number of rows deleted
+"""
+def prune(before):
+    result = db.session.execute(text(
+        'DELETE FROM changes WHERE created_at < :before'), {'before': before})
+    db.session.commit()
+    return result.rowcount
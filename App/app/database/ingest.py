@@ -0,0 +1,222 @@
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, text
+
+from .models import db, Product, user_products
+from . import batch, catalog, changes, listeners, outbox
+
+
+'''
+Receipt to inventory ingestion
+
+    Turns parsed receipt line items into products linked to a user in one
+    transaction and a fixed number of statements regardless of how many
+    items the receipt has:
+
+    1. claim the (user, receipt hash) pair, a retry stops here and gets
+       the products the first attempt resolved to
+    2. resolve every item name against the catalog (one upsert), lines
+       for the same item and weight are combined, quantities summed
+    3. look up identical products the user already has (one SELECT)
+    4. insert the missing products (one multi-row INSERT)
+    5. link them all to the user (one multi-row INSERT) and append them
+       to the user's change log
+'''
+
+
+class UnknownUser(Exception):
+    """Raised when the receipt's user does not exist."""
+
+
+def _product_key(row):
+    return (row['catalog_id'], row.get('weight'), row.get('quantity'),
+            row.get('date_purchased'))
+
+
+def _number(quantity):
+    # A line without a quantity is one of the item.
+    if quantity is None:
+        return 1
+    if isinstance(quantity, (int, float)) and not isinstance(quantity, bool):
+        return quantity
+    for parse in (int, float):
+        try:
+            return parse(quantity)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _combine(wanted):
+    """Folds lines for the same catalog item and weight into the first of
+    them, summing their quantities. Lines whose quantity is not a number
+    are left as they are. Returns the combined rows and, for each line,
+    the index of the row it went into."""
+    rows, lines, positions, totals = [], [], {}, {}
+    for row in wanted:
+        amount = _number(row['quantity'])
+        key = (row['catalog_id'], row['weight'])
+        position = positions.get(key) if amount is not None else None
+        if position is None:
+            position = len(rows)
+            rows.append(dict(row))
+            if amount is not None:
+                positions[key] = position
+                totals[position] = amount
+        else:
+            totals[position] += amount
+            rows[position]['quantity'] = totals[position]
+        lines.append(position)
+    for row in rows:
+        if row['quantity'] is not None:
+            row['quantity'] = str(row['quantity'])
+    return rows, lines
+
+
+def _claim(user_id, receipt_hash):
+    """Inserts the receipt row, returns its id or None if it already
+    existed. A concurrent retry waits here for the first attempt's
+    transaction to finish, then sees the conflict."""
+    result = db.session.execute(text(
+        'INSERT INTO receipts (user_id, receipt_hash, created_at) '
+        'VALUES (:user_id, :receipt_hash, :created_at) '
+        'ON CONFLICT (user_id, receipt_hash) DO NOTHING RETURNING id'), {
+            'user_id': user_id,
+            'receipt_hash': receipt_hash,
+            'created_at': datetime.utcnow(),
+        })
+    row = result.first()
+    return row[0] if row else None
+
+
+"""
+existing_receipt(user_id, receipt_hash)
+    result of an already ingested receipt, or None
+
+    Lets callers skip OCR entirely when a retried upload is a replay.
+"""
+def existing_receipt(user_id, receipt_hash):
+    row = db.session.execute(text(
+        'SELECT id, product_ids FROM receipts '
+        'WHERE user_id = :user_id AND receipt_hash = :receipt_hash'), {
+            'user_id': user_id, 'receipt_hash': receipt_hash}).first()
+    if row is None:
+        return None
+    return {
+        'receipt_id': row[0],
+        'product_ids': json.loads(row[1] or '[]'),
+        'replayed': True,
+    }
+
+
+"""
+ingest_receipt(user_id, receipt_hash, items, date_purchased)
+    adds a receipt's line items to a user's inventory, exactly once
+
+    Keyword arguments:
+    user_id -- owner of the receipt
+    receipt_hash -- identity of the receipt, see ocr.receipts.receipt_hash
+    items -- list of dicts with name and optionally quantity and weight
+    date_purchased -- epoch seconds stamped on new products, now if None
+    Return: dict with receipt_id, product_ids (one per item, in order),
+        replayed and timings in milliseconds
+"""
+def ingest_receipt(user_id, receipt_hash, items, date_purchased=None):
+    started = time.perf_counter()
+    if date_purchased is None:
+        date_purchased = int(time.time())
+    items = [item for item in items if catalog.normalize_name(item.get('name'))]
+
+    if db.session.execute(text('SELECT 1 FROM users WHERE id = :id'),
+                          {'id': user_id}).first() is None:
+        raise UnknownUser(user_id)
+
+    try:
+        receipt_id = _claim(user_id, receipt_hash)
+        if receipt_id is None:
+            db.session.rollback()
+            result = existing_receipt(user_id, receipt_hash)
+            result['timings'] = {
+                'total_ms': round((time.perf_counter() - started) * 1000, 3)}
+            return result
+
+        catalog_ids = catalog.upsert([item['name'] for item in items])
+        wanted = []
+        for item in items:
+            wanted.append({
+                'name': ' '.join(item['name'].split()),
+                'weight': item.get('weight'),
+                'quantity': item.get('quantity'),
+                'date_purchased': date_purchased,
+                'catalog_id': catalog_ids[catalog.normalize_name(item['name'])],
+            })
+        wanted, lines = _combine(wanted)
+        resolved = time.perf_counter()
+
+        existing = {}
+        if wanted:
+            table = Product.__table__
+            result = db.session.execute(
+                select([table]).select_from(table.join(
+                    user_products, user_products.c.product_id == table.c.id))
+                .where(user_products.c.user_id == user_id)
+                .where(table.c.catalog_id.in_(
+                    bindparam('catalog_ids', expanding=True)))
+                .where(table.c.date_purchased == date_purchased),
+                {'catalog_ids': sorted({row['catalog_id'] for row in wanted})})
+            for row in result:
+                existing.setdefault(_product_key(dict(row)), row['id'])
+
+        missing = []
+        for row in wanted:
+            key = _product_key(row)
+            if key not in existing:
+                existing[key] = None
+                missing.append(row)
+        inserted = batch.insert_product_rows(missing)
+        for row in inserted:
+            existing[_product_key(row)] = row['id']
+        product_ids = [existing[_product_key(wanted[position])]
+                       for position in lines]
+        matched = time.perf_counter()
+
+        links = sorted(set(product_ids))
+        if links:
+            db.session.execute(text(
+                'INSERT INTO user_products (user_id, product_id) VALUES {} '
+                'ON CONFLICT DO NOTHING'.format(', '.join(
+                    '(:user_id, :product_{})'.format(index)
+                    for index in range(len(links))))),
+                dict({'user_id': user_id},
+                     **{'product_{}'.format(index): product_id
+                        for index, product_id in enumerate(links)}))
+            changes.record_links(user_id, links)
+        db.session.execute(text(
+            'UPDATE receipts SET product_ids = :product_ids WHERE id = :id'),
+            {'product_ids': json.dumps(product_ids), 'id': receipt_id})
+        outbox.append([('receipt.ingested', receipt_id, {
+            'receipt_id': receipt_id,
+            'user_id': user_id,
+            'product_ids': product_ids,
+        })])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    listeners.written('products', inserted)
+    finished = time.perf_counter()
+    return {
+        'receipt_id': receipt_id,
+        'product_ids': product_ids,
+        'replayed': False,
+        'created': len(inserted),
+        'timings': {
+            'resolve_ms': round((resolved - started) * 1000, 3),
+            'match_ms': round((matched - resolved) * 1000, 3),
+            'link_ms': round((finished - matched) * 1000, 3),
+            'total_ms': round((finished - started) * 1000, 3),
+        }
+    }
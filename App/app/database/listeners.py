@@ -0,0 +1,102 @@
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+
+from .models import User, Product
+from .routing import RoutingSession
+
+
+'''
+Write listeners
+
+    In-process structures derived from table contents (search and
+    autocomplete indexes, caches) register here to be told about writes.
+    ORM flushes are collected through mapper events and reported once
+    their transaction commits, and dropped if it rolls back; set-based
+    statements that bypass the ORM, such as those in database.batch,
+    report their affected rows explicitly through written() and
+    deleted() after committing.
+'''
+
+_write_listeners = defaultdict(list)
+_delete_listeners = defaultdict(list)
+# Session.info key of notifications waiting for their transaction.
+_PENDING = 'listeners_pending'
+
+
+"""
+on_write(table)
+    registers fn(rows) to be called with the new column values of rows
+    inserted or updated in table
+"""
+def on_write(table):
+    def register(fn):
+        _write_listeners[table].append(fn)
+        return fn
+    return register
+
+
+"""
+on_delete(table)
+    registers fn(ids) to be called with the ids of rows deleted from table
+"""
+def on_delete(table):
+    def register(fn):
+        _delete_listeners[table].append(fn)
+        return fn
+    return register
+
+
+def written(table, rows):
+    rows = list(rows)
+    if rows:
+        for fn in _write_listeners[table]:
+            fn(rows)
+
+
+def deleted(table, ids):
+    ids = list(ids)
+    if ids:
+        for fn in _delete_listeners[table]:
+            fn(ids)
+
+
+def column_values(target):
+    """Column values of a mapped instance by attribute name."""
+    return {attr.key: getattr(target, attr.key)
+            for attr in inspect(target).mapper.column_attrs}
+
+
+def _defer(target, notify, table, values):
+    # Values are taken at flush, the instance is expired by the commit.
+    pending = object_session(target).info.setdefault(_PENDING, [])
+    pending.append((notify, table, values))
+
+
+def _listen(model):
+    table = model.__tablename__
+
+    @event.listens_for(model, 'after_insert')
+    @event.listens_for(model, 'after_update')
+    def after_write(mapper, connection, target):
+        _defer(target, written, table, [column_values(target)])
+
+    @event.listens_for(model, 'after_delete')
+    def after_delete(mapper, connection, target):
+        _defer(target, deleted, table, [target.id])
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def notify_committed(session):
+    for notify, table, values in session.info.pop(_PENDING, ()):
+        notify(table, values)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop(_PENDING, None)
+
+
+_listen(Product)
+_listen(User)
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from .models import db, Product, User
+from . import listeners
+
+
+'''
+Primary key lookups
+
+    The per-id routes load one Product or User by id. Three layers, each
+    skipped when the one before it answers:
+
+    1. the session's identity map, which already holds every object the
+       current request loaded, so a second lookup of an id in one request
+       never reaches the database;
+    2. with PK_CACHE_TTL set, a process wide cache of column values kept
+       for that many seconds, for reads only (get(..., cached=True)).
+       Writes made through this process drop their entries through
+       database.listeners once committed, writes from other processes
+       are seen after at most PK_CACHE_TTL;
+    3. a baked query, whose SQL is compiled once per model instead of on
+       every request as Model.query.filter_by(id=...) is.
+'''
+
+PK_CACHE_TTL = float(os.environ.get('PK_CACHE_TTL', 0))
+PK_CACHE_SIZE = int(os.environ.get('PK_CACHE_SIZE', 10000))
+
+MODELS = {'products': Product, 'users': User}
+
+bakery = baked.bakery()
+
+
+def _by_id(model):
+    # Baked queries are cached by the lambdas' code, shared by every
+    # model here, so the model is added to the key.
+    query = bakery(lambda session: session.query(model), model)
+    query.add_criteria(lambda q: q.filter(model.id == bindparam('id')), model)
+    return query
+
+
+_queries = {model: _by_id(model) for model in MODELS.values()}
+
+
+class PKCache(object):
+    """Column values of rows by (table, id), each kept for ttl seconds.
+
+    A read that began before a commit can finish after the commit's
+    discard() and would store the old row again. Entries carry the
+    invalidation count at which they were last discarded, and set()
+    refuses values read before then: callers take token() before
+    querying and pass it to set()."""
+
+    def __init__(self, ttl, max_entries=PK_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # key: (expires, values or None when discarded, invalidation)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.invalidations = 0
+        # Tokens older than this are refused for every key, set when
+        # discarded entries are dropped to make room.
+        self.floor = 0
+        self.hits = self.misses = 0
+
+    def token(self):
+        return self.invalidations
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None and \
+                entry[0] > self.clock():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def set(self, key, values, token):
+        with self.lock:
+            entry = self.entries.get(key)
+            if token < self.floor or \
+                    (entry is not None and entry[2] > token):
+                return
+            if len(self.entries) >= self.max_entries:
+                self._make_room()
+            self.entries[key] = (self.clock() + self.ttl, values,
+                                 entry[2] if entry is not None else 0)
+
+    def _make_room(self):
+        now = self.clock()
+        for stale in [key for key, entry in self.entries.items()
+                      if entry[0] <= now]:
+            del self.entries[stale]
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        self.floor = self.invalidations
+
+    def discard(self, table, ids):
+        with self.lock:
+            self.invalidations += 1
+            for row_id in ids:
+                self.entries[(table, row_id)] = (0, None, self.invalidations)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.clear()
+            self.floor = self.invalidations
+
+
+_cache = PKCache(PK_CACHE_TTL) if PK_CACHE_TTL > 0 else None
+
+
+def cache():
+    return _cache
+
+
+def set_cache(pk_cache):
+    """Replaces the cross-request cache, None turns it off."""
+    global _cache
+    _cache = pk_cache
+
+
+def _attach(session, model, values):
+    # A detached copy built from cached values, merged without a SELECT.
+    instance = model.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(instance, key, value)
+    make_transient_to_detached(instance)
+    return session.merge(instance, load=False)
+
+
+"""
+get(model, row_id, cached)
+    a Product or User by id, None if there is none
+
+    Keyword arguments:
+    model -- Product or User
+    row_id -- primary key
+    cached -- may be answered from the cross-request cache, only for
+        reads that tolerate PK_CACHE_TTL of staleness
+    Return: instance attached to db.session
+"""
+def get(model, row_id, cached=False):
+    session = db.session()
+    instance = session.identity_map.get(identity_key(model, row_id))
+    if instance is not None:
+        return instance
+
+    pk_cache = _cache if cached else None
+    key = (model.__tablename__, row_id)
+    if pk_cache is not None:
+        values = pk_cache.get(key)
+        if values is not None:
+            return _attach(session, model, values)
+        token = pk_cache.token()
+
+    instance = _queries[model](session).params(id=row_id).one_or_none()
+    if pk_cache is not None and instance is not None:
+        pk_cache.set(key, listeners.column_values(instance), token)
+    return instance
+
+
+def get_product(product_id, cached=False):
+    return get(Product, product_id, cached)
+
+
+def get_user(user_id, cached=False):
+    return get(User, user_id, cached)
+
+
+def _register(table):
+    @listeners.on_write(table)
+    def uncache_written(rows):
+        if _cache is not None:
+            _cache.discard(table, [row['id'] for row in rows])
+
+    @listeners.on_delete(table)
+    def uncache_deleted(ids):
+        if _cache is not None:
+            _cache.discard(table, ids)
+
+
+for _table in MODELS:
+    _register(_table)
@@ -1,27 +1,75 @@
 import os
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, \
-  Table, create_engine
+import sqlite3
+from sqlalchemy import Column, String, Integer, DateTime, Float, \
+  ForeignKey, Index, Table, Text, UniqueConstraint, create_engine, event, \
+  inspect
+from sqlalchemy.engine import Engine
 from flask_sqlalchemy import SQLAlchemy
 import json
 from flask_migrate import Migrate
+from .routing import RoutingSQLAlchemy, init_replicas
 
 database_name = "myfridge"
-database_path = "postgresql://{}/{}".format('localhost:5432', database_name)
+default_database_path = "postgresql://{}/{}".format('localhost:5432',
+  database_name)
+database_path = os.environ.get('DATABASE_URL', default_database_path)
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
+# Off under manage.py, where Flask-Migrate creates the schema.
+create_tables = True
+
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, GET requests
+    read from DATABASE_REPLICA_URLS when set, see database.routing
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replica_paths=None):
+    # Read at call time so DATABASE_URL can be set after this module loads.
+    database_path = database_path or \
+        os.environ.get('DATABASE_URL', default_database_path)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if not database_path.startswith('sqlite'):
+        # Sized per worker process by gunicorn.conf.py, cooperative workers
+        # multiplex many requests over one pool so they need a larger one.
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_pre_ping': True
+        })
+    if database_path.startswith('postgresql'):
+        # Lets psycopg2 send executemany() batches as multi-row VALUES
+        # instead of one round trip per row.
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].setdefault(
+            'executemany_mode', 'values')
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].setdefault(
+            'executemany_values_page_size', 10000)
+    init_replicas(app, db, replica_paths)
     db.app = app
     db.init_app(app)
     migrate.init_app(app, db)
-    db.create_all()
+    # A database with an alembic_version table is migrated with
+    # manage.py db upgrade. Tables created here ahead of it would make
+    # its create_table steps fail, and create_all() cannot add columns
+    # to tables that already exist anyway.
+    if create_tables and \
+            'alembic_version' not in inspect(db.engine).get_table_names():
+        db.create_all()
+
+
+'''
+SQLite only enforces foreign keys, and so ON DELETE CASCADE on
+user_products, when asked to on every connection
+'''
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 
 """
@@ -38,6 +86,34 @@ def db_drop_and_create_all():
     db.create_all()
 
 
+'''
+CatalogItem
+
+    canonical identity of a product: one row per normalized name, shared
+    by every Product row (purchase) of that item. name_hash is the SHA-1
+    of normalized_name and carries the unique index upserts conflict on.
+'''
+class CatalogItem(db.Model):
+  __tablename__ = 'catalog'
+
+  id = Column(Integer, primary_key=True)
+  name = Column(String, nullable=False)
+  normalized_name = Column(String, nullable=False)
+  name_hash = Column(String(40), nullable=False, unique=True)
+  barcode = Column(String, unique=True)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'name': self.name,
+      'normalized_name': self.normalized_name,
+      'barcode': self.barcode
+    }
+
+  def __repr__(self):
+        return f'<CatalogItem {self.id}: {self.name}>'
+
+
 '''
 User-Product association table
 '''
@@ -62,6 +138,8 @@ class User(db.Model):
   current_products = Column(String)
   past_products = Column(String)
   date_registered = Column(DateTime)
+  # Bumped by every write to this user's inventory, see Change.
+  change_seq = Column(Integer, nullable=False, default=0, server_default='0')
 
   def __init__(self, first_name, last_name, age):
     self.first_name = first_name
@@ -107,15 +185,20 @@ class Product(db.Model):
   name = Column(String)
   weight = Column(String)
   quantity = Column(String)
-  date_purchased = Column(Integer)
+  # Indexed for the archive job, see database.archive.
+  date_purchased = Column(Integer, index=True)
   image_link = Column(String)
+  catalog_id = Column(Integer, ForeignKey('catalog.id',
+    ondelete='SET NULL'), index=True)
 
-  def __init__(self, name, weight, quantity, date_purchased, description=''):
+  def __init__(self, name, weight, quantity, date_purchased, description='',
+               catalog_id=None):
     self.name = name
     self.description = description
     self.weight = weight
     self.quantity = quantity
     self.date_purchased = date_purchased
+    self.catalog_id = catalog_id
 
   def insert(self):
     db.session.add(self)
@@ -134,9 +217,179 @@ class Product(db.Model):
       'name': self.name,
       'weight': self.weight,
       'quantity': self.quantity,
-      'date_purchased': self.date_purchased
+      'date_purchased': self.date_purchased,
+      'catalog_id': self.catalog_id
     }
 
   def __repr__(self):
         return f'<Product {self.id}: {self.last_name}, {self.first_name}>'
 
+
+'''
+User-ArchivedProduct association table
+
+    user_products rows of archived products, moved along with them
+'''
+user_products_archive = Table('user_products_archive', db.Model.metadata,
+      Column('user_id', Integer, ForeignKey('users.id',
+        onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+      Column('product_id', Integer, ForeignKey('products_archive.id',
+        onupdate='CASCADE', ondelete='CASCADE'), primary_key=True))
+
+'''
+ArchivedProduct
+
+    a product purchased before the retention horizon, moved out of
+    products by the archive job so listings and indexes only cover recent
+    items. Keeps its original id. See database.archive.
+'''
+class ArchivedProduct(db.Model):
+  __tablename__ = 'products_archive'
+
+  id = Column(Integer, primary_key=True, autoincrement=False)
+  name = Column(String)
+  weight = Column(String)
+  quantity = Column(String)
+  date_purchased = Column(Integer, index=True)
+  image_link = Column(String)
+  catalog_id = Column(Integer, ForeignKey('catalog.id',
+    ondelete='SET NULL'))
+  archived_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'name': self.name,
+      'weight': self.weight,
+      'quantity': self.quantity,
+      'date_purchased': self.date_purchased,
+      'catalog_id': self.catalog_id,
+      'archived_at': self.archived_at
+    }
+
+  def __repr__(self):
+        return f'<ArchivedProduct {self.id}: {self.name}>'
+
+
+'''
+Receipt
+
+    one ingested receipt per (user, receipt_hash), which is what makes
+    ingestion idempotent. product_ids is the JSON list of products the
+    receipt resolved to, returned again when a retry replays it.
+'''
+class Receipt(db.Model):
+  __tablename__ = 'receipts'
+  __table_args__ = (UniqueConstraint('user_id', 'receipt_hash'),)
+
+  id = Column(Integer, primary_key=True)
+  user_id = Column(Integer, ForeignKey('users.id',
+    onupdate='CASCADE', ondelete='CASCADE'), nullable=False)
+  receipt_hash = Column(String(64), nullable=False)
+  product_ids = Column(String)
+  created_at = Column(DateTime)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'user_id': self.user_id,
+      'receipt_hash': self.receipt_hash,
+      'product_ids': json.loads(self.product_ids or '[]'),
+      'created_at': self.created_at
+    }
+
+  def __repr__(self):
+        return f'<Receipt {self.id}: {self.receipt_hash}>'
+
+
+'''
+Change
+
+    one row per product a write touched in a user's inventory, op is 'u'
+    (inserted, updated or linked) or 'd' (deleted or unlinked). seq is
+    the user's change_seq after that write and is the cursor clients
+    sync from, see database.changes.
+'''
+class Change(db.Model):
+  __tablename__ = 'changes'
+  __table_args__ = (Index('ix_changes_user_id_seq', 'user_id', 'seq'),)
+
+  id = Column(Integer, primary_key=True)
+  user_id = Column(Integer, ForeignKey('users.id',
+    onupdate='CASCADE', ondelete='CASCADE'), nullable=False)
+  seq = Column(Integer, nullable=False)
+  product_id = Column(Integer, nullable=False)
+  op = Column(String(1), nullable=False)
+  created_at = Column(DateTime)
+
+  def __repr__(self):
+        return f'<Change {self.user_id}@{self.seq}: {self.op} {self.product_id}>'
+
+
+'''
+OutboxEvent
+
+    an inventory event waiting to be delivered downstream, appended in
+    the same transaction as the write it describes and deleted once a
+    consumer has delivered it, see database.outbox.
+'''
+class OutboxEvent(db.Model):
+  __tablename__ = 'outbox_events'
+
+  id = Column(Integer, primary_key=True)
+  topic = Column(String(64), nullable=False)
+  aggregate_id = Column(Integer)
+  payload = Column(Text, nullable=False)
+  created_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'topic': self.topic,
+      'aggregate_id': self.aggregate_id,
+      'payload': json.loads(self.payload),
+      'created_at': self.created_at
+    }
+
+  def __repr__(self):
+        return f'<OutboxEvent {self.id}: {self.topic} {self.aggregate_id}>'
+
+
+'''
+RestockPrediction
+
+    when a user is expected to run out of a catalog item, estimated by
+    the restock job from the gaps between their past purchases of it and
+    replaced wholesale on every run, see restock.restock. Times are epoch
+    seconds like Product.date_purchased.
+'''
+class RestockPrediction(db.Model):
+  __tablename__ = 'restock_predictions'
+  __table_args__ = (Index('ix_restock_predictions_user_id_runout_at',
+                          'user_id', 'runout_at'),)
+
+  user_id = Column(Integer, ForeignKey('users.id',
+    onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+  catalog_id = Column(Integer, ForeignKey('catalog.id',
+    ondelete='CASCADE'), primary_key=True)
+  purchases = Column(Integer, nullable=False)
+  interval_days = Column(Float, nullable=False)
+  interval_std_days = Column(Float, nullable=False)
+  last_purchased = Column(Integer, nullable=False)
+  runout_at = Column(Integer, nullable=False)
+  computed_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'user_id': self.user_id,
+      'catalog_id': self.catalog_id,
+      'purchases': self.purchases,
+      'interval_days': self.interval_days,
+      'interval_std_days': self.interval_std_days,
+      'last_purchased': self.last_purchased,
+      'runout_at': self.runout_at,
+      'computed_at': self.computed_at
+    }
+
+  def __repr__(self):
+        return f'<RestockPrediction {self.user_id}: {self.catalog_id}>'
@@ -0,0 +1,140 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import event, text
+
+from .models import db, Product, User
+from .routing import RoutingSession
+from .listeners import column_values
+
+
+'''
+Transactional outbox
+
+    Writes to products and users append an event row to outbox_events in
+    the same transaction, so an event exists exactly when its write
+    committed. events.consumer drains the table in batches and hands the
+    events to sinks; delivery is at least once, consumers dedupe on id.
+
+    ORM writes are recorded from session flush events, set-based writes
+    (database.batch, database.ingest) call append() themselves.
+
+    Topics: product.created, product.updated, product.deleted,
+    product.archived, user.created, user.updated, user.deleted,
+    receipt.ingested
+'''
+
+# Sent with each claimed batch to sinks, in this order.
+COLUMNS = ('id', 'topic', 'aggregate_id', 'payload', 'created_at')
+
+
+def json_default(value):
+    """JSON for the values columns hold, shared with events.sinks."""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def event_row(topic, aggregate_id, payload, created_at=None):
+    return {
+        'topic': topic,
+        'aggregate_id': aggregate_id,
+        'payload': json.dumps(payload, default=json_default,
+                              separators=(',', ':'), sort_keys=True),
+        'created_at': created_at or datetime.utcnow(),
+    }
+
+
+"""
+append(events, session)
+    adds events to the outbox with one executemany INSERT
+
+    Keyword arguments:
+    events -- iterable of (topic, aggregate_id, payload dict)
+    session -- session whose transaction to write in, db.session if None
+
+    Runs in the caller's transaction and does not commit.
+"""
+def append(events, session=None):
+    session = session or db.session
+    now = datetime.utcnow()
+    rows = [event_row(topic, aggregate_id, payload, now)
+            for topic, aggregate_id, payload in events]
+    if rows:
+        session.execute(text(
+            'INSERT INTO outbox_events (topic, aggregate_id, payload, '
+            'created_at) VALUES (:topic, :aggregate_id, :payload, '
+            ':created_at)'), rows)
+
+
+_TOPICS = {Product: 'product', User: 'user'}
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def append_flushed(session, flush_context):
+    events = []
+    for target in session.new:
+        topic = _TOPICS.get(type(target))
+        if topic:
+            events.append((topic + '.created', target.id,
+                           column_values(target)))
+    for target in session.dirty:
+        topic = _TOPICS.get(type(target))
+        if topic and session.is_modified(target, include_collections=False):
+            events.append((topic + '.updated', target.id,
+                           column_values(target)))
+    for target in session.deleted:
+        topic = _TOPICS.get(type(target))
+        if topic:
+            events.append((topic + '.deleted', target.id, {'id': target.id}))
+    if events:
+        append(events, session)
+
+
+def _claim_statement(dialect):
+    # SKIP LOCKED lets parallel consumers take disjoint batches instead
+    # of queueing on each other's locks. SQLite has neither, its writers
+    # are serialized anyway.
+    lock = ' FOR UPDATE SKIP LOCKED' if dialect == 'postgresql' else ''
+    return text(
+        'DELETE FROM outbox_events WHERE id IN ('
+        'SELECT id FROM outbox_events ORDER BY id LIMIT :limit{}) '
+        'RETURNING {}'.format(lock, ', '.join(COLUMNS)))
+
+
+"""
+claim(connection, limit)
+    takes up to limit of the oldest undelivered events
+
+    Keyword arguments:
+    connection -- connection inside a transaction: committing it marks
+        the events delivered, rolling back returns them to the outbox
+    limit -- batch size
+    Return: list of event dicts ordered by id, payloads decoded
+"""
+def claim(connection, limit):
+    result = connection.execute(
+        _claim_statement(connection.dialect.name), {'limit': limit})
+    events = []
+    for row in result:
+        item = dict(zip(COLUMNS, row))
+        item['payload'] = json.loads(item['payload'])
+        if isinstance(item['created_at'], str):
+            item['created_at'] = datetime.fromisoformat(item['created_at'])
+        events.append(item)
+    events.sort(key=lambda item: item['id'])
+    return events
+
+
+"""
+backlog(connection)
+    (undelivered event count, age in seconds of the oldest one)
+"""
+def backlog(connection):
+    count = connection.execute(text(
+        'SELECT count(*) FROM outbox_events')).scalar()
+    oldest = connection.execute(text(
+        'SELECT created_at FROM outbox_events ORDER BY id LIMIT 1')).scalar()
+    if oldest is None:
+        return count, 0.0
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    return count, max(0.0, (datetime.utcnow() - oldest).total_seconds())
@@ -0,0 +1,179 @@
+import os
+import random
+import threading
+import time
+
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.sql.expression import Select, TextClause, UpdateBase
+
+
+'''
+Read replica routing
+
+    With DATABASE_REPLICA_URLS set (comma separated), statements of GET
+    and HEAD requests are sent to a replica, the same one for the whole
+    request, and everything else to the primary at DATABASE_URL. A
+    replica is skipped while it lags more than DB_REPLICA_MAX_LAG seconds
+    or cannot be reached, and a client that just wrote reads from the
+    primary for DB_REPLICA_STICKY seconds (cookie), so its own change is
+    never missing from the page it is redirected to. Outside a request,
+    in scripts and migrations, everything uses the primary.
+'''
+
+REPLICA_BIND_PREFIX = 'replica_'
+STICKY_COOKIE = 'db_primary_until'
+MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY', MAX_LAG))
+# How long a replica's measured lag is trusted before asking again.
+LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK', 1))
+READ_METHODS = ('GET', 'HEAD')
+
+# Seconds the replica's replay is behind the primary, 0 when caught up
+# or when the server is not a streaming replica.
+POSTGRES_LAG = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - '
+    'pg_last_xact_replay_timestamp()), 0) END')
+
+
+def replica_urls():
+    return [url.strip() for url in
+            os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+            if url.strip()]
+
+
+def _is_read(clause):
+    if isinstance(clause, Select):
+        return True
+    if isinstance(clause, TextClause):
+        words = clause.text.split(None, 1)
+        return bool(words) and words[0].upper() == 'SELECT'
+    return False
+
+
+def _is_write(clause):
+    return isinstance(clause, UpdateBase) or \
+        (isinstance(clause, TextClause) and not _is_read(clause))
+
+
+class ReplicaHealth(object):
+    """Cached replication lag of each replica engine."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    def measure(self, engine):
+        """Returns the replica's lag in seconds, None if unreachable."""
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name != 'postgresql':
+                    connection.execute(text('SELECT 1'))
+                    return 0.0
+                return float(connection.execute(POSTGRES_LAG).scalar() or 0)
+        except Exception:
+            return None
+
+    def usable(self, engine, now=None):
+        now = time.monotonic() if now is None else now
+        checked_at, lag = self.checked.get(engine, (None, None))
+        if checked_at is None or now - checked_at > LAG_CHECK_INTERVAL:
+            # One request re-measures, the others keep the last value.
+            if self.lock.acquire(blocking=checked_at is None):
+                try:
+                    if self.checked.get(engine, (None,))[0] == checked_at:
+                        lag = self.measure(engine)
+                        self.checked[engine] = (now, lag)
+                    else:
+                        lag = self.checked[engine][1]
+                finally:
+                    self.lock.release()
+        return lag is not None and lag <= MAX_LAG
+
+
+health = ReplicaHealth()
+
+
+class RoutingSession(SignallingSession):
+    """Flask-SQLAlchemy session that picks the primary or its replica per
+    statement, see the module notes."""
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        self.db = db
+        self.wrote = False
+        # Chosen on the first read and kept, so all reads of a request
+        # see one replica's state rather than a mix of differently
+        # lagging ones.
+        self.replica = None
+        self.primary_only = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or _is_write(clause):
+            self.wrote = True
+        # Statements of unknown kind and everything after a write in this
+        # session stay on the primary.
+        if not self.wrote and not self.primary_only and _is_read(clause) \
+                and self._use_replica():
+            if self.replica is None:
+                replicas = [engine for engine in self._replicas()
+                            if health.usable(engine)]
+                if replicas:
+                    self.replica = random.choice(replicas)
+            if self.replica is not None:
+                return self.replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def use_primary(self):
+        """Sends the rest of this session's reads to the primary, for
+        reads that must not go back in time between requests."""
+        self.primary_only = True
+
+    def _replicas(self):
+        return [self.db.get_engine(self.app, bind=key)
+                for key in self.app.config.get('SQLALCHEMY_BINDS') or {}
+                if key.startswith(REPLICA_BIND_PREFIX)]
+
+    def _use_replica(self):
+        if not has_request_context() or request.method not in READ_METHODS:
+            return False
+        try:
+            sticky_until = float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            sticky_until = 0
+        return sticky_until < time.time()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+"""
+init_replicas(app, db, urls)
+    registers replica binds and the read-your-writes cookie on an app
+
+    Keyword arguments:
+    app -- flask application
+    db -- the RoutingSQLAlchemy instance
+    urls -- replica database URLs, from DATABASE_REPLICA_URLS if None
+"""
+def init_replicas(app, db, urls=None):
+    urls = replica_urls() if urls is None else urls
+    if not urls:
+        return
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for index, url in enumerate(urls):
+        binds['{}{}'.format(REPLICA_BIND_PREFIX, index)] = url
+
+    @app.after_request
+    def stick_to_primary(response):
+        if db.session.registry.has() and db.session().wrote:
+            response.set_cookie(STICKY_COOKIE,
+                                str(int(time.time() + STICKY_SECONDS) + 1),
+                                max_age=int(STICKY_SECONDS) + 1,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,190 @@
+"""Outbox consumer: drains outbox_events into sinks.
+
+    Each iteration claims a batch with one DELETE ... RETURNING (FOR
+    UPDATE SKIP LOCKED on Postgres, so any number of consumers can run
+    side by side), delivers it to every sink and commits. A sink error
+    rolls the batch back into the outbox and the consumer backs off.
+
+    Usage (from the App/ directory):
+        DATABASE_URL=postgresql://... python -m app.events.consumer \\
+            --sink log --sink webhook:https://example.com/hook \\
+            --processes 4 --batch-size 500
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import create_engine
+
+from ..database import outbox
+from ..database.models import default_database_path
+from .sinks import build as build_sink
+
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+IDLE_SLEEP = float(os.environ.get('OUTBOX_IDLE_SLEEP', 0.5))
+MAX_BACKOFF = 30.0
+# How often the outbox size and oldest event age are sampled.
+BACKLOG_INTERVAL = 5.0
+
+DELIVERED = Counter('myfridge_outbox_delivered_total',
+                    'Events delivered to every sink')
+FAILED = Counter('myfridge_outbox_failed_batches_total',
+                 'Batches rolled back after a sink error')
+LAG_SECONDS = Histogram('myfridge_outbox_lag_seconds',
+                        'Time from an event being written to delivered',
+                        buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60,
+                                 300))
+BACKLOG = Gauge('myfridge_outbox_backlog', 'Undelivered events',
+                multiprocess_mode='max')
+BACKLOG_AGE = Gauge('myfridge_outbox_backlog_age_seconds',
+                    'Age of the oldest undelivered event',
+                    multiprocess_mode='max')
+
+
+class Consumer(object):
+    """Claims, delivers and commits outbox batches in a loop."""
+
+    def __init__(self, engine, sinks, batch_size=BATCH_SIZE,
+                 idle_sleep=IDLE_SLEEP):
+        self.engine = engine
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.idle_sleep = idle_sleep
+        self.delivered = 0
+        self.failed = 0
+        self.max_lag = 0.0
+        self.backlog_checked = 0.0
+
+    def run_once(self):
+        """Delivers one batch, returns its size."""
+        with self.engine.begin() as connection:
+            events = outbox.claim(connection, self.batch_size)
+            if not events:
+                return 0
+            for sink in self.sinks:
+                sink.deliver(events)
+        now = datetime.utcnow()
+        for event in events:
+            lag = (now - event['created_at']).total_seconds()
+            LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+        self.delivered += len(events)
+        DELIVERED.inc(len(events))
+        return len(events)
+
+    def check_backlog(self):
+        with self.engine.connect() as connection:
+            count, age = outbox.backlog(connection)
+        BACKLOG.set(count)
+        BACKLOG_AGE.set(age)
+        return count, age
+
+    def run(self, stop_when_empty=False, max_events=None):
+        backoff = self.idle_sleep
+        while max_events is None or self.delivered < max_events:
+            if time.monotonic() - self.backlog_checked > BACKLOG_INTERVAL:
+                self.backlog_checked = time.monotonic()
+                self.check_backlog()
+            try:
+                claimed = self.run_once()
+            except Exception:
+                self.failed += 1
+                FAILED.inc()
+                print(sys.exc_info(), file=sys.stderr)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = self.idle_sleep
+            if not claimed:
+                if stop_when_empty:
+                    return
+                time.sleep(self.idle_sleep)
+
+    def stats(self):
+        return {
+            'delivered': self.delivered,
+            'failed_batches': self.failed,
+            'max_lag_s': round(self.max_lag, 3),
+        }
+
+
+def _run_process(index, database_url, sink_specs, batch_size,
+                 stop_when_empty, metrics_port, results):
+    if metrics_port:
+        # Each process serves its own metrics, one port per process.
+        start_http_server(metrics_port + index)
+    # One engine per process, connections must not cross a fork.
+    engine = create_engine(database_url, pool_pre_ping=True)
+    consumer = Consumer(engine, [build_sink(spec) for spec in sink_specs],
+                        batch_size)
+    started = time.perf_counter()
+    try:
+        consumer.run(stop_when_empty=stop_when_empty)
+    except KeyboardInterrupt:
+        pass
+    results.put(dict(consumer.stats(), pid=os.getpid(),
+                     elapsed_s=round(time.perf_counter() - started, 3)))
+
+
+"""
+consume(database_url, sink_specs, processes, batch_size, stop_when_empty,
+        metrics_port)
+    runs consumers in parallel processes until interrupted
+
+    Keyword arguments:
+    database_url -- database holding the outbox
+    sink_specs -- list of sink specs, see sinks.build
+    processes -- number of consumer processes
+    batch_size -- events claimed per transaction
+    stop_when_empty -- return once the outbox is drained
+    metrics_port -- first of the ports the processes serve metrics on
+    Return: list of per process stats
+"""
+def consume(database_url, sink_specs, processes=1, batch_size=BATCH_SIZE,
+            stop_when_empty=False, metrics_port=None):
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(
+        target=_run_process,
+        args=(index, database_url, sink_specs, batch_size, stop_when_empty,
+              metrics_port, results))
+        for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    stats = []
+    try:
+        for _ in workers:
+            stats.append(results.get())
+    except KeyboardInterrupt:
+        pass
+    for worker in workers:
+        worker.join()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sink', action='append', dest='sinks',
+                        help='null, log[:path], webhook:url or '
+                             'module:factory, repeatable (default log)')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--drain', action='store_true',
+                        help='exit once the outbox is empty')
+    parser.add_argument('--metrics-port', type=int,
+                        default=os.environ.get('OUTBOX_METRICS_PORT'))
+    args = parser.parse_args(argv)
+
+    stats = consume(os.environ.get('DATABASE_URL', default_database_path),
+                    args.sinks or ['log'], args.processes, args.batch_size,
+                    args.drain, args.metrics_port and int(args.metrics_port))
+    print(json.dumps(stats, indent=2, sort_keys=True), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
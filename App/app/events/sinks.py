@@ -0,0 +1,81 @@
+import json
+import sys
+from urllib.request import Request, urlopen
+
+from ..database.outbox import json_default
+from ..registry import Registry
+
+
+'''
+Outbox sinks
+
+    A sink receives each claimed batch of events through deliver(events)
+    and raises to have the whole batch returned to the outbox and retried.
+    Sinks are named on the consumer command line as NAME or NAME:ARGUMENT,
+    or as a dotted path module:factory for sinks living outside this
+    module.
+'''
+
+_sinks = Registry('sink')
+sink = _sinks.register
+
+
+def encode(events):
+    return json.dumps(events, default=json_default, separators=(',', ':'))
+
+
+@sink('null')
+class NullSink(object):
+    """Drops events, for measuring the consumer itself."""
+
+    def __init__(self, argument=None):
+        pass
+
+    def deliver(self, events):
+        pass
+
+
+@sink('log')
+class LogSink(object):
+    """Appends one JSON line per event to a file, stdout by default."""
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def deliver(self, events):
+        lines = ''.join(encode(event) + '\n' for event in events)
+        if self.path:
+            with open(self.path, 'a') as handle:
+                handle.write(lines)
+        else:
+            sys.stdout.write(lines)
+            sys.stdout.flush()
+
+
+@sink('webhook')
+class WebhookSink(object):
+    """POSTs each batch as a JSON array, any non 2xx reply retries it."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, events):
+        request = Request(self.url, data=encode(events).encode('utf-8'),
+                          headers={'Content-Type': 'application/json'},
+                          method='POST')
+        with urlopen(request, timeout=self.timeout) as response:
+            if not 200 <= response.status < 300:
+                raise IOError('webhook answered {}'.format(response.status))
+
+
+"""
+build(spec)
+    creates the sink described by a command line spec
+
+    Keyword arguments:
+    spec -- "null", "log", "log:/var/log/events.jsonl",
+        "webhook:https://example.com/hook" or "package.module:factory"
+    Return: object with a deliver(events) method
+"""
+build = _sinks.build
@@ -1,14 +1,90 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app import app
-from models import db
+from .database import models
+# Tables are created by db upgrade, not by the app being imported below.
+models.create_tables = False
+
+from .app import app
+from .database.models import db
+from .database import archive, batch, changes
+from .barcode import barcodes
+from .notify import notifier
+from .restock import restock
 
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, directory=os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def import_products(path):
+    """Bulk imports products from a CSV file with a header row of name,
+    weight, quantity, date_purchased and optionally image_link, barcode."""
+    with open(path, newline='') as handle:
+        rows = list(csv.DictReader(handle))
+    for row in rows:
+        if row.get('date_purchased'):
+            row['date_purchased'] = int(row['date_purchased'])
+    print('Imported {} products'.format(batch.insert_products(rows)))
+
+
+@manager.command
+def build_barcodes(path, output=None):
+    """Compiles a CSV with a header row of barcode (or upc), name and
+    optionally weight, quantity into the catalog /api/barcode reads."""
+    print(barcodes.build(path, output))
+
+
+@manager.command
+def prune_changes(days=30):
+    """Deletes change log rows older than days, clients that have not
+    synced since then fetch a full snapshot instead."""
+    before = datetime.utcnow() - timedelta(days=int(days))
+    print('Pruned {} changes'.format(changes.prune(before)))
+
+
+@manager.command
+def predict_restock(users_per_chunk=restock.USERS_PER_CHUNK):
+    """Recomputes every user's restock predictions from their purchase
+    history, meant to run nightly."""
+    print(restock.run(db.engine, int(users_per_chunk)))
+
+
+@manager.command
+def archive_products(days=archive.RETENTION_DAYS,
+                     batch_size=archive.BATCH_SIZE):
+    """Moves products purchased more than days ago to the archive tables,
+    batch_size per transaction, meant to run nightly."""
+    before = int(time.time()) - int(days) * archive.DAY
+    print(archive.archive_products(before, int(batch_size)))
+
+
+# Options are spelled out, @manager.command would give sink and shard_size
+# the same -s.
+@manager.option('-s', '--sink', dest='sink', default='file')
+@manager.option('-p', '--processes', dest='processes', default=4)
+@manager.option('-z', '--shard_size', dest='shard_size',
+                default=notifier.SHARD_SIZE)
+@manager.option('-r', '--run_id', dest='run_id', default=None)
+def notify(sink='file', processes=4, shard_size=notifier.SHARD_SIZE,
+           run_id=None):
+    """Sends every user a digest of products about to expire and items
+    about to run out, rerun with the same run id to resume."""
+    # The workers open their own connections, none may be forked.
+    db.engine.dispose()
+    report = notifier.notify(app.config["SQLALCHEMY_DATABASE_URI"], sink,
+                             int(processes), int(shard_size), run_id)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
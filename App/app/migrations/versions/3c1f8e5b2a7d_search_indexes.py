@@ -0,0 +1,45 @@
+"""trigram and full-text search indexes
+
+Revision ID: 3c1f8e5b2a7d
+Revises: 88162422f489
+Create Date: 2026-10-19 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f8e5b2a7d'
+down_revision = '88162422f489'
+branch_labels = None
+depends_on = None
+
+
+# Must match the expressions used by search/search.py exactly, or the
+# planner will not pick these indexes.
+PRODUCT_DOCUMENT = "coalesce(name, '')"
+USER_DOCUMENT = "(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_products_name_trgm ON products '
+               'USING gin (({}) gin_trgm_ops)'.format(PRODUCT_DOCUMENT))
+    op.execute("CREATE INDEX ix_products_name_tsv ON products "
+               "USING gin (to_tsvector('simple', {}))".format(PRODUCT_DOCUMENT))
+    op.execute('CREATE INDEX ix_users_name_trgm ON users '
+               'USING gin (({}) gin_trgm_ops)'.format(USER_DOCUMENT))
+    op.execute("CREATE INDEX ix_users_name_tsv ON users "
+               "USING gin (to_tsvector('simple', {}))".format(USER_DOCUMENT))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP INDEX IF EXISTS ix_users_name_tsv')
+    op.execute('DROP INDEX IF EXISTS ix_users_name_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_products_name_tsv')
+    op.execute('DROP INDEX IF EXISTS ix_products_name_trgm')
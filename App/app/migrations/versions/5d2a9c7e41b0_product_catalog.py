@@ -0,0 +1,147 @@
+"""canonical product catalog and duplicate product merge
+
+Revision ID: 5d2a9c7e41b0
+Revises: 3c1f8e5b2a7d
+Create Date: 2026-10-19 13:40:00.000000
+
+"""
+import hashlib
+import re
+import unicodedata
+from contextlib import contextmanager
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a9c7e41b0'
+down_revision = '3c1f8e5b2a7d'
+branch_labels = None
+depends_on = None
+
+
+# Frozen copy of database/catalog.py normalize_name at this revision, so
+# the migration keeps producing the same keys if the app's rules change.
+_SEPARATORS = re.compile(r'[^\w]+|_', re.UNICODE)
+_SPACED_UNIT = re.compile(
+    r'(\d) (ml|l|g|kg|mg|oz|lb|lbs|ct|pk|pack)\b')
+
+
+def normalize_name(name):
+    name = unicodedata.normalize('NFKC', name or '').lower()
+    name = ' '.join(_SEPARATORS.sub(' ', name).split())
+    return _SPACED_UNIT.sub(r'\1\2', name)
+
+
+CHUNK_SIZE = 5000
+
+
+@contextmanager
+def _copying_products():
+    # On SQLite batch mode rebuilds products as a copy and drops the
+    # original. The app turns foreign keys on for every connection, and
+    # with them on the drop would cascade into user_products.
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        yield
+        return
+    enabled = bind.execute(sa.text('PRAGMA foreign_keys')).scalar()
+    bind.execute(sa.text('PRAGMA foreign_keys=OFF'))
+    try:
+        yield
+    finally:
+        bind.execute(sa.text('PRAGMA foreign_keys={}'.format(
+            'ON' if enabled else 'OFF')))
+
+
+def upgrade():
+    op.create_table('catalog',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('normalized_name', sa.String(), nullable=False),
+        sa.Column('name_hash', sa.String(length=40), nullable=False),
+        sa.Column('barcode', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name_hash'),
+        sa.UniqueConstraint('barcode')
+    )
+    # Batch mode is plain ALTER TABLE on PostgreSQL, SQLite cannot add a
+    # foreign key to an existing table so the table is copied there.
+    with _copying_products(), op.batch_alter_table('products') as batch:
+        batch.add_column(sa.Column('catalog_id', sa.Integer(),
+                                   nullable=True))
+        batch.create_index(op.f('ix_products_catalog_id'), ['catalog_id'],
+                           unique=False)
+        batch.create_foreign_key('products_catalog_id_fkey', 'catalog',
+                                 ['catalog_id'], ['id'], ondelete='SET NULL')
+
+    bind = op.get_bind()
+
+    # Backfill: one catalog row per normalized name, then point every
+    # product at it.
+    names = bind.execute(sa.text(
+        'SELECT DISTINCT name FROM products WHERE name IS NOT NULL')).fetchall()
+    catalog = {}
+    for (name,) in names:
+        normalized = normalize_name(name)
+        if normalized and normalized not in catalog:
+            catalog[normalized] = {
+                'name': ' '.join(name.split()),
+                'normalized_name': normalized,
+                'name_hash': hashlib.sha1(
+                    normalized.encode('utf-8')).hexdigest(),
+            }
+    rows = list(catalog.values())
+    for start in range(0, len(rows), CHUNK_SIZE):
+        bind.execute(sa.text(
+            'INSERT INTO catalog (name, normalized_name, name_hash) '
+            'VALUES (:name, :normalized_name, :name_hash)'),
+            rows[start:start + CHUNK_SIZE])
+
+    bind.execute(sa.text(
+        'CREATE TEMPORARY TABLE product_names '
+        '(name VARCHAR PRIMARY KEY, name_hash VARCHAR(40))'))
+    mapping = [{'name': name,
+                'name_hash': catalog[normalize_name(name)]['name_hash']}
+               for (name,) in names if normalize_name(name)]
+    for start in range(0, len(mapping), CHUNK_SIZE):
+        bind.execute(sa.text(
+            'INSERT INTO product_names (name, name_hash) '
+            'VALUES (:name, :name_hash)'), mapping[start:start + CHUNK_SIZE])
+    bind.execute(sa.text(
+        'UPDATE products SET catalog_id = ('
+        'SELECT catalog.id FROM product_names '
+        'JOIN catalog ON catalog.name_hash = product_names.name_hash '
+        'WHERE product_names.name = products.name)'))
+
+    # Merge products that are the same item with the same attributes:
+    # keep the lowest id, move every user link onto it, drop the rest.
+    bind.execute(sa.text(
+        'CREATE TEMPORARY TABLE product_merge AS '
+        'SELECT id, MIN(id) OVER (PARTITION BY catalog_id, weight, quantity, '
+        'date_purchased, image_link) AS keep_id '
+        'FROM products WHERE catalog_id IS NOT NULL'))
+    bind.execute(sa.text('DELETE FROM product_merge WHERE id = keep_id'))
+    bind.execute(sa.text(
+        'INSERT INTO user_products (user_id, product_id) '
+        'SELECT DISTINCT user_products.user_id, product_merge.keep_id '
+        'FROM user_products '
+        'JOIN product_merge ON product_merge.id = user_products.product_id '
+        'WHERE true ON CONFLICT DO NOTHING'))
+    bind.execute(sa.text(
+        'DELETE FROM user_products WHERE product_id IN '
+        '(SELECT id FROM product_merge)'))
+    bind.execute(sa.text(
+        'DELETE FROM products WHERE id IN (SELECT id FROM product_merge)'))
+    bind.execute(sa.text('DROP TABLE product_merge'))
+    bind.execute(sa.text('DROP TABLE product_names'))
+
+
+def downgrade():
+    # Merged duplicate products are not restored.
+    with _copying_products(), op.batch_alter_table('products') as batch:
+        batch.drop_constraint('products_catalog_id_fkey', type_='foreignkey')
+        batch.drop_index(op.f('ix_products_catalog_id'))
+        batch.drop_column('catalog_id')
+    op.drop_table('catalog')
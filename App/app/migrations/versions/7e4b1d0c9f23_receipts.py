@@ -0,0 +1,34 @@
+"""receipts for idempotent receipt ingestion
+
+Revision ID: 7e4b1d0c9f23
+Revises: 5d2a9c7e41b0
+Create Date: 2026-10-19 14:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4b1d0c9f23'
+down_revision = '5d2a9c7e41b0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('receipts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('receipt_hash', sa.String(length=64), nullable=False),
+        sa.Column('product_ids', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'receipt_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('receipts')
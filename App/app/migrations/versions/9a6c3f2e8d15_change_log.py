@@ -0,0 +1,39 @@
+"""change log for delta sync
+
+Revision ID: 9a6c3f2e8d15
+Revises: 7e4b1d0c9f23
+Create Date: 2026-10-19 16:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a6c3f2e8d15'
+down_revision = '7e4b1d0c9f23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('change_seq', sa.Integer(),
+                                     nullable=False, server_default='0'))
+    op.create_table('changes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('op', sa.String(length=1), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_changes_user_id_seq', 'changes', ['user_id', 'seq'])
+
+
+def downgrade():
+    op.drop_index('ix_changes_user_id_seq', table_name='changes')
+    op.drop_table('changes')
+    op.drop_column('users', 'change_seq')
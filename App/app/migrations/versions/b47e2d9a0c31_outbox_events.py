@@ -0,0 +1,31 @@
+"""transactional outbox for inventory events
+
+Revision ID: b47e2d9a0c31
+Revises: 9a6c3f2e8d15
+Create Date: 2026-10-19 18:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47e2d9a0c31'
+down_revision = '9a6c3f2e8d15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('topic', sa.String(length=64), nullable=False),
+        sa.Column('aggregate_id', sa.Integer(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('outbox_events')
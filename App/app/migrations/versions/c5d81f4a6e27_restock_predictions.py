@@ -0,0 +1,42 @@
+"""restock predictions
+
+Revision ID: c5d81f4a6e27
+Revises: b47e2d9a0c31
+Create Date: 2026-10-19 20:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d81f4a6e27'
+down_revision = 'b47e2d9a0c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('restock_predictions',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('catalog_id', sa.Integer(), nullable=False),
+        sa.Column('purchases', sa.Integer(), nullable=False),
+        sa.Column('interval_days', sa.Float(), nullable=False),
+        sa.Column('interval_std_days', sa.Float(), nullable=False),
+        sa.Column('last_purchased', sa.Integer(), nullable=False),
+        sa.Column('runout_at', sa.Integer(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['catalog_id'], ['catalog.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'catalog_id')
+    )
+    op.create_index('ix_restock_predictions_user_id_runout_at',
+                    'restock_predictions', ['user_id', 'runout_at'])
+
+
+def downgrade():
+    op.drop_index('ix_restock_predictions_user_id_runout_at',
+                  table_name='restock_predictions')
+    op.drop_table('restock_predictions')
@@ -0,0 +1,66 @@
+"""product archive
+
+Revision ID: d3e9b6a1f482
+Revises: c5d81f4a6e27
+Create Date: 2026-10-19 22:10:00.000000
+
+Existing products past the retention horizon are not moved here, in one
+long transaction, but by the batched archive job once this is applied:
+    python -m app.manage archive_products
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3e9b6a1f482'
+down_revision = 'c5d81f4a6e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_products_date_purchased'), 'products',
+                    ['date_purchased'])
+    op.create_table('products_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('weight', sa.String(), nullable=True),
+        sa.Column('quantity', sa.String(), nullable=True),
+        sa.Column('date_purchased', sa.Integer(), nullable=True),
+        sa.Column('image_link', sa.String(), nullable=True),
+        sa.Column('catalog_id', sa.Integer(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['catalog_id'], ['catalog.id'],
+                                ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_products_archive_date_purchased'),
+                    'products_archive', ['date_purchased'])
+    op.create_table('user_products_archive',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['product_id'], ['products_archive.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'product_id')
+    )
+
+
+def downgrade():
+    # Archived products go back to the hot tables before the archive is
+    # dropped.
+    op.execute(
+        'INSERT INTO products (id, name, weight, quantity, date_purchased, '
+        'image_link, catalog_id) SELECT id, name, weight, quantity, '
+        'date_purchased, image_link, catalog_id FROM products_archive')
+    op.execute(
+        'INSERT INTO user_products (user_id, product_id) '
+        'SELECT user_id, product_id FROM user_products_archive')
+    op.drop_table('user_products_archive')
+    op.drop_index(op.f('ix_products_archive_date_purchased'),
+                  table_name='products_archive')
+    op.drop_table('products_archive')
+    op.drop_index(op.f('ix_products_date_purchased'), table_name='products')
@@ -0,0 +1,327 @@
+"""Expiry notifier: sends each user a digest of what to use up or rebuy.
+
+    Users are split into shards of consecutive ids and the shards are
+    handed to a pool of worker processes, each holding a single database
+    connection. A worker streams its shard's candidate rows ordered by
+    user through a server-side cursor, folds them into one digest per
+    user and delivers the digests to a sink.
+
+    Progress is checkpointed per shard under CHECKPOINT_DIR/RUN_ID after
+    the sink has flushed, so rerunning the same run id skips finished
+    shards and resumes the others after the last checkpointed user.
+    Delivery is at least once: digests sent after the last checkpoint of
+    an interrupted shard are sent again.
+
+    Products carry no expiry date, a product is considered to expire
+    SHELF_LIFE_DAYS after its purchase. Restock candidates come from
+    restock_predictions, see restock.restock.
+
+    Usage (from the App/ directory):
+        DATABASE_URL=postgresql://... python -m app.notify.notifier \\
+            --sink file:/var/spool/digests --processes 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+from ..database.models import default_database_path
+from .sinks import build as build_sink
+
+
+DAY = 86400
+SHELF_LIFE_DAYS = int(os.environ.get('NOTIFY_SHELF_LIFE_DAYS', 7))
+# Items expiring or running out within this many days are notified.
+WITHIN_DAYS = int(os.environ.get('NOTIFY_WITHIN_DAYS', 2))
+SHARD_SIZE = int(os.environ.get('NOTIFY_SHARD_SIZE', 10000))
+CHECKPOINT_DIR = os.environ.get('NOTIFY_CHECKPOINT_DIR',
+                                'notify-checkpoints')
+# Digests delivered between two checkpoints of a shard.
+CHECKPOINT_USERS = 1000
+FETCH_ROWS = 5000
+
+CANDIDATES = text(
+    'SELECT users.id, users.first_name, \'expiring\' AS kind, '
+    'products.id AS item_id, products.name, '
+    'products.date_purchased + :shelf_life AS due_at '
+    'FROM users '
+    'JOIN user_products ON user_products.user_id = users.id '
+    'JOIN products ON products.id = user_products.product_id '
+    'WHERE users.id BETWEEN :first_user AND :last_user '
+    'AND products.date_purchased BETWEEN :purchased_from AND :purchased_until '
+    'UNION ALL '
+    'SELECT users.id, users.first_name, \'restock\' AS kind, '
+    'catalog.id AS item_id, catalog.name, '
+    'restock_predictions.runout_at AS due_at '
+    'FROM users '
+    'JOIN restock_predictions ON restock_predictions.user_id = users.id '
+    'JOIN catalog ON catalog.id = restock_predictions.catalog_id '
+    'WHERE users.id BETWEEN :first_user AND :last_user '
+    'AND restock_predictions.runout_at BETWEEN :now AND :until '
+    'ORDER BY 1, 3, 6')
+
+
+"""
+shards(connection, shard_size)
+    splits the users table into inclusive ranges of ids
+
+    Keyword arguments:
+    connection -- SQLAlchemy connection
+    shard_size -- ids per range, ranges may hold fewer users when ids
+        have gaps
+    Return: list of (first_user, last_user)
+"""
+def shards(connection, shard_size=SHARD_SIZE):
+    low, high = connection.execute(text(
+        'SELECT min(id), max(id) FROM users')).first()
+    if low is None:
+        return []
+    return [(first, min(first + shard_size - 1, high))
+            for first in range(low, high + 1, shard_size)]
+
+
+def _shard_path(run_dir, shard):
+    return os.path.join(run_dir, 'shard-{}-{}.json'.format(*shard))
+
+
+def _load_json(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+
+def _save_json(path, data):
+    # Written aside and renamed, a crash leaves the previous checkpoint.
+    partial = path + '.tmp'
+    with open(partial, 'w') as handle:
+        json.dump(data, handle, sort_keys=True)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(partial, path)
+
+
+"""
+digests(rows)
+    folds candidate rows ordered by user into one digest per user
+
+    Keyword arguments:
+    rows -- iterable of (user_id, first_name, kind, item_id, name, due_at)
+    Return: generator of digest dicts
+"""
+def digests(rows):
+    digest = None
+    for user_id, first_name, kind, item_id, name, due_at in rows:
+        if digest is None or digest['user_id'] != user_id:
+            if digest is not None:
+                yield digest
+            digest = {'user_id': user_id, 'first_name': first_name,
+                      'expiring': [], 'restock': []}
+        digest[kind].append({'id': item_id, 'name': name, 'due_at': due_at})
+    if digest is not None:
+        yield digest
+
+
+def _stream(connection, parameters):
+    result = connection.execution_options(stream_results=True).execute(
+        CANDIDATES, parameters)
+    try:
+        while True:
+            rows = result.fetchmany(FETCH_ROWS)
+            if not rows:
+                return
+            for row in rows:
+                yield tuple(row)
+    finally:
+        result.close()
+
+
+"""
+notify_shard(connection, shard, sink, run_dir, now)
+    delivers the digests of one shard, resuming from its checkpoint
+
+    Keyword arguments:
+    connection -- SQLAlchemy connection to stream candidates with
+    shard -- (first_user, last_user)
+    sink -- Sink to deliver to, see notify.sinks
+    run_dir -- directory holding the run's checkpoints
+    now -- epoch seconds the run notifies for
+    Return: the shard's final checkpoint, plus the users covered and
+        seconds spent by this attempt
+"""
+def notify_shard(connection, shard, sink, run_dir, now):
+    path = _shard_path(run_dir, shard)
+    state = _load_json(path) or {
+        'first_user': shard[0], 'last_user': shard[1],
+        'checkpoint_user': shard[0] - 1, 'users': 0, 'digests': 0,
+        'elapsed_s': 0.0, 'done': False}
+    if state['done']:
+        return dict(state, skipped=True)
+
+    started = time.perf_counter()
+    elapsed = state['elapsed_s']
+
+    def checkpoint(user_id, done=False):
+        sink.flush()
+        state.update(checkpoint_user=user_id, done=done, elapsed_s=round(
+            elapsed + time.perf_counter() - started, 3))
+        _save_json(path, state)
+
+    first_user = state['checkpoint_user'] + 1
+    # Users this attempt covers, a resumed shard only has the rest left.
+    users = connection.execute(text(
+        'SELECT count(*) FROM users WHERE id BETWEEN :first_user '
+        'AND :last_user'),
+        {'first_user': first_user, 'last_user': shard[1]}).scalar()
+    if not state['users']:
+        state['users'] = users
+    rows = _stream(connection, {
+        'first_user': first_user,
+        'last_user': shard[1],
+        'shelf_life': SHELF_LIFE_DAYS * DAY,
+        'purchased_from': now - SHELF_LIFE_DAYS * DAY,
+        'purchased_until': now + (WITHIN_DAYS - SHELF_LIFE_DAYS) * DAY,
+        'now': now,
+        'until': now + WITHIN_DAYS * DAY,
+    })
+    sink.open(shard)
+    try:
+        delivered = 0
+        for digest in digests(rows):
+            sink.deliver(digest)
+            state['digests'] += 1
+            delivered += 1
+            if delivered % CHECKPOINT_USERS == 0:
+                checkpoint(digest['user_id'])
+        checkpoint(shard[1], done=True)
+    finally:
+        rows.close()
+        sink.close()
+    seconds = time.perf_counter() - started
+    return dict(state, skipped=False, attempt_users=users,
+                attempt_s=round(seconds, 3),
+                users_per_s=round(users / max(seconds, 1e-6), 1))
+
+
+# Per worker process state, set up once by _init_worker.
+_worker = {}
+
+
+def _init_worker(database_url, sink_spec, run_dir, now):
+    options = {}
+    if not database_url.startswith('sqlite'):
+        # A worker works one shard at a time over one connection.
+        options = {'pool_size': 1, 'max_overflow': 0, 'pool_pre_ping': True}
+    _worker.update(engine=create_engine(database_url, **options),
+                   sink_spec=sink_spec, run_dir=run_dir, now=now)
+
+
+def _run_shard(shard):
+    try:
+        with _worker['engine'].connect() as connection:
+            state = notify_shard(connection, shard,
+                                 build_sink(_worker['sink_spec']),
+                                 _worker['run_dir'], _worker['now'])
+    except Exception:
+        print(sys.exc_info(), file=sys.stderr)
+        return {'first_user': shard[0], 'last_user': shard[1],
+                'error': repr(sys.exc_info()[1])}
+    return dict(state, pid=os.getpid())
+
+
+"""
+notify(database_url, sink_spec, processes, shard_size, run_id,
+       checkpoint_dir, now)
+    runs or resumes a notification run over every user
+
+    Keyword arguments:
+    database_url -- database to read candidates from
+    sink_spec -- sink the digests go to, see sinks.build
+    processes -- worker processes, one database connection each
+    shard_size -- user ids per shard, fixed for the run at its start
+    run_id -- names the run, today's date if None; rerunning a run id
+        resumes it
+    checkpoint_dir -- directory holding one subdirectory per run
+    now -- epoch seconds to notify for, fixed for the run at its start
+    Return: report dict with per shard and total counts and throughput
+"""
+def notify(database_url, sink_spec='file', processes=4,
+           shard_size=SHARD_SIZE, run_id=None, checkpoint_dir=CHECKPOINT_DIR,
+           now=None):
+    run_id = run_id or date.today().isoformat()
+    run_dir = os.path.join(checkpoint_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    # Shards and the notification time are fixed when a run starts so a
+    # resumed run picks up exactly the shards and windows it left.
+    run = _load_json(os.path.join(run_dir, 'run.json'))
+    if run is None:
+        engine = create_engine(database_url)
+        with engine.connect() as connection:
+            run = {'now': int(time.time()) if now is None else now,
+                   'shards': shards(connection, shard_size)}
+        # No pooled connection may be inherited by the workers.
+        engine.dispose()
+        _save_json(os.path.join(run_dir, 'run.json'), run)
+
+    started = time.perf_counter()
+    results = []
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_worker,
+        initargs=(database_url, sink_spec, run_dir, run['now']))
+    try:
+        for result in pool.imap_unordered(_run_shard,
+                                          [tuple(s) for s in run['shards']]):
+            results.append(result)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    elapsed = time.perf_counter() - started
+
+    results.sort(key=lambda result: result['first_user'])
+    worked = [result for result in results
+              if not result.get('skipped') and 'error' not in result]
+    # Throughput of this invocation, shards finished by an earlier one
+    # are reported but not counted.
+    users = sum(result['attempt_users'] for result in worked)
+    return {
+        'run_id': run_id,
+        'shards': results,
+        'failed': sum('error' in result for result in results),
+        'skipped': sum(bool(result.get('skipped')) for result in results),
+        'users': users,
+        'digests': sum(result.get('digests', 0) for result in results),
+        'elapsed_s': round(elapsed, 3),
+        'users_per_s': round(users / max(elapsed, 1e-6), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sink', default='file',
+                        help='null, file[:directory] or smtp[:host:port] '
+                             '(default file:digests)')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('--run-id', help='run to start or resume, '
+                                         'default today')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    args = parser.parse_args(argv)
+
+    report = notify(os.environ.get('DATABASE_URL', default_database_path),
+                    args.sink, args.processes, args.shard_size, args.run_id,
+                    args.checkpoint_dir)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import json
+import os
+import smtplib
+from email.message import EmailMessage
+
+from ..registry import Registry
+
+
+'''
+Digest sinks
+
+    A sink delivers one digest per user for a shard: open(shard) before
+    the first digest, deliver(digest) for each user, flush() before the
+    notifier checkpoints (everything delivered so far must be durable or
+    sent by then) and close() when the shard ends. Sinks are named on the
+    command line as NAME or NAME:ARGUMENT, see app.registry.
+'''
+
+_sinks = Registry('sink')
+sink = _sinks.register
+
+
+class Sink(object):
+    def open(self, shard):
+        pass
+
+    def deliver(self, digest):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+@sink('null')
+class NullSink(Sink):
+    def __init__(self, argument=None):
+        pass
+
+    def deliver(self, digest):
+        pass
+
+
+@sink('file')
+class FileSink(Sink):
+    """Appends digests as JSON lines to one file per shard under a
+    directory, so workers never share a file."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or 'digests'
+        self.handle = None
+
+    def open(self, shard):
+        os.makedirs(self.directory, exist_ok=True)
+        self.handle = open(os.path.join(
+            self.directory, 'shard-{}-{}.jsonl'.format(*shard)), 'a')
+
+    def deliver(self, digest):
+        self.handle.write(json.dumps(digest, sort_keys=True) + '\n')
+
+    def flush(self):
+        if self.handle:
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+
+    def close(self):
+        if self.handle:
+            self.flush()
+            self.handle.close()
+            self.handle = None
+
+
+@sink('smtp')
+class SmtpSink(Sink):
+    """Sends each digest as a plain text email over one SMTP connection
+    per shard. Users have no email address yet, recipients are made from
+    NOTIFY_RECIPIENT, e.g. user{user_id}@example.com."""
+
+    def __init__(self, address=None):
+        host, _, port = (address or 'localhost:25').partition(':')
+        self.host = host
+        self.port = int(port or 25)
+        self.sender = os.environ.get('NOTIFY_SENDER', 'myfridge@localhost')
+        self.recipient = os.environ.get('NOTIFY_RECIPIENT',
+                                        'user{user_id}@localhost')
+        self.connection = None
+
+    def open(self, shard):
+        self.connection = smtplib.SMTP(self.host, self.port, timeout=30)
+
+    def deliver(self, digest):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = self.recipient.format(**digest)
+        message['Subject'] = 'Your fridge today'
+        lines = ['Hi {},'.format(digest['first_name'] or 'there'), '']
+        if digest['expiring']:
+            lines.append('Use these soon:')
+            lines.extend('  - ' + item['name'] for item in digest['expiring'])
+        if digest['restock']:
+            lines.append('Running low:')
+            lines.extend('  - ' + item['name'] for item in digest['restock'])
+        message.set_content('\n'.join(lines) + '\n')
+        self.connection.send_message(message)
+
+    def close(self):
+        if self.connection:
+            self.connection.quit()
+            self.connection = None
+
+
+"""
+build(spec)
+    creates the sink described by a command line spec
+
+    Keyword arguments:
+    spec -- "null", "file:/var/spool/digests", "smtp:localhost:1025" or
+        "package.module:factory"
+    Return: a Sink
+"""
+build = _sinks.build
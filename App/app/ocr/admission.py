@@ -0,0 +1,227 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+'''
+OCR admission control
+
+    Receipt OCR is slow and bounded by Vision, so uploads are admitted
+    here before any page is sent off:
+
+    1. a per-user token bucket caps how often one user may scan, an
+       empty bucket is a 429 with the time until the next token
+    2. at most MAX_CONCURRENT uploads are OCRed at once per worker, up
+       to MAX_QUEUE more wait their turn for at most MAX_WAIT seconds
+    3. anything past that is a 503 with a Retry-After estimated from the
+       recent OCR time, instead of piling up in front of the routes that
+       share the worker
+
+    Limits are per process, a gunicorn deployment admits workers times
+    MAX_CONCURRENT uploads in total. Uploads rejected with a 503 keep
+    their token.
+'''
+
+MAX_CONCURRENT = int(os.environ.get('OCR_MAX_CONCURRENT', 8))
+MAX_QUEUE = int(os.environ.get('OCR_MAX_QUEUE', 32))
+MAX_WAIT = float(os.environ.get('OCR_MAX_WAIT', 10))
+# Sustained uploads per user per minute, and how many may come at once.
+USER_RATE = float(os.environ.get('OCR_USER_RATE', 6))
+USER_BURST = float(os.environ.get('OCR_USER_BURST', 10))
+MAX_BUCKETS = 10000
+
+QUEUE_DEPTH = Gauge('myfridge_ocr_queue_depth',
+                    'Uploads waiting for an OCR slot',
+                    multiprocess_mode='livesum')
+IN_FLIGHT = Gauge('myfridge_ocr_in_flight', 'Uploads being OCRed',
+                  multiprocess_mode='livesum')
+REJECTIONS = Counter('myfridge_ocr_rejections_total',
+                     'Uploads turned away by admission control', ['reason'])
+WAIT_SECONDS = Histogram('myfridge_ocr_wait_seconds',
+                         'Time an admitted upload waited for a slot',
+                         buckets=(.005, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+OCR_SECONDS = Histogram('myfridge_ocr_seconds',
+                        'Time an upload held its OCR slot',
+                        buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+
+"""
+Rejected Exception
+Raised when an upload is not admitted, status_code is 429 when the
+user's quota is spent and 503 when the OCR queue is full
+"""
+
+
+class Rejected(Exception):
+    def __init__(self, reason, status_code, retry_after):
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket(object):
+    """Refills rate tokens per second up to burst."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now, cost=1):
+        """Spends cost tokens, returns 0 or the seconds until they are
+        available."""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class Limiter(object):
+    """Bounded concurrency with a bounded wait queue and per-key quotas."""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE,
+                 max_wait=MAX_WAIT, user_rate=USER_RATE,
+                 user_burst=USER_BURST, clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.user_rate = user_rate / 60.0
+        self.user_burst = user_burst
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.buckets = OrderedDict()
+        # Exponentially weighted OCR time, seeds the Retry-After estimate.
+        self.service_time = 2.0
+        self.admitted = 0
+        self.rejected = {'quota': 0, 'queue_full': 0, 'timeout': 0}
+
+    def _reject(self, reason, status_code, retry_after):
+        self.rejected[reason] += 1
+        REJECTIONS.labels(reason).inc()
+        raise Rejected(reason, status_code, retry_after)
+
+    def _drain_time(self):
+        # Seconds until the uploads ahead of a new one have been served.
+        return self.service_time * (self.waiting + 1) / self.max_concurrent
+
+    def refund_quota(self, key):
+        """Gives back the token of an upload rejected after check_quota."""
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+
+    def check_quota(self, key, now):
+        if key is None or self.user_rate <= 0:
+            return
+        bucket = self.buckets.pop(key, None) or \
+            TokenBucket(self.user_rate, self.user_burst, now)
+        self.buckets[key] = bucket
+        if len(self.buckets) > MAX_BUCKETS:
+            self.buckets.popitem(last=False)
+        wait = bucket.take(now)
+        if wait:
+            self._reject('quota', 429, wait)
+
+    @contextmanager
+    def admit(self, key=None):
+        """Holds an OCR slot for the duration of the block.
+
+        Raises Rejected instead of waiting when key is over its quota,
+        when the queue is full or when no slot frees up in max_wait."""
+        with self.condition:
+            enqueued = self.clock()
+            # Capacity first, so an upload turned away for it does not
+            # spend a token of its user's quota.
+            if self.active >= self.max_concurrent and \
+                    self.waiting >= self.max_queue:
+                self._reject('queue_full', 503, self._drain_time())
+            self.check_quota(key, enqueued)
+            if self.active >= self.max_concurrent:
+                self.waiting += 1
+                QUEUE_DEPTH.inc()
+                try:
+                    deadline = enqueued + self.max_wait
+                    while self.active >= self.max_concurrent:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self.refund_quota(key)
+                            self._reject('timeout', 503, self._drain_time())
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    QUEUE_DEPTH.dec()
+                    if self.active < self.max_concurrent:
+                        # Pass on a wakeup this waiter may have consumed.
+                        self.condition.notify()
+            self.active += 1
+            self.admitted += 1
+            IN_FLIGHT.inc()
+        started = self.clock()
+        WAIT_SECONDS.observe(started - enqueued)
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - started
+            OCR_SECONDS.observe(elapsed)
+            with self.condition:
+                self.active -= 1
+                self.service_time += 0.2 * (elapsed - self.service_time)
+                IN_FLIGHT.dec()
+                self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'service_time_s': round(self.service_time, 3),
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def limiter():
+    # Created on first use so that under gevent the condition is built
+    # after the worker has monkey patched threading.
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = Limiter()
+    return _limiter
+
+
+def reset_limiter(**options):
+    global _limiter
+    with _limiter_lock:
+        _limiter = Limiter(**options) if options else None
+
+
+""" admit(key)
+Waits for an OCR slot, see Limiter.admit
+
+    @INPUTS
+        key: who the upload is charged to, a user id or client address
+
+    @RAISES:
+        Rejected: 429 over quota, 503 queue full or wait timed out
+"""
+
+
+def admit(key=None):
+    return limiter().admit(key)
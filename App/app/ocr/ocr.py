@@ -0,0 +1,78 @@
+import threading
+
+from google.cloud import vision
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+""" get_client()
+Returns the process wide Vision client
+
+    The client holds a gRPC channel, creating one per request pays a TLS
+    handshake every time. The channel is safe to share between threads
+    and, once grpc is initialised for gevent, between greenlets.
+
+    @RETURNS: vision.ImageAnnotatorClient
+"""
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = vision.ImageAnnotatorClient()
+    return _client
+
+
+""" reset_client()
+Drops the cached client, used after fork so children open their own
+channel instead of sharing the parent's socket.
+"""
+
+
+def reset_client():
+    global _client
+    _client = None
+
+
+""" annotate(content)
+Runs Vision text detection on an image
+
+    @INPUTS
+        content: image bytes
+
+    @RETURNS: list of text annotations, the first one holds the full text
+
+    @RAISES:
+        Exception: the Vision API returned an error
+"""
+
+
+def annotate(content):
+    image = vision.types.Image(content=content)
+
+    response = get_client().text_detection(image=image)
+    if response.error.message:
+        raise Exception(
+            '{}\nFor more info on error messages, check: '
+            'https://cloud.google.com/apis/design/errors'.format(
+                response.error.message))
+    return response.text_annotations
+
+
+""" read_text(content)
+Full text of an image, one printed line per line
+
+    @INPUTS
+        content: image bytes
+
+    @RETURNS: string, empty when no text was found
+"""
+
+
+def read_text(content):
+    texts = annotate(content)
+    return texts[0].description if texts else ''
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import re
+
+
+'''
+Receipt line item parsing
+
+    Turns the raw text Vision reads off a grocery receipt into line items
+    of the form {'name', 'quantity', 'weight', 'price'}. Totals, taxes,
+    payment and store header lines are dropped.
+'''
+
+_PRICE = re.compile(r'\s+\$?(-?\d{1,5}[.,]\d{2})\s*[A-Z*]{0,2}\s*$')
+_LEADING_QUANTITY = re.compile(
+    r'^(\d{1,3})\s*(?:x|@|\*)\s+(?:\$?\d+[.,]\d{2}\s+)?', re.IGNORECASE)
+_TRAILING_QUANTITY = re.compile(r'\s+(\d{1,3})\s*(?:x|@)\s*\$?\d+[.,]\d{2}$',
+                                re.IGNORECASE)
+_WEIGHT = re.compile(r'\b(\d+(?:[.,]\d+)?\s?(?:ml|l|g|kg|oz|lb|lbs|pk|ct))\b',
+                     re.IGNORECASE)
+_SKIP = re.compile(
+    r'\b(sub\s*total|total|tax|hst|gst|pst|vat|change|cash|visa|'
+    r'mastercard|debit|credit|balance|tender|savings|discount|coupon|'
+    r'points|thank|receipt|invoice|tel|phone|www)\b', re.IGNORECASE)
+_NO_LETTERS = re.compile(r'^[^A-Za-z]*$')
+
+
+"""
+parse_line_items(text)
+    extracts purchased items from receipt text
+
+    Keyword arguments:
+    text -- full OCR text of the receipt, one printed line per line
+    Return: list of dicts with name, quantity, weight and price
+"""
+def parse_line_items(text):
+    items = []
+    for line in (text or '').splitlines():
+        line = ' '.join(line.split())
+        price = _PRICE.search(line)
+        if not price:
+            continue
+        name = line[:price.start()]
+        if _SKIP.search(name) or _NO_LETTERS.match(name):
+            continue
+
+        quantity = 1
+        match = _LEADING_QUANTITY.match(name) or _TRAILING_QUANTITY.search(name)
+        if match:
+            quantity = int(match.group(1))
+            name = name[:match.start()] + name[match.end():]
+
+        weight = _WEIGHT.search(name)
+        name = ' '.join(name.split()).strip(' -*')
+        if not name:
+            continue
+        items.append({
+            'name': name,
+            'quantity': quantity,
+            'weight': weight.group(1).replace(' ', '') if weight else None,
+            'price': float(price.group(1).replace(',', '.')),
+        })
+    return items
+
+
+"""
+receipt_hash(content)
+    identity of a receipt for idempotent ingestion: the SHA-256 of the
+    uploaded image bytes, of the page hashes of a multi-file upload in
+    upload order, or of the canonical JSON of its line items
+"""
+def receipt_hash(content):
+    if isinstance(content, list) and content and \
+            all(isinstance(part, bytes) for part in content):
+        if len(content) == 1:
+            return receipt_hash(content[0])
+        content = b''.join(hashlib.sha256(part).digest() for part in content)
+    if not isinstance(content, bytes):
+        content = json.dumps(content, sort_keys=True,
+                             separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,345 @@
+"""Opt-in request profiling.
+
+    Off unless PROFILE_DIR is set together with PROFILE_SECRET or
+    PROFILE_SAMPLE_RATE, in which case install() wraps the WSGI app.
+    When off nothing is wrapped and no SQL or OCR hook is registered, so
+    requests run exactly as without this module.
+
+    A request is profiled when
+        - it carries a valid X-Profile header, see sign(), or
+        - it is drawn by PROFILE_SAMPLE_RATE (0 to 1), limited to paths
+          starting with one of PROFILE_PATHS when that is set.
+
+    The request runs under cProfile while its SQL statements and OCR
+    pages are timed. NAME.prof (pstats, open with snakeviz or
+    python -m pstats) and NAME.json (request, SQL and OCR timings, top
+    functions) are written to PROFILE_DIR, which keeps only the newest
+    PROFILE_MAX_FILES profiles.
+
+    Signing a header for a path (from the App/ directory):
+        PROFILE_SECRET=... python -m app.profiling.profiler /products
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..ocr import pages
+
+
+HEADER = 'X-Profile'
+# A signed header is honoured until it expires, at most this far ahead.
+MAX_SIGNATURE_TTL = 3600
+MAX_FILES = 200
+TOP_FUNCTIONS = 30
+TOP_STATEMENTS = 50
+STATEMENT_CHARS = 500
+# The profile listing is itself never profiled.
+EXCLUDED_PATHS = ('/debug/profiles', '/metrics')
+
+# The recording of the request running on this thread (greenlet under
+# gevent workers), None when it is not profiled.
+_local = threading.local()
+# One profile at a time per process: cProfile hooks the interpreter, and
+# under gevent the greenlets of other requests would land in it too.
+_profiling = threading.Lock()
+
+
+"""
+sign(secret, path, ttl)
+    X-Profile header value asking for a profile of requests to path
+
+    Keyword arguments:
+    secret -- PROFILE_SECRET
+    path -- request path, without the query string
+    ttl -- seconds the value stays valid
+    Return: "EXPIRES.SIGNATURE"
+"""
+def sign(secret, path, ttl=300):
+    expires = int(time.time()) + ttl
+    return '{}.{}'.format(expires, _signature(secret, expires, path))
+
+
+def _signature(secret, expires, path):
+    return hmac.new(secret.encode('utf-8'),
+                    '{}:{}'.format(expires, path).encode('utf-8'),
+                    hashlib.sha256).hexdigest()
+
+
+"""
+verify(secret, value, path)
+    whether an X-Profile header value is a live signature for path
+"""
+def verify(secret, value, path):
+    if not secret or not value:
+        return False
+    expires, _, signature = value.partition('.')
+    try:
+        expires = int(expires)
+    except ValueError:
+        return False
+    if not time.time() <= expires <= time.time() + MAX_SIGNATURE_TTL:
+        return False
+    return hmac.compare_digest(signature,
+                               _signature(secret, expires, path))
+
+
+class Recording(object):
+    """SQL and OCR timings of one profiled request."""
+
+    def __init__(self):
+        self.statements = {}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.ocr = []
+
+    def add_statement(self, statement, seconds):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        statement = ' '.join(statement.split())[:STATEMENT_CHARS]
+        calls, total, longest = self.statements.get(statement, (0, 0.0, 0.0))
+        self.statements[statement] = (calls + 1, total + seconds,
+                                      max(longest, seconds))
+
+    def add_ocr(self, stage, page, seconds):
+        self.ocr.append({'stage': stage, 'page': page,
+                         'ms': round(seconds * 1000, 3)})
+
+    def summary(self):
+        statements = sorted(self.statements.items(),
+                            key=lambda item: item[1][1], reverse=True)
+        return {
+            'sql': {
+                'count': self.sql_count,
+                'total_ms': round(self.sql_seconds * 1000, 3),
+                'statements': [{
+                    'statement': statement,
+                    'calls': calls,
+                    'total_ms': round(total * 1000, 3),
+                    'max_ms': round(longest * 1000, 3),
+                } for statement, (calls, total, longest)
+                    in statements[:TOP_STATEMENTS]],
+            },
+            'ocr': self.ocr,
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if getattr(_local, 'recording', None) is not None:
+        conn.info.setdefault('profile_started', []).append(
+            time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    recording = getattr(_local, 'recording', None)
+    started = conn.info.get('profile_started')
+    if recording is not None and started:
+        recording.add_statement(statement,
+                                time.perf_counter() - started.pop())
+
+
+def _ocr_timing(stage, page, seconds):
+    recording = getattr(_local, 'recording', None)
+    if recording is not None:
+        recording.add_ocr(stage, page, seconds)
+
+
+def _top_functions(profile):
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [{
+        'function': '{}:{}({})'.format(*function),
+        'calls': calls,
+        'own_ms': round(own * 1000, 3),
+        'cumulative_ms': round(cumulative * 1000, 3),
+    } for function, (_, calls, own, cumulative, _) in rows[:TOP_FUNCTIONS]]
+
+
+class ProfilerMiddleware(object):
+    """WSGI middleware profiling signed or sampled requests."""
+
+    def __init__(self, wsgi_app, directory, secret=None, sample_rate=0.0,
+                 paths=(), max_files=MAX_FILES):
+        self.wsgi_app = wsgi_app
+        self.directory = os.path.abspath(directory)
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.paths = tuple(paths)
+        self.max_files = max_files
+        os.makedirs(self.directory, exist_ok=True)
+
+    def trigger(self, environ):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(EXCLUDED_PATHS):
+            return None
+        if verify(self.secret, environ.get('HTTP_X_PROFILE'), path):
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate and \
+                (not self.paths or path.startswith(self.paths)):
+            return 'sample'
+        return None
+
+    def __call__(self, environ, start_response):
+        trigger = self.trigger(environ)
+        if trigger is None or not _profiling.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self.profile(environ, start_response, trigger)
+        finally:
+            _profiling.release()
+
+    def profile(self, environ, start_response, trigger):
+        status = []
+
+        def capture(code, headers, exc_info=None):
+            status.append(code)
+            return start_response(code, headers, exc_info)
+
+        recording = _local.recording = Recording()
+        profile = cProfile.Profile()
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                # The body is produced inside the profile too, profiled
+                # responses are buffered instead of streamed.
+                response = self.wsgi_app(environ, capture)
+                try:
+                    body = list(response)
+                finally:
+                    if hasattr(response, 'close'):
+                        response.close()
+            finally:
+                profile.disable()
+        finally:
+            _local.recording = None
+        elapsed = time.perf_counter() - started
+
+        try:
+            self.save(profile, dict(
+                recording.summary(),
+                method=environ.get('REQUEST_METHOD'),
+                path=environ.get('PATH_INFO'),
+                query=environ.get('QUERY_STRING'),
+                status=status[0] if status else None,
+                trigger=trigger,
+                started_at=started_at.isoformat(),
+                total_ms=round(elapsed * 1000, 3)))
+        except Exception:
+            # A full disk must not fail the request being profiled.
+            print(sys.exc_info(), file=sys.stderr)
+        return body
+
+    def save(self, profile, report):
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', report['path']).strip('_')
+        # Names sort by time, so the oldest come first when rotating.
+        name = '{}-{}-{}-{}ms-{}'.format(
+            report['started_at'].replace(':', '').replace('-', '')[:15],
+            report['method'], slug or 'root', int(report['total_ms']),
+            uuid.uuid4().hex[:8])
+        report['name'] = name
+        report['top_functions'] = _top_functions(profile)
+        profile.dump_stats(os.path.join(self.directory, name + '.prof'))
+        with open(os.path.join(self.directory, name + '.json'), 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        self.rotate()
+        return name
+
+    def rotate(self):
+        names = sorted(entry[:-5] for entry in os.listdir(self.directory)
+                       if entry.endswith('.json'))
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            for extension in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except FileNotFoundError:
+                    # Another worker rotated it first.
+                    pass
+
+    def profiles(self):
+        """Reports of the stored profiles, newest first."""
+        reports = []
+        for entry in sorted(os.listdir(self.directory), reverse=True):
+            if not entry.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, entry)) as handle:
+                    report = json.load(handle)
+            except (FileNotFoundError, ValueError):
+                continue
+            reports.append({key: report.get(key) for key in (
+                'name', 'method', 'path', 'status', 'trigger',
+                'started_at', 'total_ms')})
+            reports[-1]['sql_count'] = report['sql']['count']
+            reports[-1]['sql_ms'] = report['sql']['total_ms']
+        return reports
+
+    def path_of(self, filename):
+        """Full path of a stored NAME.prof or NAME.json, None if there is
+        no such profile."""
+        if not re.match(r'^[\w.-]+\.(prof|json)$', filename) or \
+                filename.startswith('.'):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+
+"""
+install(app)
+    wraps app.wsgi_app in a ProfilerMiddleware when profiling is
+    configured
+
+    Keyword arguments:
+    app -- Flask application
+    Return: the ProfilerMiddleware, or None when profiling is off
+"""
+def install(app):
+    directory = os.environ.get('PROFILE_DIR')
+    secret = os.environ.get('PROFILE_SECRET')
+    sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    if not directory or not (secret or sample_rate):
+        return None
+    paths = [path for path in
+             os.environ.get('PROFILE_PATHS', '').split(',') if path]
+    profiler = ProfilerMiddleware(
+        app.wsgi_app, directory, secret, sample_rate, paths,
+        int(os.environ.get('PROFILE_MAX_FILES', MAX_FILES)))
+    app.wsgi_app = profiler
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    if _ocr_timing not in pages.timing_hooks:
+        pages.timing_hooks.append(_ocr_timing)
+    return profiler
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    secret = os.environ.get('PROFILE_SECRET')
+    if not secret or len(argv) not in (1, 2):
+        print('usage: PROFILE_SECRET=... python -m app.profiling.profiler '
+              'PATH [TTL]', file=sys.stderr)
+        return 2
+    ttl = min(int(argv[1]), MAX_SIGNATURE_TTL) if len(argv) == 2 else 300
+    print('{}: {}'.format(HEADER, sign(secret, argv[0], ttl)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
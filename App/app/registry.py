@@ -0,0 +1,35 @@
+import importlib
+
+
+'''
+Named factories
+
+    Parts chosen on a command line, the outbox consumer's sinks and the
+    notifier's digest sinks, register a factory under a name and are
+    built from a spec of NAME or NAME:ARGUMENT, or of module:factory for
+    factories living outside the registering module.
+'''
+
+
+class Registry(object):
+    """Factories by name, each called with the spec's argument or None."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.factories = {}
+
+    def register(self, name):
+        """Decorator registering factory(argument) under name."""
+        def register(factory):
+            self.factories[name] = factory
+            return factory
+        return register
+
+    def build(self, spec):
+        """Creates what spec names, raises ValueError for unknown names."""
+        name, _, argument = spec.partition(':')
+        if name in self.factories:
+            return self.factories[name](argument or None)
+        if '.' in name and argument:
+            return getattr(importlib.import_module(name), argument)()
+        raise ValueError('unknown {} {!r}'.format(self.kind, spec))
@@ -0,0 +1,252 @@
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import text
+
+from ..database.models import RestockPrediction
+
+
+'''
+Restock prediction
+
+    A purchase is a product row linked to a user, identified across
+    purchases by its catalog id. For each (user, catalog item) bought on
+    at least MIN_PURCHASES distinct days, the typical gap between
+    purchases is the consumption interval and last purchase plus that
+    interval is when the user runs out.
+
+    The job reads purchase history one range of user ids at a time as
+    integer columns, never as ORM objects, groups and reduces each range
+    with NumPy sorts and bincounts instead of per-row Python, and swaps
+    the range's rows in restock_predictions in one transaction so the API
+    always serves a complete set.
+'''
+
+DAY = 86400
+MIN_PURCHASES = 2
+# Gaps longer than this are a break in buying, not consumption.
+MAX_INTERVAL_DAYS = 180
+# Predictions this many intervals past their runout are dropped, the
+# user has most likely stopped buying the item.
+STALE_INTERVALS = 3
+USERS_PER_CHUNK = 50000
+FETCH_ROWS = 100000
+INSERT_ROWS = 10000
+
+COLUMNS = ('user_id', 'catalog_id', 'purchases', 'interval_days',
+           'interval_std_days', 'last_purchased', 'runout_at')
+
+
+"""
+load_history(connection, first_user, last_user)
+    purchase history of a range of users as three int64 arrays, archived
+    purchases included
+
+    Keyword arguments:
+    connection -- SQLAlchemy connection
+    first_user, last_user -- inclusive user id range
+    Return: (user_ids, catalog_ids, dates), dates in epoch seconds
+"""
+def load_history(connection, first_user, last_user):
+    # Archived purchases are still purchases, older ones are moved to
+    # the archive tables by database.archive.
+    select = ('SELECT l.user_id, p.catalog_id, p.date_purchased '
+              'FROM {links} l JOIN {products} p ON p.id = l.product_id '
+              'WHERE l.user_id BETWEEN :first_user AND :last_user '
+              'AND p.catalog_id IS NOT NULL '
+              'AND p.date_purchased IS NOT NULL ')
+    result = connection.execution_options(stream_results=True).execute(text(
+        select.format(products='products', links='user_products') +
+        'UNION ALL ' +
+        select.format(products='products_archive',
+                      links='user_products_archive')),
+        {'first_user': first_user, 'last_user': last_user})
+    # Plain tuples straight off the DBAPI cursor, SQLAlchemy's row
+    # objects would cost more than the arithmetic done on them.
+    cursor = result.cursor
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 3))
+    result.close()
+    if not chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    history = np.concatenate(chunks)
+    return history[:, 0], history[:, 1], history[:, 2]
+
+
+"""
+estimate(user_ids, catalog_ids, dates, now)
+    consumption interval and runout time per (user, catalog item)
+
+    Keyword arguments:
+    user_ids, catalog_ids, dates -- equal length int64 arrays, one entry
+        per purchase, in any order
+    now -- epoch seconds the predictions are made at
+    Return: dict of COLUMNS to equal length arrays, one entry per
+        predicted (user, catalog item)
+"""
+def estimate(user_ids, catalog_ids, dates, now):
+    if not len(user_ids):
+        return {column: np.empty(0, dtype=np.int64) for column in COLUMNS}
+    days = dates // DAY
+    order = np.lexsort((days, catalog_ids, user_ids))
+    users, items, days = user_ids[order], catalog_ids[order], days[order]
+
+    # Several purchases of an item on one day are one shopping trip.
+    same_item = np.zeros(len(users), dtype=bool)
+    same_item[1:] = (users[1:] == users[:-1]) & (items[1:] == items[:-1])
+    trip = np.ones(len(users), dtype=bool)
+    trip[1:] = ~same_item[1:] | (days[1:] != days[:-1])
+    users, items, days = users[trip], items[trip], days[trip]
+    same_item = same_item[trip]
+
+    group = np.cumsum(~same_item) - 1
+    groups = int(group[-1]) + 1
+    purchases = np.bincount(group, minlength=groups)
+    last = np.flatnonzero(np.append(~same_item[1:], True))
+
+    # Gap i is between purchases i and i + 1 of the same group.
+    gaps = np.diff(days).astype(np.float64)
+    within = same_item[1:]
+    gap_group = group[1:][within]
+    gaps = np.clip(gaps[within], 1, MAX_INTERVAL_DAYS)
+    counts = np.bincount(gap_group, minlength=groups)
+    sums = np.bincount(gap_group, weights=gaps, minlength=groups)
+    squares = np.bincount(gap_group, weights=gaps * gaps, minlength=groups)
+
+    keep = purchases >= MIN_PURCHASES
+    mean = np.zeros(groups)
+    std = np.zeros(groups)
+    mean[keep] = sums[keep] / counts[keep]
+    std[keep] = np.sqrt(np.maximum(
+        squares[keep] / counts[keep] - mean[keep] ** 2, 0))
+    last_day = days[last]
+    runout_day = last_day + mean
+    keep &= runout_day + STALE_INTERVALS * mean >= now / DAY
+
+    return {
+        'user_id': users[last][keep],
+        'catalog_id': items[last][keep],
+        'purchases': purchases[keep],
+        'interval_days': np.round(mean[keep], 2),
+        'interval_std_days': np.round(std[keep], 2),
+        'last_purchased': last_day[keep] * DAY,
+        'runout_at': np.rint(runout_day[keep] * DAY).astype(np.int64),
+    }
+
+
+"""
+write_predictions(connection, first_user, last_user, predictions,
+                  computed_at)
+    replaces the predictions of a range of users with the output of
+    estimate(), INSERT_ROWS rows per executemany
+
+    Runs in the connection's transaction and does not commit.
+"""
+def write_predictions(connection, first_user, last_user, predictions,
+                      computed_at):
+    connection.execute(text(
+        'DELETE FROM restock_predictions '
+        'WHERE user_id BETWEEN :first_user AND :last_user'),
+        {'first_user': first_user, 'last_user': last_user})
+    columns = [predictions[column].tolist() for column in COLUMNS]
+    rows = [dict(zip(COLUMNS, row), computed_at=computed_at)
+            for row in zip(*columns)]
+    # A Core insert(), which psycopg2's executemany_mode='values' turns
+    # into multi-row VALUES statements.
+    statement = RestockPrediction.__table__.insert()
+    for start in range(0, len(rows), INSERT_ROWS):
+        connection.execute(statement, rows[start:start + INSERT_ROWS])
+    return len(rows)
+
+
+"""
+run(engine, users_per_chunk, now)
+    recomputes every user's restock predictions
+
+    Keyword arguments:
+    engine -- database to read history from and write predictions to
+    users_per_chunk -- user id range processed per transaction
+    now -- epoch seconds to predict from, the current time if None
+    Return: dict with counts and per stage seconds
+"""
+def run(engine, users_per_chunk=USERS_PER_CHUNK, now=None):
+    now = int(time.time()) if now is None else now
+    computed_at = datetime.utcnow()
+    timings = {'load_s': 0.0, 'estimate_s': 0.0, 'write_s': 0.0}
+    purchases = predictions = 0
+
+    with engine.connect() as connection:
+        low, high = connection.execute(text(
+            'SELECT min(user_id), max(user_id) FROM '
+            '(SELECT user_id FROM user_products UNION ALL '
+            'SELECT user_id FROM user_products_archive) links')).first()
+    with engine.begin() as connection:
+        # Users left without any purchases keep no predictions.
+        if low is None:
+            connection.execute(text('DELETE FROM restock_predictions'))
+        else:
+            connection.execute(text(
+                'DELETE FROM restock_predictions '
+                'WHERE user_id < :low OR user_id > :high'),
+                {'low': low, 'high': high})
+    if low is None:
+        low, high = 0, -1
+
+    for first_user in range(low, high + 1, users_per_chunk):
+        last_user = first_user + users_per_chunk - 1
+        with engine.begin() as connection:
+            started = time.perf_counter()
+            history = load_history(connection, first_user, last_user)
+            loaded = time.perf_counter()
+            result = estimate(*history, now=now)
+            estimated = time.perf_counter()
+            predictions += write_predictions(connection, first_user,
+                                             last_user, result, computed_at)
+            timings['write_s'] += time.perf_counter() - estimated
+        timings['load_s'] += loaded - started
+        timings['estimate_s'] += estimated - loaded
+        purchases += len(history[0])
+
+    return dict({stage: round(seconds, 3)
+                 for stage, seconds in timings.items()},
+                purchases=purchases, predictions=predictions)
+
+
+"""
+predictions_for(connection, user_id, within_days, now)
+    a user's items expected to run out within a number of days, soonest
+    first, with the catalog name of each
+
+    Keyword arguments:
+    connection -- connection or session to read with
+    user_id -- owner of the predictions
+    within_days -- horizon, items already overdue are included
+    now -- epoch seconds, the current time if None
+"""
+def predictions_for(connection, user_id, within_days, now=None):
+    now = int(time.time()) if now is None else now
+    result = connection.execute(text(
+        'SELECT restock_predictions.catalog_id, catalog.name, '
+        'restock_predictions.runout_at, restock_predictions.last_purchased, '
+        'restock_predictions.interval_days, restock_predictions.purchases '
+        'FROM restock_predictions '
+        'JOIN catalog ON catalog.id = restock_predictions.catalog_id '
+        'WHERE restock_predictions.user_id = :user_id '
+        'AND restock_predictions.runout_at <= :until '
+        'ORDER BY restock_predictions.runout_at'),
+        {'user_id': user_id, 'until': now + within_days * DAY})
+    return [{
+        'catalog_id': catalog_id,
+        'name': name,
+        'runout_at': runout_at,
+        'last_purchased': last_purchased,
+        'interval_days': interval_days,
+        'purchases': purchases,
+    } for catalog_id, name, runout_at, last_purchased, interval_days,
+        purchases in result]
@@ -0,0 +1,170 @@
+import sys
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from heapq import nsmallest
+
+from sqlalchemy import select
+
+from ..database.models import db, Product
+from ..database import listeners
+
+
+'''
+Product name autocomplete
+
+    Suggestions come from an in-process prefix index over Product.name:
+    a sorted array of distinct lower-cased names searched with bisect,
+    ranked by how many products carry each name. It is built once per
+    process on first use and then updated incrementally from the write
+    listeners, never rebuilt. Each gunicorn worker keeps its own copy,
+    so a worker sees another worker's writes only after it restarts.
+'''
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Prefixes matching more names than this have their top MAX_LIMIT
+# results cached until a write touches a name under them.
+CACHE_MIN_MATCHES = 256
+
+
+class PrefixIndex(object):
+    """Frequency-ranked prefix index over a multiset of names."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.keys = []
+        self.counts = defaultdict(int)
+        self.display = {}
+        self.name_by_id = {}
+        self.top_cache = {}
+
+    def load(self, rows):
+        """Bulk-loads (row_id, name) pairs into an empty index, sorting
+        once instead of inserting each key."""
+        with self.lock:
+            for row_id, name in rows:
+                if not name or not name.strip():
+                    continue
+                name = ' '.join(name.split())
+                key = name.lower()
+                self.name_by_id[row_id] = key
+                self.counts[key] += 1
+                self.display[key] = name
+            self.keys = sorted(self.counts)
+            self.top_cache.clear()
+
+    def set(self, row_id, name):
+        with self.lock:
+            self.remove(row_id)
+            if not name or not name.strip():
+                return
+            name = ' '.join(name.split())
+            key = name.lower()
+            self.name_by_id[row_id] = key
+            if self.counts[key] == 0:
+                insort(self.keys, key)
+            self.counts[key] += 1
+            self.display[key] = name
+            self._invalidate(key)
+
+    def remove(self, row_id):
+        with self.lock:
+            key = self.name_by_id.pop(row_id, None)
+            if key is None:
+                return
+            self.counts[key] -= 1
+            if self.counts[key] == 0:
+                del self.counts[key]
+                del self.display[key]
+                del self.keys[bisect_left(self.keys, key)]
+            self._invalidate(key)
+
+    def _invalidate(self, key):
+        if self.top_cache:
+            for length in range(len(key) + 1):
+                self.top_cache.pop(key[:length], None)
+
+    def lookup(self, prefix, limit=DEFAULT_LIMIT):
+        """Returns up to limit names starting with prefix, most frequent
+        first, ties broken alphabetically."""
+        prefix = ' '.join(prefix.split()).lower()
+        with self.lock:
+            if prefix in self.top_cache:
+                return self.top_cache[prefix][:limit]
+
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+            cached = end - start > CACHE_MIN_MATCHES
+            top = nsmallest(max(limit, MAX_LIMIT if cached else limit),
+                            self.keys[start:end],
+                            key=lambda key: (-self.counts[key], key))
+            top = [self.display[key] for key in top]
+            if cached:
+                self.top_cache[prefix] = top
+            return top[:limit]
+
+    def memory_bytes(self):
+        """Approximate footprint of the index structures."""
+        with self.lock:
+            size = sys.getsizeof(self.keys) + sys.getsizeof(self.counts) + \
+                sys.getsizeof(self.display) + sys.getsizeof(self.name_by_id)
+            size += sum(sys.getsizeof(key) for key in self.keys)
+            size += sum(sys.getsizeof(name) for name in self.display.values())
+            size += sum(sys.getsizeof(row_id) for row_id in self.name_by_id)
+            return size
+
+    def __len__(self):
+        return len(self.keys)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def product_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PrefixIndex()
+                table = Product.__table__
+                index.load(db.session.execute(
+                    select([table.c.id, table.c.name])))
+                _index = index
+    return _index
+
+
+def reset_product_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+@listeners.on_write('products')
+def index_products(rows):
+    if _index is not None:
+        for row in rows:
+            _index.set(row['id'], row.get('name'))
+
+
+@listeners.on_delete('products')
+def unindex_products(ids):
+    if _index is not None:
+        for row_id in ids:
+            _index.remove(row_id)
+
+
+"""
+suggest(prefix, limit)
+    product names previously entered that start with prefix
+
+    Keyword arguments:
+    prefix -- text typed so far
+    limit -- maximum number of suggestions
+    Return: list of names, most common first
+"""
+def suggest(prefix, limit=DEFAULT_LIMIT):
+    if not prefix or not prefix.strip():
+        return []
+    return product_index().lookup(prefix, min(limit, MAX_LIMIT))
@@ -0,0 +1,285 @@
+import re
+import threading
+from collections import Counter, defaultdict
+
+from sqlalchemy import text
+
+from ..database.models import db, User, Product
+from ..database import listeners
+
+
+'''
+Product and user search
+
+    On PostgreSQL searches are answered from the pg_trgm and tsvector GIN
+    indexes created by migration 3c1f8e5b2a7d. Any other database (SQLite
+    in tests and benchmarks) falls back to an in-process trigram index
+    with the same matching rules:
+
+    - every word of the term appears in the text (tsvector match),
+    - the term is a case-insensitive substring of the text (ILIKE), or
+    - trigram similarity with the text reaches SIMILARITY_THRESHOLD (%).
+
+    Results are ordered by similarity, best first.
+'''
+
+SIMILARITY_THRESHOLD = 0.3
+DEFAULT_LIMIT = 20
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+# Text searched for each table, as SQL and as a Python function of a row.
+SEARCHABLE = {
+    'products': {
+        'model': Product,
+        'sql': "coalesce(name, '')",
+        'text': lambda row: row.get('name') or '',
+    },
+    'users': {
+        'model': User,
+        'sql': "(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))",
+        'text': lambda row: '{} {}'.format(row.get('first_name') or '',
+                                           row.get('last_name') or ''),
+    },
+}
+
+
+def words(value):
+    return _WORD.findall(value.lower())
+
+
+def trigrams(value):
+    """Trigram set of value, computed the way pg_trgm does: each word is
+    lower-cased and padded with two spaces in front and one behind."""
+    grams = set()
+    for word in words(value):
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def substring_trigrams(value):
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class TrigramIndex(object):
+    """In-memory inverted index from trigrams to distinct texts.
+
+    Rows sharing a text (the same product bought by many users) are
+    indexed once. Each text has two posting lists: padded word trigrams
+    for similarity, and raw trigrams of the whole text which narrow
+    ILIKE-style substring matches down to a handful of candidates.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.text_by_id = {}
+        self.ids_by_text = defaultdict(set)
+        self.sizes = {}
+        self.word_postings = defaultdict(set)
+        self.substring_postings = defaultdict(set)
+
+    def add(self, row_id, value):
+        with self.lock:
+            self.remove(row_id)
+            value = value.lower()
+            self.text_by_id[row_id] = value
+            if not self.ids_by_text[value]:
+                grams = trigrams(value)
+                self.sizes[value] = len(grams)
+                for gram in grams:
+                    self.word_postings[gram].add(value)
+                for gram in substring_trigrams(value):
+                    self.substring_postings[gram].add(value)
+            self.ids_by_text[value].add(row_id)
+
+    def remove(self, row_id):
+        with self.lock:
+            value = self.text_by_id.pop(row_id, None)
+            if value is None:
+                return
+            ids = self.ids_by_text[value]
+            ids.discard(row_id)
+            if ids:
+                return
+            del self.ids_by_text[value]
+            del self.sizes[value]
+            for gram in trigrams(value):
+                self._discard(self.word_postings, gram, value)
+            for gram in substring_trigrams(value):
+                self._discard(self.substring_postings, gram, value)
+
+    @staticmethod
+    def _discard(postings, gram, value):
+        values = postings.get(gram)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del postings[gram]
+
+    def _substring_candidates(self, term):
+        grams = substring_trigrams(term)
+        if not grams:
+            # Too short for trigrams, pg_trgm scans here as well.
+            return set(self.sizes)
+        if any(gram not in self.substring_postings for gram in grams):
+            return set()
+        lists = sorted((self.substring_postings[gram] for gram in grams),
+                       key=len)
+        candidates = set(lists[0])
+        for values in lists[1:]:
+            candidates &= values
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, term, limit=DEFAULT_LIMIT):
+        """Returns [(row_id, similarity)] best first."""
+        term = term.lower().strip()
+        if not term:
+            return []
+        query_grams = trigrams(term)
+        query_words = set(words(term))
+        with self.lock:
+            shared = Counter()
+            for gram in query_grams:
+                for value in self.word_postings.get(gram, ()):
+                    shared[value] += 1
+
+            scores = {}
+            for value, count in shared.items():
+                scores[value] = count / float(
+                    len(query_grams) + self.sizes[value] - count)
+            matched = {value for value, score in scores.items()
+                       if score >= SIMILARITY_THRESHOLD}
+            matched.update(value for value in self._substring_candidates(term)
+                           if term in value)
+            if query_words:
+                matched.update(value for value in shared
+                               if query_words <= set(words(value)))
+
+            ranked = []
+            for value in sorted(matched, key=lambda value: (
+                    -scores.get(value, 0.0), min(self.ids_by_text[value]))):
+                for row_id in sorted(self.ids_by_text[value]):
+                    ranked.append((row_id, scores.get(value, 0.0)))
+                    if len(ranked) == limit:
+                        return ranked
+        return ranked
+
+    def __len__(self):
+        return len(self.text_by_id)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def fallback_index(table):
+    """Returns the in-process index for table, building it on first use.
+    Afterwards it is kept current by the write listeners below."""
+    index = _indexes.get(table)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(table)
+            if index is None:
+                index = _build(table)
+                _indexes[table] = index
+    return index
+
+
+def _build(table):
+    searchable = SEARCHABLE[table]
+    model = searchable['model']
+    index = TrigramIndex()
+    columns = list(model.__table__.columns)
+    result = db.session.execute(model.__table__.select())
+    for row in result:
+        row = dict(zip((column.name for column in columns), row))
+        index.add(row['id'], searchable['text'](row))
+    return index
+
+
+def reset_fallback_indexes():
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def _register(table):
+    @listeners.on_write(table)
+    def index_rows(rows):
+        index = _indexes.get(table)
+        if index is not None:
+            for row in rows:
+                index.add(row['id'], SEARCHABLE[table]['text'](row))
+
+    @listeners.on_delete(table)
+    def unindex_rows(ids):
+        index = _indexes.get(table)
+        if index is not None:
+            for row_id in ids:
+                index.remove(row_id)
+
+
+for _table in SEARCHABLE:
+    _register(_table)
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _postgres_search(table, term, limit):
+    document = SEARCHABLE[table]['sql']
+    statement = text(
+        "SELECT id, similarity({doc}, :term) AS score "
+        "FROM {table} "
+        "WHERE to_tsvector('simple', {doc}) @@ plainto_tsquery('simple', :term) "
+        "OR {doc} ILIKE :pattern ESCAPE '\\' "
+        "OR {doc} % :term "
+        "ORDER BY similarity({doc}, :term) "
+        "+ ts_rank(to_tsvector('simple', {doc}), "
+        "plainto_tsquery('simple', :term)) DESC, id "
+        "LIMIT :limit".format(doc=document, table=table))
+    result = db.session.execute(statement, {
+        'term': term,
+        'pattern': '%' + _escape_like(term) + '%',
+        'limit': limit,
+    })
+    return [(row.id, row.score) for row in result]
+
+
+"""
+search(table, term, limit)
+    finds rows of 'products' or 'users' matching term
+
+    Keyword arguments:
+    table -- 'products' or 'users'
+    term -- search text as typed by the user
+    limit -- maximum number of results
+    Return: list of model instances, best match first
+"""
+def search(table, term, limit=DEFAULT_LIMIT):
+    term = (term or '').strip()
+    if not term:
+        return []
+    if db.session.get_bind().dialect.name == 'postgresql':
+        ranked = _postgres_search(table, term, limit)
+    else:
+        ranked = fallback_index(table).search(term, limit)
+    if not ranked:
+        return []
+
+    model = SEARCHABLE[table]['model']
+    order = {row_id: position for position, (row_id, _) in enumerate(ranked)}
+    rows = model.query.filter(model.id.in_(list(order))).all()
+    return sorted(rows, key=lambda row: order[row.id])
+
+
+def search_products(term, limit=DEFAULT_LIMIT):
+    return search('products', term, limit)
+
+
+def search_users(term, limit=DEFAULT_LIMIT):
+    return search('users', term, limit)
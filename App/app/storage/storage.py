@@ -0,0 +1,218 @@
+import hashlib
+import importlib
+import io
+import os
+import re
+import tempfile
+import threading
+
+from PIL import Image, ImageOps
+
+
+'''
+Blob storage
+
+    Uploaded receipt images are stored once per distinct content, named
+    by the SHA-256 of their bytes, so identical uploads share a blob and
+    different uploads never overwrite each other whatever their file
+    names. Derived blobs such as thumbnails are named KEY-VARIANT after
+    the blob they come from.
+
+    BLOB_STORE selects the backend:
+        local:/var/lib/myfridge/blobs -- LocalBlobStore (default, under
+            UPLOAD_FOLDER)
+        package.module:factory -- any other BlobStore, e.g. one backed by
+            an S3 compatible service
+'''
+
+THUMBNAIL_SIZES = (128, 256, 512)
+DEFAULT_THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 80
+
+_KEY = re.compile(r'^[0-9a-f]{64}(-[a-z0-9]+)?$')
+
+_store = None
+_store_lock = threading.Lock()
+
+# File signatures of the formats receipts are uploaded in.
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'%PDF-', 'application/pdf'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class BlobNotFound(Exception):
+    """Raised when a key names no stored blob."""
+
+
+def content_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_key(key):
+    return bool(_KEY.match(key))
+
+
+def content_type(data):
+    for signature, mimetype in _SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+class BlobStore(object):
+    """Interface of blob backends. Subclasses implement get, put_at and
+    exists; local_path lets files on local disk be served by the web
+    server instead of read through the application."""
+
+    def put(self, data):
+        """Stores data unless a blob with the same content exists,
+        returns its key."""
+        key = content_key(data)
+        if not self.exists(key):
+            self.put_at(key, data)
+        return key
+
+    def put_at(self, key, data):
+        raise NotImplementedError
+
+    def get(self, key):
+        """Bytes of a blob, raises BlobNotFound."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Path of the blob on local disk, None if it is not stored as a
+        local file."""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root, sharded as root/ab/cd/abcd... by the
+    first four hex digits of the key so no directory grows past 65536
+    entries."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, key):
+        if not is_key(key):
+            raise BlobNotFound(key)
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put_at(self, key, data):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and renamed so readers never see a partial blob,
+        # racing writers of one key write the same bytes.
+        descriptor, partial = tempfile.mkstemp(dir=directory, prefix='.')
+        try:
+            with os.fdopen(descriptor, 'wb') as handle:
+                handle.write(data)
+            os.chmod(partial, 0o644)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as handle:
+                return handle.read()
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+
+
+"""
+build(spec)
+    creates the blob store described by a BLOB_STORE value
+
+    Keyword arguments:
+    spec -- "local:/path/to/root" or "package.module:factory"
+    Return: a BlobStore
+"""
+def build(spec):
+    name, _, argument = spec.partition(':')
+    if name == 'local':
+        return LocalBlobStore(argument)
+    if '.' in name and argument:
+        return getattr(importlib.import_module(name), argument)()
+    raise ValueError('unknown blob store {!r}'.format(spec))
+
+
+def store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                default = os.path.join(os.path.dirname(os.path.dirname(
+                    os.path.abspath(__file__))), 'static/img/Receipts')
+                _store = build(os.environ.get('BLOB_STORE', 'local:' +
+                               os.environ.get('UPLOAD_FOLDER', default)))
+    return _store
+
+
+def set_store(blob_store):
+    global _store
+    _store = blob_store
+
+
+""" thumbnail(blob_store, key, size)
+Key of a JPEG thumbnail of an image blob, made and stored the first time
+it is asked for
+
+    @INPUTS
+        blob_store: BlobStore holding the image
+        key: key of the image
+        size: longest side in pixels, one of THUMBNAIL_SIZES
+
+    @RETURNS: key of the thumbnail blob
+
+    @RAISES:
+        BlobNotFound: no image under key
+        ValueError: size is not one of THUMBNAIL_SIZES
+"""
+
+
+def thumbnail(blob_store, key, size=DEFAULT_THUMBNAIL_SIZE):
+    if size not in THUMBNAIL_SIZES:
+        raise ValueError(size)
+    thumbnail_key = '{}-w{}'.format(key, size)
+    if blob_store.exists(thumbnail_key):
+        return thumbnail_key
+    data = blob_store.get(key)
+    if content_type(data) == 'application/pdf':
+        from ..ocr.pages import split_pages
+        data = split_pages([data])[0]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image.thumbnail((size, size))
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG',
+                              quality=THUMBNAIL_QUALITY, optimize=True)
+    blob_store.put_at(thumbnail_key, output.getvalue())
+    return thumbnail_key
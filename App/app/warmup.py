@@ -0,0 +1,85 @@
+import gc
+import sys
+import time
+
+from .auth import auth
+from .barcode import barcodes
+from .database.models import db
+from .search import autocomplete, search
+
+
+'''
+Preloading
+
+    With gunicorn's preload_app (PRELOAD=1, see gunicorn.conf.py) the app
+    is created once in the master and workers are forked from it. warm()
+    runs in the master just before the first fork and fills every
+    read-mostly structure there, so workers start with them already built
+    and share their memory pages copy-on-write instead of each loading
+    its own copy on its first requests:
+
+    - all Jinja templates, compiled
+    - the autocomplete index and, off PostgreSQL, the search indexes
+    - the barcode catalog mapping
+    - Auth0's signing keys
+
+    Database connections are closed afterwards, a connection must never
+    be shared by forked processes.
+'''
+
+
+def _timed(timings, name, fn, *args):
+    started = time.perf_counter()
+    try:
+        fn(*args)
+    except Exception:
+        # A cache that cannot be warmed is built by the first request
+        # instead, as without preloading.
+        print(sys.exc_info(), file=sys.stderr)
+        timings[name] = None
+        return
+    timings[name] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def compile_templates(app):
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+        except Exception:
+            print(name, sys.exc_info(), file=sys.stderr)
+
+
+def dispose_engines(app):
+    db.session.remove()
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+        db.get_engine(app, bind).dispose()
+
+
+"""
+warm(app)
+    builds the app's shared caches and closes its database connections,
+    to be called in the gunicorn master before workers are forked
+
+    Keyword arguments:
+    app -- Flask application
+    Return: dict of milliseconds per step, None for a step that failed
+"""
+def warm(app):
+    timings = {}
+    _timed(timings, 'templates_ms', compile_templates, app)
+    with app.app_context():
+        _timed(timings, 'autocomplete_ms', autocomplete.product_index)
+        if db.engine.dialect.name != 'postgresql':
+            for table in search.SEARCHABLE:
+                _timed(timings, 'search_{}_ms'.format(table),
+                       search.fallback_index, table)
+        _timed(timings, 'barcodes_ms', barcodes.index)
+        if auth.AUTH0_DOMAIN:
+            _timed(timings, 'jwks_ms', auth.get_jwks)
+        dispose_engines(app)
+    # Everything allocated so far lives as long as the process. Moving it
+    # out of the collector's generations keeps collections in the workers
+    # from writing to, and so copying, the pages it sits on.
+    gc.collect()
+    gc.freeze()
+    return timings
@@ -0,0 +1,87 @@
+"""Gunicorn settings for serving MyFridge in production.
+
+    Run from the App/ directory (gunicorn picks this file up by default):
+        gunicorn app.app:app
+
+    WORKER_CLASS selects the serving mode:
+        gevent (default) -- cooperative workers. Vision OCR calls, Auth0
+                            JWKS fetches and Postgres queries yield to
+                            other requests instead of blocking the worker.
+        sync             -- one request per worker process, the baseline.
+
+    PRELOAD=1 creates the app once in the master, warms its caches there
+    and forks workers that share them, see app.warmup.
+"""
+import multiprocessing
+import os
+
+
+bind = os.environ.get('BIND', '0.0.0.0:8080')
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+preload_app = os.environ.get('PRELOAD') == '1'
+
+if preload_app and worker_class == 'gevent':
+    # The app is imported by the master, which has to be patched before
+    # that import as the workers are patched after fork otherwise.
+    from gevent import monkey
+    monkey.patch_all()
+
+_cpus = multiprocessing.cpu_count()
+if worker_class == 'sync':
+    workers = int(os.environ.get('WEB_CONCURRENCY', 2 * _cpus + 1))
+    worker_connections = 1
+else:
+    # Cooperative workers are bound by CPU rather than by waiting, one
+    # per core is enough and each carries many concurrent requests.
+    workers = int(os.environ.get('WEB_CONCURRENCY', _cpus))
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 200))
+
+# Every in-flight request may hold a database connection while it waits
+# on OCR, so give each worker's pool enough room for a share of its
+# connections without exceeding Postgres' max_connections across workers.
+_db_connections = int(os.environ.get('DB_MAX_CONNECTIONS', 100))
+_per_worker = max(_db_connections // workers, 2)
+os.environ.setdefault('DB_POOL_SIZE',
+                      str(min(_per_worker // 2, worker_connections) or 1))
+os.environ.setdefault('DB_MAX_OVERFLOW',
+                      str(_per_worker - int(os.environ['DB_POOL_SIZE'])))
+
+# OCR round trips regularly take several seconds.
+timeout = int(os.environ.get('TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    """Warms the preloaded app in the master right before the first
+    workers are forked from it."""
+    if preload_app:
+        from app.app import app
+        from app.warmup import warm
+        server.log.info('Preloaded caches: %s', warm(app))
+
+
+def post_worker_init(worker):
+    """Finishes cooperative setup once gunicorn has monkey patched the
+    worker: psycopg2 and gRPC both bypass the patched socket module and
+    need their own gevent integration."""
+    if worker_class != 'gevent':
+        return
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+    from grpc.experimental import gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+    # A channel opened before init_gevent would still block.
+    from app.ocr.ocr import reset_client
+    reset_client()
+
+
+def child_exit(server, worker):
+    """Drops a dead worker's live gauges (OCR queue depth, in flight)
+    from the aggregated /metrics when running multiprocess."""
+    if os.environ.get('prometheus_multiproc_dir'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)